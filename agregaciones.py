@@ -0,0 +1,52 @@
+import pandas as pd
+
+# Nombre corto de cada producto para las columnas de las tablas
+PRODUCTOS = {
+    "ETANOL - ALCOHOL CARBURANTE": "Etanol",
+    "B 100": "B100",
+}
+
+
+def agregar_por(data, claves, columna_producto="PRODUCTO", columna_volumen="VOLUMEN_DESPACHADO", columna_conteo=None):
+    """
+    Calcular en una sola pasada la cantidad de despachos y el volumen por producto
+    para cualquier agrupación (proveedor, destino, año, mes, tipo de comprador...).
+    Sobre datos ya resumidos (el cubo), columna_conteo indica la columna con las cantidades.
+    """
+    claves = [claves] if isinstance(claves, str) else list(claves)
+    grupos = data.groupby(claves + [columna_producto], observed=True)
+    if columna_conteo is None:
+        agrupado = grupos[columna_volumen].agg(["size", "sum"])
+    else:
+        agrupado = grupos[[columna_conteo, columna_volumen]].sum().set_axis(["size", "sum"], axis=1)
+
+    por_producto = agrupado.unstack(columna_producto, fill_value=0)
+    por_producto = por_producto.reindex(columns=pd.MultiIndex.from_product([["size", "sum"], list(PRODUCTOS)]), fill_value=0)
+    conteos, volumenes = por_producto["size"], por_producto["sum"]
+
+    tabla = pd.DataFrame(index=por_producto.index)
+    tabla["Cantidad de Despachos"] = conteos.sum(axis=1)
+    for producto, nombre in PRODUCTOS.items():
+        tabla[f"Despachos {nombre}"] = conteos[producto].astype("int64")
+    for producto, nombre in PRODUCTOS.items():
+        tabla[f"Volumen de {nombre}"] = volumenes[producto].astype("float64")
+    return tabla.reset_index()
+
+
+def agregar_cubo(cubo, claves):
+    """
+    Cantidad de despachos y volumen por producto a partir del cubo de despachos
+    """
+    return agregar_por(cubo, claves, columna_volumen="VOLUMEN", columna_conteo="CANTIDAD")
+
+
+def tabla_municipios(cubo, municipios, columna_codigo):
+    """
+    Tabla numérica de despachos y volumen por producto de cada municipio
+    """
+    tabla = agregar_cubo(cubo, columna_codigo).merge(
+        municipios.rename(columns={"CODIGO_MUNICIPIO_DANE": columna_codigo}), on=columna_codigo
+    )
+    tabla = tabla.rename(columns={"DEPARTAMENTO": "Departamento", "MUNICIPIO": "Municipio"})
+    columnas = ["Departamento", "Municipio", "Cantidad de Despachos"] + [f"Volumen de {n}" for n in PRODUCTOS.values()]
+    return tabla.sort_values(["Departamento", "Municipio"])[columnas].reset_index(drop=True)
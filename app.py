@@ -1,35 +1,61 @@
+import hashlib
+import os
+
 import dash
-from dash import dcc, html, dash_table
+from dash import dcc, html, dash_table, Input, Output
+from dash.dash_table.Format import Format, Group, Scheme
 import plotly.express as px
 import plotly.graph_objects as go
+from flask import abort, g, jsonify, request, Response
 
 import pandas as pd
-import geopandas as gpd
-import folium
+
+from agregaciones import PRODUCTOS, agregar_cubo, tabla_municipios
+from artefactos import cargar_artefactos, MAPA_MUNICIPIOS, MAPA_DESPACHOS
+from indice import IndiceCubo
+from memoizacion import Memoizador, crear_cache
+from paginacion import consultar
+from estadisticas import LIMITE_EXACTO, resumen_exacto, resumen_aproximado
+from mapas import figura_municipios, figura_relaciones
+from grafo_flujos import GrafoFlujos, flujos_municipios
+from series import reducir
+from metricas import REGISTRO, Perfilador, exponer, medida, tramo
+from entrega import CACHE_INMUTABLE, comprimir, revalidable
+from exportacion import FORMATOS, lotes_despachos, lotes_tabla, serializar
 
 # 1️⃣ CARGA DE DATOS
-# Base de datos y Mapa de Colombia por municipios
-df = pd.read_csv("Productores_Productores_de_B100_y_Etanol_-_Alcohol_Carburante__AUTOMATIZADO__20250314.csv")
-gdf_m = gpd.read_file("Municipios_Interes.geojson")
+# Solo se leen los artefactos que construye `python artefactos.py` (el ETL no se repite al importar)
+artefactos = cargar_artefactos()
+cubo, municipios = artefactos["cubo"], artefactos["municipios"]
+indice = IndiceCubo(cubo, municipios)
+memoizar = Memoizador(crear_cache(), artefactos["version"])
 
 # 2️⃣ DESPACHOS
 # Tabla del total de despachos
-t_desp = pd.DataFrame({
-    "Producto": df["PRODUCTO"].value_counts().index,
-    "Cantidad": df["PRODUCTO"].value_counts().values,
-})
-t_desp
+def tabla_productos(data):
+    """
+    Cantidad de despachos por producto
+    """
+    conteo_producto = data.groupby("PRODUCTO", observed=True)["CANTIDAD"].sum().sort_values(ascending=False)
+    return pd.DataFrame({
+        "Producto": conteo_producto.index,
+        "Cantidad": conteo_producto.values,
+    })
+
+t_desp = tabla_productos(cubo)
 
 # Despachos por producto
-b100 = df[df["PRODUCTO"] == "B 100"]
-etanol = df[df["PRODUCTO"] == "ETANOL - ALCOHOL CARBURANTE"]
+b100 = cubo[cubo["PRODUCTO"] == "B 100"]
+etanol = cubo[cubo["PRODUCTO"] == "ETANOL - ALCOHOL CARBURANTE"]
 
-year = df.groupby("ANIO_DESPACHO").size().reset_index(name="Total Despachos")
-b100_d = b100.groupby("ANIO_DESPACHO").size().reset_index(name="Despachos B100")
-etanol_d = etanol.groupby("ANIO_DESPACHO").size().reset_index(name="Despachos Etanol")
+def tabla_anual(data):
+    """
+    Despachos totales y por producto de cada año
+    """
+    tabla = agregar_cubo(data, "ANIO_DESPACHO")[["ANIO_DESPACHO", "Cantidad de Despachos", "Despachos B100", "Despachos Etanol"]]
+    return tabla.rename(columns={"ANIO_DESPACHO": "Año", "Cantidad de Despachos": "Total Despachos"})
 
-table_desp = year.merge(b100_d, on="ANIO_DESPACHO", how="left").merge(etanol_d, on="ANIO_DESPACHO", how="left")
-table_desp = table_desp.rename(columns={"ANIO_DESPACHO": "Año"})
+table_desp = tabla_anual(cubo)
 
 
 # Gráfico despachos por año y mes de cada producto
@@ -38,7 +64,7 @@ def despachos(data, producto, color = "#A0C878"):
     Generar un gráfico de linea sobre la evolución mensual de despachos
     """
     nombre_columna = f"Despachos {producto}"
-    data_m = data.groupby(["ANIO_DESPACHO", "MES_DESPACHO"]).size().reset_index(name= nombre_columna)
+    data_m = data.groupby(["ANIO_DESPACHO", "MES_DESPACHO"])["CANTIDAD"].sum().reset_index(name= nombre_columna)
     fig = px.line(
         data_m,
         x="MES_DESPACHO", 
@@ -61,24 +87,76 @@ def despachos(data, producto, color = "#A0C878"):
 fig_b100 = despachos(b100, "B100")
 fig_etanol = despachos(etanol, "Etanol")
 
+# Series diarias de despachos, para ver la evolución por día, semana, mes o año
+series = artefactos["series"]
+FRECUENCIAS_DESPACHOS = {"mes_anio": "Mes por año", "dia": "Diaria", "semana": "Semanal", "mes": "Mensual", "anio": "Anual"}
+
+def serie_despachos(serie, producto, frecuencia, color = "#A0C878"):
+    """
+    Generar un gráfico de línea de la serie de despachos remuestreada; con ventanas largas
+    la serie se reduce con LTTB, así que la figura tiene a lo sumo MAX_PUNTOS puntos
+    """
+    puntos = reducir(serie)
+    fig = go.Figure(go.Scattergl(x=puntos.index, y=puntos.to_numpy(), mode="lines", line=dict(color=color), name=producto))
+    fig.update_layout(
+        title=dict(text=f"Evolución {FRECUENCIAS_DESPACHOS[frecuencia]} de Despachos de {producto}", font=dict(size=16, color=color)),
+        xaxis_title="Fecha",
+        yaxis_title="Despachos",
+        hovermode="x unified"
+    )
+    return fig
+
 
 
 # VOLUMEN|
-df.loc[df["VOLUMEN_DESPACHADO"] > 3.1e6, "VOLUMEN_DESPACHADO"] = pd.NA
-vol_e = df[df["PRODUCTO"] == "ETANOL - ALCOHOL CARBURANTE"]["VOLUMEN_DESPACHADO"]
-vol_b = df[df["PRODUCTO"] == "B 100"]["VOLUMEN_DESPACHADO"]
+# Los diagramas de caja se envían ya resumidos (tamaño constante, sin los volúmenes individuales)
+distribucion = artefactos["distribucion"]
 
-def volumen(data, producto, color):
+def resumen_volumen(nombre, anios=None):
+    """
+    Resumen del diagrama de caja de un producto: exacto con los volúmenes individuales si son pocos,
+    o aproximado con el histograma del cubo (que además permite elegir un rango de años)
+    """
+    volumenes = artefactos["volumenes"][nombre]
+    if anios is None and len(volumenes) <= LIMITE_EXACTO:
+        return resumen_exacto(volumenes)
+    producto = {nombre_producto: p for p, nombre_producto in PRODUCTOS.items()}[nombre]
+    en_distribucion = distribucion["PRODUCTO"] == producto
+    en_cubo = cubo["PRODUCTO"] == producto
+    if anios is not None:
+        en_distribucion &= distribucion["ANIO_DESPACHO"].between(anios[0], anios[-1])
+        en_cubo &= cubo["ANIO_DESPACHO"].between(anios[0], anios[-1])
+    return resumen_aproximado(distribucion[en_distribucion], cubo[en_cubo])
+
+def volumen(resumen, producto, color):
     """
-    Generar un boxplot para la distribución del volumen
+    Generar un boxplot para la distribución del volumen a partir de su resumen
     """
     fig = go.Figure()
-    fig.add_trace(go.Box(
-        x = data,
-        name = producto,
-        marker_color = color,
-        boxmean = "sd",
-    ))
+    if resumen is not None:
+        fig.add_trace(go.Box(
+            y = [producto],
+            q1 = [resumen["q1"]],
+            median = [resumen["mediana"]],
+            q3 = [resumen["q3"]],
+            lowerfence = [resumen["bigote_inferior"]],
+            upperfence = [resumen["bigote_superior"]],
+            mean = [resumen["media"]],
+            sd = [resumen["desviacion"]],
+            orientation = "h",
+            name = producto,
+            marker_color = color,
+            boxpoints = False,
+        ))
+        fig.add_trace(go.Scatter(
+            x = resumen["atipicos"],
+            y = [producto] * len(resumen["atipicos"]),
+            mode = "markers",
+            marker = dict(color = color, size = 5, opacity = 0.6),
+            name = f"Atípicos ({resumen['n_atipicos']:,})",
+            hovertemplate = "%{x:,.2f}<extra></extra>",
+            showlegend = False,
+        ))
     fig.update_layout(
         title = f"Distribución de los volúmenes de {producto} despachados",
         title_font=dict(size=18, color="#A0C878"),  
@@ -87,261 +165,119 @@ def volumen(data, producto, color):
         yaxis=dict(gridcolor="lightgray") 
     )
     return fig
-fig_e_v = volumen(vol_b, "B100", "#57B4BA")
-fig_b100_v = volumen(vol_e, "Etanol", "#FE4F2D")
+fig_e_v = volumen(resumen_volumen("B100"), "B100", "#57B4BA")
+fig_b100_v = volumen(resumen_volumen("Etanol"), "Etanol", "#FE4F2D")
 
 
 # Volumen por año
-tabla_volumen = df.groupby(["ANIO_DESPACHO", "PRODUCTO"])["VOLUMEN_DESPACHADO"].sum().unstack()
-tabla_volumen = tabla_volumen.apply(pd.to_numeric)
-tabla_volumen_reset = tabla_volumen.reset_index()
-fig_vol_year = px.bar(
-    tabla_volumen_reset, 
-    x="ANIO_DESPACHO", 
-    y=tabla_volumen.columns,  
-    barmode="group",
-    title="Volúmen de productos despachados por año",
-    labels={"value": "Volúmen despachado", "variable": "Producto"},
-    hover_data={"ANIO_DESPACHO": False}, 
-    color_discrete_map={ "B 100": '#57B4BA',  "ETANOL": "#FE4F2D"}
-)
-fig_vol_year.update_layout(
-    title = dict(
-        text = "Volúmen de producto despachado por año", font = dict(size = 20, color = "#A0C878"),
-        x = 0.5),
-    xaxis_title="Año de despacho",
-    yaxis_title="Volúmen despachado",
-    legend_title="Producto",
-    bargap=0.2,  
-    hovermode="x"
-)
+def volumen_anual(data):
+    """
+    Generar un gráfico de barras del volumen despachado de cada producto por año
+    """
+    tabla_volumen = data.groupby(["ANIO_DESPACHO", "PRODUCTO"], observed=True)["VOLUMEN"].sum().unstack()
+    tabla_volumen = tabla_volumen.apply(pd.to_numeric)
+    tabla_volumen_reset = tabla_volumen.reset_index()
+    fig = px.bar(
+        tabla_volumen_reset, 
+        x="ANIO_DESPACHO", 
+        y=tabla_volumen.columns,  
+        barmode="group",
+        title="Volúmen de productos despachados por año",
+        labels={"value": "Volúmen despachado", "variable": "Producto"},
+        hover_data={"ANIO_DESPACHO": False}, 
+        color_discrete_map={ "B 100": '#57B4BA',  "ETANOL": "#FE4F2D"}
+    )
+    fig.update_layout(
+        title = dict(
+            text = "Volúmen de producto despachado por año", font = dict(size = 20, color = "#A0C878"),
+            x = 0.5),
+        xaxis_title="Año de despacho",
+        yaxis_title="Volúmen despachado",
+        legend_title="Producto",
+        bargap=0.2,  
+        hovermode="x"
+    )
+    return fig
+
+fig_vol_year = volumen_anual(cubo)
 
 
 
 # TIPO DE COMPRADOR
-t_comp = pd.DataFrame({
-    "Producto": df["TIPO_COMPRADOR"].value_counts().index,
-    "Cantidad": df["TIPO_COMPRADOR"].value_counts().values,
-    "Porcentaje": (df["TIPO_COMPRADOR"].value_counts().values / df["TIPO_COMPRADOR"].count()) * 100
-})
-t_comp["Porcentaje"] = t_comp["Porcentaje"].map(lambda x: f"{x:.2f}%")
+def tabla_compradores(data):
+    """
+    Cantidad y porcentaje de despachos por tipo de comprador
+    """
+    conteo_comprador = data.groupby("TIPO_COMPRADOR", observed=True)["CANTIDAD"].sum().sort_values(ascending=False)
+    t_comp = pd.DataFrame({
+        "Producto": conteo_comprador.index,
+        "Cantidad": conteo_comprador.values,
+        "Porcentaje": (conteo_comprador.values / conteo_comprador.sum()) * 100
+    })
+    t_comp["Porcentaje"] = t_comp["Porcentaje"].map(lambda x: f"{x:.2f}%")
+    return t_comp
+
+t_comp = tabla_compradores(cubo)
 
 
 
 # LUGAR DE DESPACHO
 # Proveedores
-tabla_proveedores = df.groupby(["DEPARTAMENTO_PROVEEDOR", "MUNICIPIO_PROVEEDOR"]).agg(
-    Cantidad_Despachos=("VOLUMEN_DESPACHADO", "count"),
-    Volumen_Etanol=("VOLUMEN_DESPACHADO", lambda x: x[df["PRODUCTO"] == "ETANOL - ALCOHOL CARBURANTE"].sum()),
-    Volumen_B100=("VOLUMEN_DESPACHADO", lambda x: x[df["PRODUCTO"] == "B 100"].sum())
-).reset_index()
-tabla_proveedores.rename(columns={
-    "DEPARTAMENTO_PROVEEDOR": "Departamento",
-    "MUNICIPIO_PROVEEDOR": "Municipio",
-    "Cantidad_Despachos": "Cantidad de Despachos",
-    "Volumen_Etanol": "Volumen de Etanol",
-    "Volumen_B100": "Volumen de B100"
-}, inplace=True)
-tabla_proveedores["Volumen de B100"] = tabla_proveedores["Volumen de B100"].apply(lambda x: f"{x:,.2f}")
-tabla_proveedores["Volumen de Etanol"] = tabla_proveedores["Volumen de Etanol"].apply(lambda x: f"{x:,.2f}")
-
-# Destino
-tabla_destino = df.groupby(["DEPARTAMENTO", "MUNICIPIO"]).agg(
-    Cantidad_Despachos=("VOLUMEN_DESPACHADO", "count"),
-    Volumen_Etanol=("VOLUMEN_DESPACHADO", lambda x: x[df["PRODUCTO"] == "ETANOL - ALCOHOL CARBURANTE"].sum()),
-    Volumen_B100=("VOLUMEN_DESPACHADO", lambda x: x[df["PRODUCTO"] == "B 100"].sum())
-).reset_index()
-tabla_destino.rename(columns={
-    "DEPARTAMENTO": "Departamento",
-    "MUNICIPIO": "Municipio",
-    "Cantidad_Despachos": "Cantidad de Despachos",
-    "Volumen_Etanol": "Volumen de Etanol",
-    "Volumen_B100": "Volumen de B100"
-}, inplace=True)
-tabla_destino["Volumen de B100"] = tabla_destino["Volumen de B100"].apply(lambda x: f"{x:,.2f}")
-tabla_destino["Volumen de Etanol"] = tabla_destino["Volumen de Etanol"].apply(lambda x: f"{x:,.2f}")
-
-# Asegurar strings de 5 dígitos para los códigos de municipios
-df["CODIGO_MUNICIPIO_DANE_PROVEEDOR"] = df["CODIGO_MUNICIPIO_DANE_PROVEEDOR"].astype(str).str.zfill(5)
-df["CODIGO_MUNICIPIO_DANE_DESTINO"] = df["CODIGO_MUNICIPIO_DANE_DESTINO"].astype(str).str.zfill(5)
-
-# CREACIÓN DE CÓDIGOS DE MUNICIPIOS EN gdf_m
-gdf_m["CODIGO_MUNICIPIO_DANE"] = gdf_m["dpto_ccdgo"].astype(str).str.zfill(2) + gdf_m["mpio_ccdgo"].astype(str).str.zfill(3)
-geo_dict = dict(zip(gdf_m["CODIGO_MUNICIPIO_DANE"], gdf_m["geometry"]))
-df["geometry_proveedor"] = df["CODIGO_MUNICIPIO_DANE_PROVEEDOR"].map(geo_dict)
-df["geometry_destino"] = df["CODIGO_MUNICIPIO_DANE_DESTINO"].map(geo_dict)
-
-gdf_proveedores = gpd.GeoDataFrame(df, geometry="geometry_proveedor").drop_duplicates(subset=["CODIGO_MUNICIPIO_DANE_PROVEEDOR"])
-gdf_destinos = gpd.GeoDataFrame(df, geometry="geometry_destino").drop_duplicates(subset=["CODIGO_MUNICIPIO_DANE_DESTINO"])
-
-
-
-# Mapa municipios y proveedores
-m = folium.Map(location=[4.5709, -74.2973], zoom_start=6)
-for _, row in gdf_proveedores.iterrows():
-    if row["geometry_proveedor"]:
-        nombre = row.get("MUNICIPIO_PROVEEDOR")  
-        folium.GeoJson(
-            row["geometry_proveedor"],
-            style_function=lambda x: {"color": "#57B4BA", "fillColor": "#57B4BA", "fillOpacity": 0.5},
-            tooltip=f"Proveedor: {nombre}"
-        ).add_to(m)
-for _, row in gdf_destinos.iterrows():
-    if row["geometry_destino"]:
-        nombre = row.get("MUNICIPIO")  
-        folium.GeoJson(
-            row["geometry_destino"],
-            style_function=lambda x: {"color": "#FE4F2D", "fillColor": "#FE4F2D", "fillOpacity": 0.5},
-            tooltip=f"Destino: {nombre}"
-        ).add_to(m)
-legend_html = """
-<div style="
-    position: fixed; 
-    bottom: 50px; left: 50px; width: 200px; height: 90px; 
-    background-color: white; z-index:9999; 
-    padding: 10px; font-size:14px; border-radius:5px;
-    box-shadow: 2px 2px 5px rgba(0,0,0,0.3);
-">
-    <b>Leyenda</b> <br>
-    <i style="background:blue; width:10px; height:10px; display:inline-block;"></i> Municipios Proveedores<br>
-    <i style="background:red; width:10px; height:10px; display:inline-block;"></i> Municipios Destino
-</div>
-"""
-m.get_root().html.add_child(folium.Element(legend_html))
-m.save("mapa_municipios.html")
+with tramo("arranque_tablas_municipios"):
+    tabla_proveedores = tabla_municipios(cubo, municipios, "CODIGO_MUNICIPIO_DANE_PROVEEDOR")
+
+    # Destino
+    tabla_destino = tabla_municipios(cubo, municipios, "CODIGO_MUNICIPIO_DANE_DESTINO")
+
+# Los mapas se generan con Folium (HTML en un iframe) o con Plotly (dcc.Graph), según MAPAS_BACKEND
+MAPAS_BACKEND = os.environ.get("MAPAS_BACKEND", "folium")
+
+# Geometría servida una sola vez como archivo estático para los mapas de Plotly
+GEOJSON_MUNICIPIOS = artefactos["geojson"]
+URL_GEOJSON = f"/geometria/municipios-{hashlib.sha256(GEOJSON_MUNICIPIOS.encode()).hexdigest()[:12]}.geojson"
+centroides_municipios = artefactos["centroides"]
 
 
 
 # RELACIÓN PROVEEDOR-DESTINO
-df_despachos = df.groupby(["MUNICIPIO_PROVEEDOR", "MUNICIPIO"]).size().reset_index(name="CANTIDAD_DESPACHOS")
-
-# Proveedor
-df_rel_p = df_despachos.groupby("MUNICIPIO_PROVEEDOR")["MUNICIPIO"].nunique().reset_index()
-df_rel_p.columns = ["MUNICIPIO_PROVEEDOR", "CANTIDAD_RELACIONES"]
-
-# Destinos
-df_rel_d = df_despachos.groupby("MUNICIPIO")["MUNICIPIO_PROVEEDOR"].nunique().reset_index()
-df_rel_d .columns = ["MUNICIPIO", "CANTIDAD_RELACIONES"]
-
-fig_rel_p = px.bar(df_rel_p, 
-    x="MUNICIPIO_PROVEEDOR", 
-    y="CANTIDAD_RELACIONES", 
-    title="Número de relaciones por Municipio Proveedor",
-    labels={"MUNICIPIO_PROVEEDOR": "Municipio Proveedor", "CANTIDAD_RELACIONES": "Número de Destinos"},
-    hover_data=["CANTIDAD_RELACIONES"]
-)
-fig_rel_p.update_layout(clickmode="event+select")
-fig_rel_p.update_traces(marker_color="#57B4BA")
-
-fig_rel_d = px.bar(df_rel_d , 
-    x="MUNICIPIO", 
-    y="CANTIDAD_RELACIONES", 
-    title="Número de relaciones por Municipio Destino",
-    labels={"MUNICIPIO": "Municipio Destino", "CANTIDAD_RELACIONES": "Número de Proveedores"},
-    hover_data=["CANTIDAD_RELACIONES"])
-fig_rel_d.update_layout(clickmode="event+select")
-fig_rel_d.update_traces(marker_color="#57B4BA")
-
-
-# MAPA RELACIONES
-grafo = folium.Map(location=[4.5709, -74.2973], zoom_start=6)
-
-gdf_proveedores["lat"] = gdf_proveedores.geometry.centroid.y
-gdf_proveedores["lon"] = gdf_proveedores.geometry.centroid.x
-gdf_destinos["lat"] = gdf_destinos.geometry.centroid.y
-gdf_destinos["lon"] = gdf_destinos.geometry.centroid.x
-
-coord_prov = gdf_proveedores.set_index("MUNICIPIO_PROVEEDOR")[["lat", "lon"]].to_dict("index")
-coord_dest = gdf_destinos.set_index("MUNICIPIO")[["lat", "lon"]].to_dict("index")
-
-for municipio, coord in coord_prov.items():
-    folium.CircleMarker(
-        location=[coord["lat"], coord["lon"]],
-        radius=5,
-        color="blue",
-        fill=True,
-        fill_color="blue",
-        fill_opacity=0.6,
-        tooltip=f"Proveedor: {municipio}"
-    ).add_to(m)
-
-for municipio, coord in coord_dest.items():
-    folium.CircleMarker(
-        location=[coord["lat"], coord["lon"]],
-        radius=5,
-        color="red",
-        fill=True,
-        fill_color="red",
-        fill_opacity=0.6,
-        tooltip=f"Destino: {municipio}"
-    ).add_to(m)
-    
-rango_colores = {
-    (0, 100): "blue",
-    (100, 1000): "green",
-    (1000, 10000): "orange",
-    (10000, 30000): "red"
-}
+nombres = municipios.set_index("CODIGO_MUNICIPIO_DANE")["MUNICIPIO"]
+
+def relaciones(grados, columna, titulo, etiqueta, nombre_relacion):
+    """
+    Generar un gráfico de barras con el número de municipios relacionados con cada municipio
+    """
+    df_rel = pd.DataFrame({
+        columna: grados.index.map(nombres),
+        "CANTIDAD_RELACIONES": grados.to_numpy(),
+    }).sort_values(columna, kind="stable")
+    fig = px.bar(df_rel, 
+        x=columna, 
+        y="CANTIDAD_RELACIONES", 
+        title=titulo,
+        labels={columna: etiqueta, "CANTIDAD_RELACIONES": nombre_relacion},
+        hover_data=["CANTIDAD_RELACIONES"]
+    )
+    fig.update_layout(clickmode="event+select")
+    fig.update_traces(marker_color="#57B4BA")
+    return fig
 
-import math
-
-for _, row in df_despachos.iterrows():
-    origen = row["MUNICIPIO_PROVEEDOR"]
-    destino = row["MUNICIPIO"]
-    peso = row["CANTIDAD_DESPACHOS"]
-    if origen in coord_prov and destino in coord_dest:
-        lat_o = coord_prov[origen]["lat"]
-        lon_o = coord_prov[origen]["lon"]
-        lat_d = coord_dest[destino]["lat"]
-        lon_d = coord_dest[destino]["lon"]
-
-        # Chequeo de NaNs
-        if any(math.isnan(x) for x in [lat_o, lon_o, lat_d, lon_d]):
-            print(f"❌ Coordenadas faltantes para: {origen} → {destino}")
-            continue  # Saltar esta fila
-
-        loc_origen = [lat_o, lon_o]
-        loc_destino = [lat_d, lon_d]
-        color = "gray"  
-        for (low, high), col in rango_colores.items():
-            if low <= peso < high:
-                color = col
-                break       
-        folium.PolyLine(
-            [loc_origen, loc_destino],
-            color=color,
-            weight=3,
-            opacity=0.6,
-            tooltip=f"{origen} → {destino}: {peso} despachos"
-        ).add_to(grafo)
-
-legend_html = """
-<div style="
-    position: fixed;
-    bottom: 50px;
-    left: 50px;
-    width: 220px;
-    background-color: white;
-    z-index:9999;
-    padding: 10px;
-    border-radius: 5px;
-    font-size: 14px;
-    opacity: 0.9;
-">
-    <b>Rango de Despachos</b><br>
-    <i style="background:blue; width: 10px; height: 10px; display: inline-block;"></i> 0 - 100 <br>
-    <i style="background:green; width: 10px; height: 10px; display: inline-block;"></i> 100 - 1,000 <br>
-    <i style="background:orange; width: 10px; height: 10px; display: inline-block;"></i> 1,000 - 10,000 <br>
-    <i style="background:red; width: 10px; height: 10px; display: inline-block;"></i> 10,000 - 30,000 <br>
-</div>
-"""
-
-grafo.get_root().html.add_child(folium.Element(legend_html))
-grafo.save("despachos_mapa.html")
+def relaciones_proveedor(grafo_od):
+    return relaciones(grafo_od.grados_salida(), "MUNICIPIO_PROVEEDOR",
+        "Número de relaciones por Municipio Proveedor", "Municipio Proveedor", "Número de Destinos")
+
+def relaciones_destino(grafo_od):
+    return relaciones(grafo_od.grados_entrada(), "MUNICIPIO",
+        "Número de relaciones por Municipio Destino", "Municipio Destino", "Número de Proveedores")
+
+# Grafo origen-destino por código DANE
+with tramo("arranque_grafo"):
+    grafo_od = GrafoFlujos.desde_cubo(cubo)
+fig_rel_p = relaciones_proveedor(grafo_od)
+fig_rel_d = relaciones_destino(grafo_od)
 
 
 #______________
-app = dash.Dash(__name__)
+app = dash.Dash(__name__, suppress_callback_exceptions=True)
 server = app.server
 
 
@@ -356,6 +292,247 @@ subtitulo_estilo = {
     'textAlign': 'center', 
     'fontSize': '24px' 
 }
+anios = indice.opciones("ANIO_DESPACHO")
+
+# Las tablas de municipios se envían por páginas, con los volúmenes numéricos
+TAMANO_PAGINA = 10
+formato_volumen = Format(group=Group.yes, precision=2, scheme=Scheme.fixed)
+columnas_municipios = [
+    {"name": "Departamento", "id": "Departamento"},
+    {"name": "Municipio", "id": "Municipio"},
+    {"name": "Cantidad de Despachos", "id": "Cantidad de Despachos", "type": "numeric"},
+    {"name": "Volumen de Etanol", "id": "Volumen de Etanol", "type": "numeric", "format": formato_volumen},
+    {"name": "Volumen de B100", "id": "Volumen de B100", "type": "numeric", "format": formato_volumen}
+]
+pagina_proveedores = consultar(tabla_proveedores, 0, TAMANO_PAGINA)
+pagina_destino = consultar(tabla_destino, 0, TAMANO_PAGINA)
+
+def componente_mapa(id_mapa, archivo_html, grafico):
+    """
+    Mapa de Folium embebido en un iframe, o gráfico de Plotly que se actualiza con los filtros
+    """
+    if MAPAS_BACKEND == "plotly":
+        return dcc.Graph(id=id_mapa, figure=grafico(SIN_FILTROS), config={"scrollZoom": True})
+    # El HTML del mapa se sirve aparte (y queda en la caché del navegador), no dentro del layout
+    return html.Iframe(
+        src=f"/mapas/{artefactos['version']}/{archivo_html}",
+        width="100%",
+        height="600px")
+
+
+@memoizar
+def pestana_despachos():
+    """
+    Contenido de la pestaña "Despachos por producto"
+    """
+    return [
+        # DESPACHOS
+        html.H2("Despachos por producto", style=subtitulo_estilo),
+        html.H3("Tabla: Total de Despachos por producto"),
+        dash_table.DataTable(
+            id = 'tabla_despachos',
+            columns=[
+                {'name': 'Producto', 'id': 'Producto'},
+                {'name': 'Cantidad', 'id': 'Cantidad'}
+            ],
+            data = t_desp.to_dict('records'), 
+            style_table={'height': '100px', 'overflowY': 'auto'},  
+            style_cell={'textAlign': 'center'},  
+            style_header={"backgroundColor": "#A0C878", "color": "white", "fontWeight": "bold"},
+            style_data={"textAlign": "center"},
+        ),
+        html.H3("Tabla: Total de Despachos por año"),
+        dash_table.DataTable(
+            id='tabla_despachos_total',
+            columns=[ 
+                {'name': 'Año', 'id': 'Año'},
+                {'name': 'Total Despachos', 'id': 'Total Despachos'},
+                {'name': 'Despachos B100', 'id': 'Despachos B100'},
+                {'name': 'Despachos Etanol', 'id': 'Despachos Etanol'}
+            ],
+            data = table_desp.to_dict('records'),  
+            style_table={'height': '200px', 'overflowY': 'auto'},  
+            style_cell={'textAlign': 'center'}, 
+            style_header={"backgroundColor": "#A0C878", "color": "white", "fontWeight": "bold"}, 
+            style_data={"textAlign": "center"},
+        ),
+        html.P("Exceptuando el 2025, todos en todos los años tienen más de 20.000 despachos, "
+        "siendo 2023 el que menos registros tiene (23.730) y 2024 el de mayor registro (25.940). "
+        "En Colombia se produce en mayor cantidad Biodiesel puro B100 con 69.517 despachos. "
+        "El Etanol tiene casi la mitad de esos despachos 37.107."),
+
+        html.H3("Gráfico: Evolución mensual de despachos por año"),
+        dcc.RadioItems(
+            id="frecuencia_despachos",
+            options=[{"label": etiqueta, "value": valor} for valor, etiqueta in FRECUENCIAS_DESPACHOS.items()],
+            value="mes_anio",
+            inline=True,
+        ),
+        dcc.Graph(
+            id = "grafico_etanol",
+            figure = fig_etanol,
+        ),
+        dcc.Graph(
+            id = "grafico_b100",
+            figure = fig_b100,
+        ),
+        html.P("Para el Etanol, se observa una fluctuación significativa en la cantidad de despachos"
+        "mes a mes, lo que sugiere que la demanda no es constante a lo largo del año. "
+        "Algunos meses presentan caídas abruptas en ciertos años, como en abril de 2021 y mayo de 2025."
+        "Para el B100, la variabilidad en los despachos es menor en comparación al etanol, "
+        "lo que sugiere que su demanda o producción está mejor regulada.")
+    ]
+
+
+@memoizar
+def pestana_volumen():
+    """
+    Contenido de la pestaña "Volumen despachado"
+    """
+    return [
+        # Volumen despachado
+        html.H2("Volúmenes de Producto despachados", style=subtitulo_estilo),
+        html.H3("Gráfico: Distribución de volúmenes"),
+        dcc.Graph(
+            id = "fig_e_v",
+            figure = fig_e_v,
+        ),
+        dcc.Graph(
+            id = "fig_b100_v",
+            figure = fig_b100_v,
+        ),
+        html.P("La distribución del volúmen en galones vendidos es muy amplia en ambos casos."
+            "La producción de Etanol, tiene asimetría negativa, con una producción desde 3.72 hasta más de 12 mil galones. "
+            "Se encuentran observaciones registradas a lo largo de toda la amplitud."
+            "Para el caso del B100, se tienen datos desde 10.4 galones hasta 3.01 millones de galones, "
+            "con una alta asimetría positiva. Dentro de la dispersión, podemos ver dos grandes cúmulos de datos entre 0 a 500 mil galones, "
+            "y el otro de datos dispersos entre los 2 a 2.7 millones de galones. Existen zonas sin presencia de datos, "
+            "lo que podría indicar diferencia entre capacidades de producción."
+            ),
+
+        dcc.Graph(
+            id = "fig_vol_year",
+            figure = fig_vol_year,
+        ),
+        html.P("A lo largo de los años, la producción de B100 es mucho mayor que la de Etanol"
+                "El año 2024, es el año de mayor volumen de ambos protuctos.")
+    ]
+
+
+@memoizar
+def pestana_comprador():
+    """
+    Contenido de la pestaña "Tipo de comprador"
+    """
+    return [
+        
+        # Tipo de comprador
+        html.H2("Tipo de comprador", style=subtitulo_estilo),
+        dash_table.DataTable(
+            id = "tabla_comprador",
+            columns=[
+                {"name": "Tipo de Comprador", "id": "Producto"},
+                {"name": "Cantidad", "id": "Cantidad"},
+                {"name": "Porcentaje", "id": "Porcentaje"}
+            ],
+            data=t_comp.to_dict("records"),
+            style_header={"backgroundColor": "#A0C878", "color": "white", "fontWeight": "bold"},
+            style_cell={"textAlign": "center", "padding": "10px"},
+            style_table={'height': '200px', 'overflowY': 'auto'},  
+            style_data={"textAlign": "center"},
+        )
+    ]
+
+
+@memoizar
+def pestana_lugar():
+    """
+    Contenido de la pestaña "Lugar de despacho"
+    """
+    return [
+        # Georeferenciación
+        html.H2("Ubicación del Despacho", style = subtitulo_estilo),
+        html.H3("Tabla: Municipios proveedores"),
+        dash_table.DataTable(
+            id = "tabla_proveedores",
+            columns=columnas_municipios,
+            data=pagina_proveedores[0],
+            page_action="custom",
+            page_current=0,
+            page_size=TAMANO_PAGINA,
+            page_count=pagina_proveedores[2],
+            sort_action="custom",
+            sort_mode="multi",
+            filter_action="custom",
+            style_header={"backgroundColor": "#A0C878", "color": "white", "fontWeight": "bold"},
+            style_cell={"textAlign": "center", "padding": "8px"},
+            style_table={'height': '300px', 'overflowY': 'auto'},  # Definir el tamaño de la tabla
+            style_data={"textAlign": "center"},
+        ),
+        html.P("Se identifican 15 municipios proveedores distribuidos en 8 departamentos."
+            "Facatativá (Cundinamarca), es el mayor proveedor con 23,598 despachos, mientras que Barranquilla reporta solo 5 despachos."
+            "Ningún municipio exporta ambos productos. 8 municipios exportan únicamente B100, mientras que 7 exportan solo Etanol."
+            "Meta es el departamento con mayor cantidad de despachos registrados, siendo el único que exporta ambos productos."),
+        html.H3("Tabla: Municipios de Destino"),
+        dash_table.DataTable(
+            id = "tabla_destino",
+            columns=columnas_municipios,
+            data=pagina_destino[0],
+            page_action="custom",
+            page_current=0,
+            page_size=TAMANO_PAGINA,
+            page_count=pagina_destino[2],
+            sort_action="custom",
+            sort_mode="multi",
+            filter_action="custom",
+            style_header={"backgroundColor": "#A0C878", "color": "white", "fontWeight": "bold"},
+            style_cell={"textAlign": "center", "padding": "8px"},
+            style_table={'height': '300px', 'overflowY': 'auto'},  # Definir el tamaño de la tabla
+            style_data={"textAlign": "center"},
+        ), 
+        html.P("Bogotá, D.C. es el destino con mayor recepción de ambos productos, acumulando más de 93,000 despachos. "
+            "Mientras que Nariño es el departamento con menor cantidad de despachos recibidos, con 130 despachos."
+            "Uribia (La Guajira) recibe solo B100 y no tiene consumo reportado de Etanol."
+            "Bogotá lidera la recepción de ambos productos."
+            "Medellín (Antioquia), es el municipio con menor cantidad de despachos recibidos, solo 67."),
+
+        html.H3("Mapa: Ubicación de los municipios Proveedores y Destino"),
+        componente_mapa("mapa_municipios", MAPA_MUNICIPIOS, grafico_mapa_municipios)
+    ]
+
+
+@memoizar
+def pestana_relaciones():
+    """
+    Contenido de la pestaña "Relaciones Proveedor-Destino"
+    """
+    return [
+        # Relaciones proveedor-destino
+        html.H2("Relaciones Proveedor y destino", style = subtitulo_estilo),
+        dcc.Graph(
+            id = "fig_rel_p",
+            figure = fig_rel_p,
+        ),
+        html.P("Los municipios de El cerrito(Valle del Cauca), Miranda(Cauca) y Santa Marta (Magdalena), "
+        "son los municipios que más relaciones de envio tienen, cada uno envia a 6 municipios. "),
+        dcc.Graph(
+            id = "fig_rel_d",
+            figure = fig_rel_d,
+        ),
+        html.P("Los municipios que más envio de producto reciben son Bogotá D.C. y Cartagena de Indias, "
+        "que reciben de 13 y 12 municipios respectivamente."),
+        html.H3("Mapa: Despachos entre Municipios"),
+        componente_mapa("mapa_despachos", MAPA_DESPACHOS, grafico_mapa_despachos)
+    ]
+
+PESTANAS = {
+    "despachos": pestana_despachos,
+    "volumen": pestana_volumen,
+    "comprador": pestana_comprador,
+    "lugar": pestana_lugar,
+    "relaciones": pestana_relaciones,
+}
+
 
 app.layout = html.Div([
     html.H1("PRODUCTORES DE ETANOL Y B100 EN COLOMBIA", style=titulo_estilo),
@@ -367,182 +544,403 @@ app.layout = html.Div([
             "Cada despacho es referenciado por la fecha, el tipo de comprador"
             "departamento y municipio del proveedor y de despacho, el tipo de producto y el volumen despachado."),
 
-    dcc.Tabs([
-        dcc.Tab(label='Despachos por producto', children=[
-            # DESPACHOS
-            html.H2("Despachos por producto", style=subtitulo_estilo),
-            html.H3("Tabla: Total de Despachos por producto"),
-            dash_table.DataTable(
-                id = 'tabla_despachos',
-                columns=[
-                    {'name': 'Producto', 'id': 'Producto'},
-                    {'name': 'Cantidad', 'id': 'Cantidad'}
-                ],
-                data = t_desp.to_dict('records'), 
-                style_table={'height': '100px', 'overflowY': 'auto'},  
-                style_cell={'textAlign': 'center'},  
-                style_header={"backgroundColor": "#A0C878", "color": "white", "fontWeight": "bold"},
-                style_data={"textAlign": "center"},
-            ),
-            html.H3("Tabla: Total de Despachos por año"),
-            dash_table.DataTable(
-                id='tabla_despachos_total',
-                columns=[ 
-                    {'name': 'Año', 'id': 'Año'},
-                    {'name': 'Total Despachos', 'id': 'Total Despachos'},
-                    {'name': 'Despachos B100', 'id': 'Despachos B100'},
-                    {'name': 'Despachos Etanol', 'id': 'Despachos Etanol'}
-                ],
-                data = table_desp.to_dict('records'),  
-                style_table={'height': '200px', 'overflowY': 'auto'},  
-                style_cell={'textAlign': 'center'}, 
-                style_header={"backgroundColor": "#A0C878", "color": "white", "fontWeight": "bold"}, 
-                style_data={"textAlign": "center"},
-            ),
-            html.P("Exceptuando el 2025, todos en todos los años tienen más de 20.000 despachos, "
-            "siendo 2023 el que menos registros tiene (23.730) y 2024 el de mayor registro (25.940). "
-            "En Colombia se produce en mayor cantidad Biodiesel puro B100 con 69.517 despachos. "
-            "El Etanol tiene casi la mitad de esos despachos 37.107."),
-
-            html.H3("Gráfico: Evolución mensual de despachos por año"),
-            dcc.Graph(
-                id = "grafico_etanol",
-                figure = fig_etanol,
-            ),
-            dcc.Graph(
-                id = "grafico_b100",
-                figure = fig_b100,
-            ),
-            html.P("Para el Etanol, se observa una fluctuación significativa en la cantidad de despachos"
-            "mes a mes, lo que sugiere que la demanda no es constante a lo largo del año. "
-            "Algunos meses presentan caídas abruptas en ciertos años, como en abril de 2021 y mayo de 2025."
-            "Para el B100, la variabilidad en los despachos es menor en comparación al etanol, "
-            "lo que sugiere que su demanda o producción está mejor regulada.")
-        ]), 
-
-        dcc.Tab(label='Volumen despachado', children=[
-
-            # Volumen despachado
-            html.H2("Volúmenes de Producto despachados", style=subtitulo_estilo),
-            html.H3("Gráfico: Distribución de volúmenes"),
-            dcc.Graph(
-                id = "fig_e_v",
-                figure = fig_e_v,
-            ),
-            dcc.Graph(
-                id = "fig_b100_v",
-                figure = fig_b100_v,
+    # Filtros
+    html.Div([
+        html.Div([
+            html.Label("Años"),
+            dcc.RangeSlider(
+                id = "filtro_anio",
+                min = anios[0],
+                max = anios[-1],
+                step = 1,
+                value = [anios[0], anios[-1]],
+                marks = {int(a): str(a) for a in anios},
             ),
-            html.P("La distribución del volúmen en galones vendidos es muy amplia en ambos casos."
-                "La producción de Etanol, tiene asimetría negativa, con una producción desde 3.72 hasta más de 12 mil galones. "
-                "Se encuentran observaciones registradas a lo largo de toda la amplitud."
-                "Para el caso del B100, se tienen datos desde 10.4 galones hasta 3.01 millones de galones, "
-                "con una alta asimetría positiva. Dentro de la dispersión, podemos ver dos grandes cúmulos de datos entre 0 a 500 mil galones, "
-                "y el otro de datos dispersos entre los 2 a 2.7 millones de galones. Existen zonas sin presencia de datos, "
-                "lo que podría indicar diferencia entre capacidades de producción."
-                ),
-
-            dcc.Graph(
-                id = "fig_vol_year",
-                figure = fig_vol_year,
-            ),
-            html.P("A lo largo de los años, la producción de B100 es mucho mayor que la de Etanol"
-                    "El año 2024, es el año de mayor volumen de ambos protuctos.")
-        ]),
-
-        dcc.Tab(label='Tipo de comprador', children=[
-            
-            # Tipo de comprador
-            html.H2("Tipo de comprador", style=subtitulo_estilo),
-            dash_table.DataTable(
-                columns=[
-                    {"name": "Tipo de Comprador", "id": "Producto"},
-                    {"name": "Cantidad", "id": "Cantidad"},
-                    {"name": "Porcentaje", "id": "Porcentaje"}
-                ],
-                data=t_comp.to_dict("records"),
-                style_header={"backgroundColor": "#A0C878", "color": "white", "fontWeight": "bold"},
-                style_cell={"textAlign": "center", "padding": "10px"},
-                style_table={'height': '200px', 'overflowY': 'auto'},  
-                style_data={"textAlign": "center"},
-            )
-        ]),
-
-        dcc.Tab(label='Lugar de despacho', children=[
-
-            # Georeferenciación
-            html.H2("Ubicación del Despacho", style = subtitulo_estilo),
-            html.H3("Tabla: Municipios proveedores"),
-            dash_table.DataTable(
-                columns=[
-                    {"name": "Departamento", "id": "Departamento"},
-                    {"name": "Municipio", "id": "Municipio"},
-                    {"name": "Cantidad de Despachos", "id": "Cantidad de Despachos"},
-                    {"name": "Volumen de Etanol", "id": "Volumen de Etanol"},
-                    {"name": "Volumen de B100", "id": "Volumen de B100"}
-                ],
-                data=tabla_proveedores.to_dict("records"),
-                style_header={"backgroundColor": "#A0C878", "color": "white", "fontWeight": "bold"},
-                style_cell={"textAlign": "center", "padding": "8px"},
-                style_table={'height': '300px', 'overflowY': 'auto'},  # Definir el tamaño de la tabla
-                style_data={"textAlign": "center"},
-            ),
-            html.P("Se identifican 15 municipios proveedores distribuidos en 8 departamentos."
-                "Facatativá (Cundinamarca), es el mayor proveedor con 23,598 despachos, mientras que Barranquilla reporta solo 5 despachos."
-                "Ningún municipio exporta ambos productos. 8 municipios exportan únicamente B100, mientras que 7 exportan solo Etanol."
-                "Meta es el departamento con mayor cantidad de despachos registrados, siendo el único que exporta ambos productos."),
-            html.H3("Tabla: Municipios de Destino"),
-            dash_table.DataTable(
-                columns=[
-                    {"name": "Departamento", "id": "Departamento"},
-                    {"name": "Municipio", "id": "Municipio"},
-                    {"name": "Cantidad de Despachos", "id": "Cantidad de Despachos"},
-                    {"name": "Volumen de Etanol", "id": "Volumen de Etanol"},
-                    {"name": "Volumen de B100", "id": "Volumen de B100"}
-                ],
-                data=tabla_destino.to_dict("records"),
-                style_header={"backgroundColor": "#A0C878", "color": "white", "fontWeight": "bold"},
-                style_cell={"textAlign": "center", "padding": "8px"},
-                style_table={'height': '300px', 'overflowY': 'auto'},  # Definir el tamaño de la tabla
-                style_data={"textAlign": "center"},
-            ), 
-            html.P("Bogotá, D.C. es el destino con mayor recepción de ambos productos, acumulando más de 93,000 despachos. "
-                "Mientras que Nariño es el departamento con menor cantidad de despachos recibidos, con 130 despachos."
-                "Uribia (La Guajira) recibe solo B100 y no tiene consumo reportado de Etanol."
-                "Bogotá lidera la recepción de ambos productos."
-                "Medellín (Antioquia), es el municipio con menor cantidad de despachos recibidos, solo 67."),
-
-            html.H3("Mapa: Ubicación de los municipios Proveedores y Destino"),
-            html.Iframe(
-                srcDoc=open("mapa_municipios.html", "r", encoding="utf-8").read(),
-                width="100%",
-                height="600px")
-        ]),
-
-        dcc.Tab(label='Relaciones Proveedor-Destino', children=[
-            # Relaciones proveedor-destino
-            html.H2("Relaciones Proveedor y destino", style = subtitulo_estilo),
-            dcc.Graph(
-                id = "fig_rel_p",
-                figure = fig_rel_p,
-            ),
-            html.P("Los municipios de El cerrito(Valle del Cauca), Miranda(Cauca) y Santa Marta (Magdalena), "
-            "son los municipios que más relaciones de envio tienen, cada uno envia a 6 municipios. "),
-            dcc.Graph(
-                id = "fig_rel_d",
-                figure = fig_rel_d,
-            ),
-            html.P("Los municipios que más envio de producto reciben son Bogotá D.C. y Cartagena de Indias, "
-            "que reciben de 13 y 12 municipios respectivamente."),
-            html.H3("Mapa: Despachos entre Municipios"),
-            html.Iframe(
-                srcDoc=open("despachos_mapa.html", "r", encoding="utf-8").read(),
-                width="100%",
-                height="600px")
-        ]),
+        ], style = {"flex": "2"}),
+        html.Div([
+            html.Label("Producto"),
+            dcc.Dropdown(id = "filtro_producto", options = indice.opciones("PRODUCTO"), multi = True, placeholder = "Todos"),
+        ], style = {"flex": "1"}),
+        html.Div([
+            html.Label("Tipo de comprador"),
+            dcc.Dropdown(id = "filtro_comprador", options = indice.opciones("TIPO_COMPRADOR"), multi = True, placeholder = "Todos"),
+        ], style = {"flex": "1"}),
+        html.Div([
+            html.Label("Departamento proveedor"),
+            dcc.Dropdown(id = "filtro_departamento_proveedor", options = indice.opciones("DEPARTAMENTO_PROVEEDOR"), multi = True, placeholder = "Todos"),
+        ], style = {"flex": "1"}),
+        html.Div([
+            html.Label("Departamento destino"),
+            dcc.Dropdown(id = "filtro_departamento_destino", options = indice.opciones("DEPARTAMENTO"), multi = True, placeholder = "Todos"),
+        ], style = {"flex": "1"}),
+    ], style = {"display": "flex", "gap": "20px", "padding": "10px"}),
+
+    dcc.Tabs(id="pestanas", value="despachos", children=[
+        dcc.Tab(label='Despachos por producto', value='despachos'),
+        dcc.Tab(label='Volumen despachado', value='volumen'),
+        dcc.Tab(label='Tipo de comprador', value='comprador'),
+        dcc.Tab(label='Lugar de despacho', value='lugar'),
+        dcc.Tab(label='Relaciones Proveedor-Destino', value='relaciones'),
     ]),
+    # Solo se construye la pestaña activa
+    html.Div(id="contenido_pestana", children=pestana_despachos()),
 ])
 
+
+def crear_filtros(rango_anios, productos, compradores, departamentos_proveedor, departamentos_destino):
+    """
+    Parámetros de filtro del índice a partir de los valores de los controles
+    """
+    return {
+        "anios": None if list(rango_anios) == [anios[0], anios[-1]] else rango_anios,
+        "productos": productos,
+        "compradores": compradores,
+        "departamentos_proveedor": departamentos_proveedor,
+        "departamentos_destino": departamentos_destino,
+    }
+
+
+SIN_FILTROS = crear_filtros([anios[0], anios[-1]], None, None, None, None)
+
+ENTRADAS_FILTROS = [
+    Input("filtro_anio", "value"),
+    Input("filtro_producto", "value"),
+    Input("filtro_comprador", "value"),
+    Input("filtro_departamento_proveedor", "value"),
+    Input("filtro_departamento_destino", "value"),
+]
+
+
+@app.callback(
+    Output("contenido_pestana", "children"),
+    Input("pestanas", "value"),
+    prevent_initial_call=True,
+)
+@medida()
+def mostrar_pestana(pestana):
+    """
+    Construir (o tomar de la caché) solo el contenido de la pestaña activa
+    """
+    return PESTANAS[pestana]()
+
+
+# Cada pestaña actualiza solo sus componentes; los callbacks se ejecutan también
+# al montarse la pestaña, para que respete los filtros ya elegidos
+@app.callback(
+    Output("tabla_despachos", "data"),
+    Output("tabla_despachos_total", "data"),
+    Output("grafico_etanol", "figure"),
+    Output("grafico_b100", "figure"),
+    Input("frecuencia_despachos", "value"),
+    *ENTRADAS_FILTROS,
+)
+@medida()
+def filtrar_despachos(frecuencia, *valores_filtros):
+    """
+    Actualizar las tablas y gráficos de despachos con las celdas del cubo que cumplen los filtros
+    """
+    filtros = crear_filtros(*valores_filtros)
+    t_desp, table_desp, _ = tablas_filtradas(filtros)
+    return (
+        t_desp,
+        table_desp,
+        grafico_despachos(filtros, "ETANOL - ALCOHOL CARBURANTE", "Etanol", frecuencia),
+        grafico_despachos(filtros, "B 100", "B100", frecuencia),
+    )
+
+
+@app.callback(
+    Output("fig_vol_year", "figure"),
+    Output("fig_e_v", "figure"),
+    Output("fig_b100_v", "figure"),
+    *ENTRADAS_FILTROS,
+)
+@medida()
+def filtrar_volumen(*valores_filtros):
+    filtros = crear_filtros(*valores_filtros)
+    return (
+        grafico_volumen_anual(filtros),
+        grafico_volumen(filtros, "B100", "#57B4BA"),
+        grafico_volumen(filtros, "Etanol", "#FE4F2D"),
+    )
+
+
+@app.callback(Output("tabla_comprador", "data"), *ENTRADAS_FILTROS)
+@medida()
+def filtrar_comprador(*valores_filtros):
+    return tablas_filtradas(crear_filtros(*valores_filtros))[2]
+
+
+if MAPAS_BACKEND == "plotly":
+    @app.callback(Output("mapa_municipios", "figure"), *ENTRADAS_FILTROS)
+    @medida()
+    def filtrar_mapa_municipios(*valores_filtros):
+        return grafico_mapa_municipios(crear_filtros(*valores_filtros))
+
+    @app.callback(Output("mapa_despachos", "figure"), *ENTRADAS_FILTROS)
+    @medida()
+    def filtrar_mapa_despachos(*valores_filtros):
+        return grafico_mapa_despachos(crear_filtros(*valores_filtros))
+
+
+@app.callback(Output("fig_rel_p", "figure"), Output("fig_rel_d", "figure"), *ENTRADAS_FILTROS)
+@medida()
+def filtrar_relaciones(*valores_filtros):
+    return graficos_relaciones(crear_filtros(*valores_filtros))
+
+
+@memoizar
+def tablas_filtradas(filtros):
+    """
+    Registros de las tablas de despachos y compradores
+    """
+    data = indice.filtrar(**filtros)
+    return (
+        tabla_productos(data).to_dict("records"),
+        tabla_anual(data).to_dict("records"),
+        tabla_compradores(data).to_dict("records"),
+    )
+
+
+@memoizar
+def tabla_municipios_filtrada(filtros, columna_codigo):
+    """
+    Tabla numérica de municipios proveedores o destino para los filtros dados
+    """
+    return tabla_municipios(indice.filtrar(**filtros), municipios, columna_codigo)
+
+
+@memoizar
+def grafico_despachos(filtros, producto, nombre, frecuencia="mes_anio"):
+    """
+    Despachos de un producto: meses comparados por año (del cubo) o la serie en el tiempo
+    a la frecuencia elegida, en la ventana de años del filtro
+    """
+    if frecuencia == "mes_anio":
+        data = indice.filtrar(**filtros)
+        return despachos(data[data["PRODUCTO"] == producto], nombre)
+    serie = series.serie("CANTIDAD", frecuencia, **{**filtros, "productos": [producto]})
+    if filtros["productos"] and producto not in filtros["productos"]:
+        serie = serie.iloc[:0]
+    return serie_despachos(serie, nombre, frecuencia)
+
+
+@memoizar
+def grafico_volumen_anual(filtros):
+    return volumen_anual(indice.filtrar(**filtros))
+
+
+@memoizar
+def grafico_volumen(filtros, nombre, color):
+    """
+    Diagrama de caja del volumen de un producto. La distribución solo se desglosa por año, mes
+    y producto, así que los filtros de comprador y departamento no la modifican.
+    """
+    if filtros["productos"] and nombre not in [PRODUCTOS.get(p) for p in filtros["productos"]]:
+        return volumen(None, nombre, color)
+    return volumen(resumen_volumen(nombre, filtros["anios"]), nombre, color)
+
+
+@memoizar
+def grafo_flujos(filtros):
+    """
+    Grafo origen-destino de las celdas del cubo que cumplen los filtros
+    """
+    if not any(filtros.values()):
+        return grafo_od
+    return GrafoFlujos.desde_cubo(indice.filtrar(**filtros))
+
+
+@memoizar
+def graficos_relaciones(filtros):
+    grafo_filtrado = grafo_flujos(filtros)
+    return relaciones_proveedor(grafo_filtrado), relaciones_destino(grafo_filtrado)
+
+
+@memoizar
+def grafico_mapa_municipios(filtros):
+    flujos = flujos_municipios(grafo_flujos(filtros), nombres)
+    return figura_municipios(
+        centroides_municipios,
+        flujos["CODIGO_MUNICIPIO_DANE_PROVEEDOR"].unique(),
+        flujos["CODIGO_MUNICIPIO_DANE_DESTINO"].unique(),
+        URL_GEOJSON,
+    )
+
+
+@memoizar
+def grafico_mapa_despachos(filtros):
+    return figura_relaciones(centroides_municipios, flujos_municipios(grafo_flujos(filtros), nombres))
+
+
+def paginar_municipios(id_tabla, columna_codigo):
+    """
+    Registrar el callback que filtra, ordena y pagina en el servidor una tabla de municipios
+    """
+    @app.callback(
+        Output(id_tabla, "data"),
+        Output(id_tabla, "page_current"),
+        Output(id_tabla, "page_count"),
+        Input(id_tabla, "page_current"),
+        Input(id_tabla, "page_size"),
+        Input(id_tabla, "sort_by"),
+        Input(id_tabla, "filter_query"),
+        *ENTRADAS_FILTROS,
+    )
+    @medida(f"paginar_{id_tabla}")
+    def paginar(page_current, page_size, sort_by, filter_query, *valores_filtros):
+        tabla = tabla_municipios_filtrada(crear_filtros(*valores_filtros), columna_codigo)
+        return consultar(tabla, page_current, page_size, sort_by, filter_query)
+
+    return paginar
+
+paginar_proveedores = paginar_municipios("tabla_proveedores", "CODIGO_MUNICIPIO_DANE_PROVEEDOR")
+paginar_destino = paginar_municipios("tabla_destino", "CODIGO_MUNICIPIO_DANE_DESTINO")
+
+
+@server.route("/geometria/<nombre>.geojson")
+def geometria_municipios(nombre):
+    """
+    Geometría de los municipios para los mapas de Plotly; la URL cambia con el contenido,
+    así que el navegador puede guardarla en caché indefinidamente
+    """
+    if f"/geometria/{nombre}.geojson" != URL_GEOJSON:
+        abort(404)
+    respuesta = Response(GEOJSON_MUNICIPIOS, mimetype="application/geo+json")
+    respuesta.headers["Cache-Control"] = CACHE_INMUTABLE
+    return respuesta
+
+
+@server.route("/mapas/<version>/<archivo>")
+def mapa_folium(version, archivo):
+    """
+    Mapas de Folium de los artefactos; la URL lleva la versión, así que no cambian nunca
+    """
+    if version != artefactos["version"] or archivo not in (MAPA_MUNICIPIOS, MAPA_DESPACHOS):
+        abort(404)
+    with open(os.path.join(artefactos["directorio"], archivo), "rb") as html_mapa:
+        respuesta = Response(html_mapa.read(), mimetype="text/html")
+    respuesta.headers["Cache-Control"] = CACHE_INMUTABLE
+    return respuesta
+
+
+@server.route("/cache")
+def estadisticas_cache():
+    """
+    Aciertos y fallos de la caché de figuras, para dimensionarla
+    """
+    return jsonify(memoizar.estadisticas())
+
+
+def nombre_solicitud():
+    """
+    Nombre del tramo de una solicitud: la regla de la ruta o, para los callbacks de Dash, sus salidas
+    """
+    if request.path.endswith("_dash-update-component"):
+        return "callback " + (request.get_json(silent=True) or {}).get("output", "")
+    return request.url_rule.rule if request.url_rule else "sin_ruta"
+
+
+# Con PERFILAR=cprofile o PERFILAR=pyinstrument se puede perfilar una solicitud: la que lleve
+# ?perfilar=1, o el siguiente callback después de POST /perfilar. El perfil se guarda en cache/perfiles.
+PERFILAR = os.environ.get("PERFILAR")
+perfilador = Perfilador(herramienta=PERFILAR) if PERFILAR else None
+
+
+@server.before_request
+def iniciar_solicitud():
+    g.inicio_solicitud = REGISTRO.iniciar()
+    if perfilador is not None and (request.args.get("perfilar") or request.path.endswith("_dash-update-component")):
+        g.perfil = perfilador.iniciar(forzar=bool(request.args.get("perfilar")))
+
+
+@server.after_request
+def terminar_solicitud(respuesta):
+    """
+    Medir cada solicitud completa, incluida la serialización de la respuesta del callback
+    """
+    nombre = nombre_solicitud()
+    if "inicio_solicitud" in g:
+        REGISTRO.terminar(f"http {nombre}", g.inicio_solicitud)
+    perfil = g.pop("perfil", None)
+    if perfil is not None:
+        respuesta.headers["X-Perfil"] = perfilador.terminar(perfil, nombre)
+    return respuesta
+
+
+@server.route("/metrics")
+def metricas():
+    """
+    Tramos del arranque, de los callbacks y de las solicitudes, etapas del ETL y caché, para Prometheus
+    """
+    texto = exponer(etapas_etl=artefactos["etapas"], cache=memoizar.estadisticas())
+    return Response(texto, mimetype="text/plain; version=0.0.4")
+
+
+def filtros_consulta(argumentos):
+    """
+    Filtros del tablero a partir de la consulta: anio_desde, anio_hasta y los parámetros repetibles
+    producto, comprador, departamento_proveedor y departamento_destino
+    """
+    rango_anios = [argumentos.get("anio_desde", anios[0], type=int), argumentos.get("anio_hasta", anios[-1], type=int)]
+    return crear_filtros(
+        rango_anios,
+        argumentos.getlist("producto") or None,
+        argumentos.getlist("comprador") or None,
+        argumentos.getlist("departamento_proveedor") or None,
+        argumentos.getlist("departamento_destino") or None,
+    )
+
+
+# Tablas agregadas exportables (valores numéricos, sin el formato de las DataTables)
+EXPORTABLES = {
+    "cubo": lambda filtros: indice.filtrar(**filtros),
+    "proveedores": lambda filtros: tabla_municipios_filtrada(filtros, "CODIGO_MUNICIPIO_DANE_PROVEEDOR"),
+    "destinos": lambda filtros: tabla_municipios_filtrada(filtros, "CODIGO_MUNICIPIO_DANE_DESTINO"),
+}
+
+
+@server.route("/api/exportar/<conjunto>.<formato>")
+def exportar(conjunto, formato):
+    """
+    Exportar en CSV, NDJSON o Parquet una tabla agregada (cubo, proveedores, destinos) o los despachos
+    individuales, con los filtros en la consulta, p. ej. /api/exportar/despachos.csv?anio_desde=2023&producto=B 100.
+    La respuesta se genera lote a lote, sin armar el resultado ni el archivo completos en memoria.
+    """
+    if formato not in FORMATOS or (conjunto != "despachos" and conjunto not in EXPORTABLES):
+        abort(404)
+    filtros = filtros_consulta(request.args)
+    if conjunto == "despachos":
+        esquema, lotes = lotes_despachos(artefactos["despachos"], filtros)
+    else:
+        esquema, lotes = lotes_tabla(EXPORTABLES[conjunto](filtros))
+
+    def contenido():
+        with tramo(f"exportar {conjunto}.{formato}"):
+            yield from serializar(esquema, lotes, formato)
+
+    respuesta = Response(contenido(), mimetype=FORMATOS[formato])
+    respuesta.headers["Content-Disposition"] = f'attachment; filename="{conjunto}.{formato}"'
+    return respuesta
+
+
+# Registrado después del de métricas, así que se ejecuta antes y su tiempo entra en la solicitud
+@server.after_request
+def preparar_entrega(respuesta):
+    """
+    Revalidación con ETag/Last-Modified de las respuestas GET y compresión gzip o brotli
+    """
+    respuesta = revalidable(respuesta, request, artefactos["version"], artefactos["construido"])
+    return comprimir(respuesta, request.accept_encodings)
+
+
+if perfilador is not None:
+    @server.route("/perfilar", methods=["POST"])
+    def armar_perfilador():
+        perfilador.armar()
+        return jsonify({"herramienta": perfilador.herramienta, "directorio": perfilador.directorio})
+
+
 if __name__ == "__main__":
     app.run(debug=True)
 
@@ -0,0 +1,263 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from ingesta import DIRECTORIO_CACHE, firma_archivo
+from agregaciones import PRODUCTOS
+from cubo import (
+    obtener_cubo,
+    obtener_cubo_historico,
+    cargar_distribucion,
+    despachos_cubo_por_bloques,
+    exportaciones_cubo,
+    incorporar,
+    limpiar_volumen,
+    version_datos,
+)
+from historico import RUTA_HISTORICO, rangos_cubiertos
+from geometria import RUTA_GEOJSON, ZOOM_MAPA, cargar_municipios
+from mapas import mapa_municipios, mapa_relaciones, centroides, geojson_municipios
+from grafo_flujos import GrafoFlujos, flujos_municipios
+from series import COLUMNAS_SERIE, SeriesDespachos
+from metricas import REGISTRO, medida, tramo
+
+# Cada construcción se guarda en un subdirectorio por versión; actual.json apunta a la que se sirve
+DIRECTORIO_ARTEFACTOS = os.path.join(DIRECTORIO_CACHE, "artefactos")
+_ACTUAL = "actual.json"
+_MANIFIESTO = "manifiesto.json"
+
+MAPA_MUNICIPIOS = "mapa_municipios.html"
+MAPA_DESPACHOS = "despachos_mapa.html"
+
+# Cambia cuando los artefactos incluyen archivos nuevos, para no servir una versión incompleta
+FORMATO_ARTEFACTOS = 5
+
+
+def version_artefactos(ruta_geojson=RUTA_GEOJSON):
+    """
+    Versión de los artefactos: cambia con las fuentes del cubo o con la capa de municipios
+    """
+    clave = f"{version_datos()}{firma_archivo(ruta_geojson)['sha256']}{FORMATO_ARTEFACTOS}"
+    return hashlib.sha256(clave.encode()).hexdigest()[:12]
+
+
+def _archivo_volumen(nombre):
+    return f"volumen_{nombre}.f8"
+
+
+def _abrir_volumen(ruta):
+    # np.memmap no admite archivos vacíos
+    if os.path.getsize(ruta) == 0:
+        return np.empty(0, dtype="float64")
+    return np.memmap(ruta, dtype="float64", mode="r")
+
+
+def _guardar_tabla(data, ruta):
+    """
+    Guardar una tabla en Arrow IPC sin comprimir, para abrirla después con memoria mapeada.
+    Los NaN de las columnas numéricas se guardan como valores, no como nulos, así pandas no tiene que copiarlas.
+    """
+    tabla = pa.Table.from_pandas(data, preserve_index=False)
+    for i, campo in enumerate(tabla.schema):
+        if pa.types.is_floating(campo.type):
+            tabla = tabla.set_column(i, campo, pa.array(data[campo.name].to_numpy(), from_pandas=False))
+    with ipc.new_file(ruta, tabla.schema) as escritor:
+        escritor.write_table(tabla)
+
+
+def _abrir_tabla(ruta):
+    # Las columnas numéricas y los códigos de las categóricas quedan como vistas de solo lectura
+    # sobre las páginas del archivo; solo el texto se copia
+    return ipc.open_file(pa.memory_map(ruta)).read_all().to_pandas(split_blocks=True)
+
+
+def _escribir_texto(ruta, texto):
+    with open(ruta, "w", encoding="utf-8") as archivo:
+        archivo.write(texto)
+
+
+def guardar_volumenes(directorio):
+    """
+    Escribir los volúmenes válidos de cada producto como float64 crudos, bloque a bloque,
+    para abrirlos después con memoria mapeada
+    """
+    archivos = {nombre: open(os.path.join(directorio, _archivo_volumen(nombre)), "wb") for nombre in PRODUCTOS.values()}
+    try:
+        for bloque in despachos_cubo_por_bloques(["PRODUCTO", "VOLUMEN_DESPACHADO", "CALIDAD"]):
+            bloque = limpiar_volumen(bloque)
+            for producto, nombre in PRODUCTOS.items():
+                volumen = bloque.loc[bloque["PRODUCTO"] == producto, "VOLUMEN_DESPACHADO"].dropna()
+                volumen.to_numpy(dtype="float64").tofile(archivos[nombre])
+    finally:
+        for archivo in archivos.values():
+            archivo.close()
+
+
+def guardar_series(directorio):
+    """
+    Escribir las series diarias de despachos por producto, comprador y departamentos
+    """
+    bloques = despachos_cubo_por_bloques(COLUMNAS_SERIE)
+    SeriesDespachos.desde_bloques(limpiar_volumen(bloque) for bloque in bloques).guardar(directorio)
+
+
+def fuentes_despachos(origen=None):
+    """
+    Archivos con los despachos individuales de los que sale el cubo, cada uno con los rangos de fechas
+    (AAAAMMDD) que cubre una exportación más reciente, para exportarlos sin repetir despachos
+    """
+    if origen is not None:
+        return [{"ruta": RUTA_HISTORICO, "excluidos": []}]
+    exportaciones = exportaciones_cubo()
+    excluidos = rangos_cubiertos(exportaciones)
+    return [{"ruta": datos["parquet"], "excluidos": excluidos[nombre]} for nombre, datos in exportaciones.items()]
+
+
+def construir_artefactos(directorio=DIRECTORIO_ARTEFACTOS, ruta_geojson=RUTA_GEOJSON, origen=None, procesos=None):
+    """
+    Ejecutar el ETL una sola vez y guardar todo lo que la aplicación necesita para servir:
+    cubo, municipios, distribución, volúmenes por producto, series diarias, centroides, GeoJSON y mapas de Folium.
+    Con un origen (directorio o patrón glob) se usan todas las exportaciones de SICOM.
+    """
+    with tramo("etl_cubo"):
+        cubo, municipios = obtener_cubo() if origen is None else obtener_cubo_historico(origen, procesos=procesos)
+    version = version_artefactos(ruta_geojson)
+    destino = os.path.join(directorio, version)
+    if not os.path.exists(os.path.join(destino, _MANIFIESTO)):
+        temporal = f"{destino}.{os.getpid()}.tmp"
+        shutil.rmtree(temporal, ignore_errors=True)
+        os.makedirs(temporal)
+
+        with tramo("etl_tablas"):
+            _guardar_tabla(cubo, os.path.join(temporal, "cubo.arrow"))
+            _guardar_tabla(municipios, os.path.join(temporal, "municipios.arrow"))
+            _guardar_tabla(cargar_distribucion(), os.path.join(temporal, "distribucion.arrow"))
+
+        # Volúmenes individuales para las distribuciones, en arreglos que se abren con memoria mapeada
+        with tramo("etl_volumenes"):
+            guardar_volumenes(temporal)
+        with tramo("etl_series"):
+            guardar_series(temporal)
+
+        # La geometría se une por municipio, no por despacho
+        with tramo("etl_geometria"):
+            gdf_m = cargar_municipios(zoom=ZOOM_MAPA, ruta_geojson=ruta_geojson)
+            gdf_municipios = gdf_m[["CODIGO_MUNICIPIO_DANE", "lat", "lon", "geometry"]].merge(municipios, on="CODIGO_MUNICIPIO_DANE")
+            _guardar_tabla(centroides(gdf_municipios), os.path.join(temporal, "centroides.arrow"))
+            _escribir_texto(os.path.join(temporal, "municipios.geojson"), geojson_municipios(gdf_m))
+
+        with tramo("etl_mapa_municipios"):
+            es_proveedor = gdf_municipios["CODIGO_MUNICIPIO_DANE"].isin(cubo["CODIGO_MUNICIPIO_DANE_PROVEEDOR"])
+            es_destino = gdf_municipios["CODIGO_MUNICIPIO_DANE"].isin(cubo["CODIGO_MUNICIPIO_DANE_DESTINO"])
+            gdf_proveedores = gdf_municipios[es_proveedor].rename(columns={"MUNICIPIO": "MUNICIPIO_PROVEEDOR"}).rename_geometry("geometry_proveedor")
+            gdf_destinos = gdf_municipios[es_destino].rename_geometry("geometry_destino")
+            mapa_municipios(gdf_proveedores, gdf_destinos).save(os.path.join(temporal, MAPA_MUNICIPIOS))
+
+        with tramo("etl_mapa_despachos"):
+            nombres = municipios.set_index("CODIGO_MUNICIPIO_DANE")["MUNICIPIO"]
+            flujos = flujos_municipios(GrafoFlujos.desde_cubo(cubo), nombres)
+            mapa = mapa_relaciones(centroides(gdf_proveedores, "MUNICIPIO_PROVEEDOR"), centroides(gdf_destinos), flujos)
+            mapa.save(os.path.join(temporal, MAPA_DESPACHOS))
+
+        # El manifiesto se escribe al final: un directorio sin manifiesto está incompleto
+        _escribir_texto(os.path.join(temporal, _MANIFIESTO), json.dumps({
+            "version": version,
+            "version_datos": version_datos(),
+            "geojson": firma_archivo(ruta_geojson),
+            "archivos": sorted(os.listdir(temporal)),
+            # Despachos individuales de los que sale el cubo, para exportarlos
+            "despachos": fuentes_despachos(origen),
+            "etapas": {
+                nombre: {"segundos": datos["segundos"], "cpu": datos["cpu"], "incremento_maximo": datos["incremento_maximo"]}
+                for nombre, datos in REGISTRO.resumen("etl_").items()
+            },
+        }, indent=2))
+        shutil.rmtree(destino, ignore_errors=True)
+        os.replace(temporal, destino)
+
+    temporal = os.path.join(directorio, f"{_ACTUAL}.{os.getpid()}.tmp")
+    _escribir_texto(temporal, json.dumps({"version": version}))
+    os.replace(temporal, os.path.join(directorio, _ACTUAL))
+    return version
+
+
+def limpiar_versiones(directorio=DIRECTORIO_ARTEFACTOS, conservar=2):
+    """
+    Borrar las versiones más antiguas, conservando la actual y las últimas construidas
+    """
+    actual = version_actual(directorio)
+    versiones = [
+        entrada for entrada in os.scandir(directorio)
+        if entrada.is_dir() and not entrada.name.endswith(".tmp") and entrada.name != actual
+    ]
+    versiones.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for entrada in versiones[max(conservar - 1, 0):]:
+        shutil.rmtree(entrada.path, ignore_errors=True)
+
+
+def version_actual(directorio=DIRECTORIO_ARTEFACTOS):
+    """
+    Versión de los artefactos que se está sirviendo (None si aún no se han construido)
+    """
+    try:
+        with open(os.path.join(directorio, _ACTUAL), encoding="utf-8") as archivo:
+            return json.load(archivo)["version"]
+    except FileNotFoundError:
+        return None
+
+
+@medida("arranque_artefactos")
+def cargar_artefactos(directorio=DIRECTORIO_ARTEFACTOS, version=None):
+    """
+    Cargar los artefactos ya construidos, sin repetir el ETL. Los volúmenes se abren con
+    memoria mapeada y las tablas se leen sin copiar de archivos Arrow mapeados, así que con gunicorn --preload
+    los workers comparten estas páginas con el proceso maestro.
+    """
+    version = version or version_actual(directorio)
+    if version is None:
+        raise FileNotFoundError(f"No hay artefactos en {directorio}; ejecute primero: python artefactos.py")
+    ruta = os.path.join(directorio, version)
+    with open(os.path.join(ruta, _MANIFIESTO), encoding="utf-8") as archivo:
+        manifiesto = json.load(archivo)
+    with open(os.path.join(ruta, "municipios.geojson"), encoding="utf-8") as archivo:
+        geojson = archivo.read()
+
+    return {
+        "version": manifiesto["version"],
+        "directorio": ruta,
+        "construido": os.path.getmtime(os.path.join(ruta, _MANIFIESTO)),
+        "cubo": _abrir_tabla(os.path.join(ruta, "cubo.arrow")),
+        "municipios": _abrir_tabla(os.path.join(ruta, "municipios.arrow")),
+        "centroides": _abrir_tabla(os.path.join(ruta, "centroides.arrow")),
+        "distribucion": _abrir_tabla(os.path.join(ruta, "distribucion.arrow")),
+        "volumenes": {
+            nombre: _abrir_volumen(os.path.join(ruta, _archivo_volumen(nombre)))
+            for nombre in PRODUCTOS.values()
+        },
+        "series": SeriesDespachos.abrir(ruta),
+        "despachos": manifiesto["despachos"],
+        "geojson": geojson,
+        "etapas": manifiesto.get("etapas", {}),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construir los artefactos que sirve la aplicación")
+    parser.add_argument("csv", nargs="*", help="Nuevas exportaciones de SICOM a incorporar antes de construir")
+    parser.add_argument("--historico", help="Directorio o patrón glob con todas las exportaciones de SICOM")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos para convertir las exportaciones")
+    parser.add_argument("--directorio", default=DIRECTORIO_ARTEFACTOS)
+    parser.add_argument("--conservar", type=int, default=2, help="Versiones de artefactos a conservar")
+    args = parser.parse_args()
+
+    for ruta in args.csv:
+        incorporar(ruta)
+    version = construir_artefactos(args.directorio, origen=args.historico, procesos=args.procesos)
+    limpiar_versiones(args.directorio, args.conservar)
+    print(f"Artefactos {version} en {os.path.join(args.directorio, version)}")
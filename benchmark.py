@@ -0,0 +1,217 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from agregaciones import PRODUCTOS
+from calidad import RUTA_GEOJSON, normalizar_dane
+from ingesta import RUTA_CSV, TAMANO_BLOQUE
+from medicion import Medicion
+
+TAMANOS = [100_000, 1_000_000, 10_000_000]
+COMPRADORES = ["DISTRIBUIDOR MAYORISTA", "REFINERIA", "COMERCIALIZADOR INDUSTRIAL"]
+# Una etapa es una regresión si tarda o aumenta la memoria más que la referencia por encima de esta fracción
+TOLERANCIA = 0.2
+
+_DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+def municipios_geojson(ruta_geojson=RUTA_GEOJSON):
+    """
+    Código DANE, departamento y nombre de los municipios de la capa, para generar despachos con códigos reales
+    """
+    with open(ruta_geojson, encoding="utf-8") as archivo:
+        propiedades = pd.DataFrame([f["properties"] for f in json.load(archivo)["features"]])
+    return pd.DataFrame({
+        "CODIGO": normalizar_dane(propiedades["dpto_ccdgo"], propiedades["mpio_ccdgo"]),
+        "DEPARTAMENTO": propiedades["dpto_cnmbr"],
+        "MUNICIPIO": propiedades["mpio_cnmbr"],
+    }).drop_duplicates("CODIGO").reset_index(drop=True)
+
+
+def generar_despachos(ruta_csv, filas, municipios=None, anios=(2021, 2025), productos=tuple(PRODUCTOS),
+                      semilla=0, ruta_geojson=RUTA_GEOJSON, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Escribir un CSV sintético con el esquema de la exportación de SICOM, por bloques.
+    Los proveedores son la mitad de los municipios elegidos; los destinos, todos.
+    """
+    catalogo = municipios_geojson(ruta_geojson)
+    generador = np.random.default_rng(semilla)
+    if municipios:
+        catalogo = catalogo.iloc[np.sort(generador.choice(len(catalogo), min(municipios, len(catalogo)), replace=False))]
+    catalogo = catalogo.reset_index(drop=True)
+    proveedores = catalogo.iloc[: max(1, len(catalogo) // 2)]
+    inicio = np.datetime64(f"{anios[0]}-01-01")
+    dias = int((np.datetime64(f"{anios[1] + 1}-01-01") - inicio).astype(int))
+
+    for desde in range(0, filas, tamano_bloque):
+        n = min(tamano_bloque, filas - desde)
+        fechas = pd.DatetimeIndex(inicio + generador.integers(0, dias, n).astype("timedelta64[D]"))
+        origen = proveedores.iloc[generador.integers(0, len(proveedores), n)]
+        destino = catalogo.iloc[generador.integers(0, len(catalogo), n)]
+        bloque = pd.DataFrame({
+            "ANIO_DESPACHO": fechas.year,
+            "MES_DESPACHO": fechas.month,
+            "DIA_DESPACHO": fechas.day,
+            "PRODUCTO": generador.choice(list(productos), n),
+            "TIPO_COMPRADOR": generador.choice(COMPRADORES, n),
+            "CODIGO_MUNICIPIO_DANE_PROVEEDOR": origen["CODIGO"].to_numpy(),
+            "DEPARTAMENTO_PROVEEDOR": origen["DEPARTAMENTO"].to_numpy(),
+            "MUNICIPIO_PROVEEDOR": origen["MUNICIPIO"].to_numpy(),
+            "CODIGO_MUNICIPIO_DANE_DESTINO": destino["CODIGO"].to_numpy(),
+            "DEPARTAMENTO": destino["DEPARTAMENTO"].to_numpy(),
+            "MUNICIPIO": destino["MUNICIPIO"].to_numpy(),
+            "VOLUMEN_DESPACHADO": np.round(generador.lognormal(9, 1.5, n), 2),
+        })
+        bloque.to_csv(ruta_csv, mode="w" if desde == 0 else "a", header=desde == 0, index=False)
+
+
+def medir_etapas(filas, municipios=None, anios=(2021, 2025), semilla=0):
+    """
+    Generar los datos en el directorio actual y medir cada etapa, del CSV a las respuestas de la aplicación
+    """
+    mediciones = []
+
+    def etapa(nombre):
+        mediciones.append(Medicion(nombre))
+        return mediciones[-1]
+
+    with etapa("generar_csv"):
+        generar_despachos(RUTA_CSV, filas, municipios, anios, semilla=semilla)
+
+    from ingesta import construir_cache
+    from cubo import obtener_cubo
+    from agregaciones import tabla_municipios
+    from artefactos import construir_artefactos
+
+    with etapa("ingesta_csv"):
+        construir_cache()
+    with etapa("cubo"):
+        cubo, municipios_cubo = obtener_cubo()
+    with etapa("tablas_municipios"):
+        tabla_municipios(cubo, municipios_cubo, "CODIGO_MUNICIPIO_DANE_PROVEEDOR")
+        tabla_municipios(cubo, municipios_cubo, "CODIGO_MUNICIPIO_DANE_DESTINO")
+    with etapa("artefactos_y_mapas"):
+        construir_artefactos()
+
+    with etapa("arranque_app"):
+        import app
+    from plotly.utils import PlotlyJSONEncoder
+    from mapas import figura_municipios, figura_relaciones
+    from grafo_flujos import flujos_municipios
+
+    with etapa("series_mensuales"):
+        for producto, nombre in PRODUCTOS.items():
+            app.despachos(app.cubo[app.cubo["PRODUCTO"] == producto], nombre)
+    with etapa("mapas_plotly"):
+        flujos = flujos_municipios(app.grafo_od, app.nombres)
+        figura_municipios(app.centroides_municipios, flujos["CODIGO_MUNICIPIO_DANE_PROVEEDOR"].unique(),
+                          flujos["CODIGO_MUNICIPIO_DANE_DESTINO"].unique(), app.URL_GEOJSON)
+        figura_relaciones(app.centroides_municipios, flujos)
+    with etapa("serializar_layout"):
+        json.dumps(app.app.layout, cls=PlotlyJSONEncoder)
+        for pestana in app.PESTANAS.values():
+            json.dumps(pestana(), cls=PlotlyJSONEncoder)
+    with etapa("callback_filtrado"):
+        anios_app = app.anios
+        json.dumps(app.filtrar_despachos("dia", [anios_app[0], anios_app[0]], None, None, None, None), cls=PlotlyJSONEncoder)
+        json.dumps(app.filtrar_volumen([anios_app[0], anios_app[0]], None, None, None, None), cls=PlotlyJSONEncoder)
+
+    return [{"filas": filas, **medicion.resultado} for medicion in mediciones]
+
+
+def ejecutar(tamanos, municipios=None, anios=(2021, 2025), semilla=0):
+    """
+    Medir cada tamaño en un proceso y directorio nuevos (caché, memoria y módulos limpios)
+    """
+    resultados = []
+    for filas in tamanos:
+        with tempfile.TemporaryDirectory() as directorio:
+            os.symlink(os.path.join(_DIRECTORIO, RUTA_GEOJSON), os.path.join(directorio, RUTA_GEOJSON))
+            salida = os.path.join(directorio, "resultados.json")
+            comando = [sys.executable, os.path.abspath(__file__), "--interno", "--filas", str(filas), "--salida", salida,
+                       "--anios", str(anios[0]), str(anios[1]), "--semilla", str(semilla)]
+            if municipios:
+                comando += ["--municipios", str(municipios)]
+            subprocess.run(comando, cwd=directorio, check=True, env={**os.environ, "CACHE_BACKEND": "memoria"})
+            with open(salida, encoding="utf-8") as archivo:
+                resultados.extend(json.load(archivo))
+    return {
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "resultados": resultados,
+    }
+
+
+def comparar(reporte, referencia, tolerancia=TOLERANCIA):
+    """
+    Etapas que tardan o aumentan la memoria residente más que en la referencia, por encima de la tolerancia
+    (se compara el aumento dentro de cada etapa, no el pico del proceso, que arrastra las etapas anteriores)
+    """
+    anteriores = {(r["filas"], r["etapa"]): r for r in referencia["resultados"]}
+    regresiones = []
+    for actual in reporte["resultados"]:
+        anterior = anteriores.get((actual["filas"], actual["etapa"]))
+        if anterior is None:
+            continue
+        for medida in ["segundos", "rss_incremento"]:
+            if anterior.get(medida, 0) > 0 and actual[medida] > anterior[medida] * (1 + tolerancia):
+                regresiones.append({
+                    "filas": actual["filas"],
+                    "etapa": actual["etapa"],
+                    "medida": medida,
+                    "referencia": anterior[medida],
+                    "actual": actual[medida],
+                    "razon": actual[medida] / anterior[medida],
+                })
+    return regresiones
+
+
+def imprimir(reporte, regresiones):
+    tabla = pd.DataFrame(reporte["resultados"])
+    tabla["rss_pico_mb"] = tabla["rss_pico"] / 2 ** 20
+    tabla["rss_incremento_mb"] = tabla["rss_incremento"] / 2 ** 20
+    columnas = ["filas", "etapa", "segundos", "cpu", "rss_incremento_mb", "rss_pico_mb"]
+    print(tabla[columnas].to_string(index=False, float_format="{:,.2f}".format))
+    for r in regresiones:
+        print(f"⚠️  Regresión en {r['etapa']} ({r['filas']:,} filas): {r['medida']} {r['referencia']:,.2f} → {r['actual']:,.2f} (x{r['razon']:.2f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Medir el ETL y la aplicación con datos sintéticos")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=TAMANOS, help="Número de despachos a generar")
+    parser.add_argument("--municipios", type=int, default=None, help="Municipios de la capa a usar (todos por defecto)")
+    parser.add_argument("--anios", type=int, nargs=2, default=[2021, 2025])
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--reporte", default="benchmark.json", help="Archivo JSON con los resultados")
+    parser.add_argument("--referencia", help="Reporte anterior con el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA)
+    parser.add_argument("--interno", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--filas", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--salida", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.interno:
+        with open(args.salida, "w", encoding="utf-8") as archivo:
+            json.dump(medir_etapas(args.filas, args.municipios, args.anios, args.semilla), archivo)
+        sys.exit(0)
+
+    reporte = ejecutar(args.tamanos, args.municipios, args.anios, args.semilla)
+    regresiones = []
+    if args.referencia:
+        with open(args.referencia, encoding="utf-8") as archivo:
+            regresiones = comparar(reporte, json.load(archivo), args.tolerancia)
+    reporte["regresiones"] = regresiones
+    with open(args.reporte, "w", encoding="utf-8") as archivo:
+        json.dump(reporte, archivo, indent=2)
+    imprimir(reporte, regresiones)
+    sys.exit(1 if regresiones else 0)
@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from cuantiles import cubeta, cuantiles
+
+# Marcas de calidad de cada despacho (columna CALIDAD, combinables con |)
+ATIPICO = 1
+SIN_VOLUMEN = 2
+PROVEEDOR_SIN_GEOMETRIA = 4
+DESTINO_SIN_GEOMETRIA = 8
+
+# Reglas de volúmenes atípicos por producto ("*" para los demás):
+#   {"regla": "umbral", "minimo": ..., "maximo": ...}  límites fijos
+#   {"regla": "iqr", "factor": 3.0}                    fuera de [Q1 - f·RIC, Q3 + f·RIC]
+# Se pueden cambiar con un archivo JSON indicado en la variable de entorno REGLAS_CALIDAD
+REGLAS_ATIPICOS = {"*": {"regla": "umbral", "maximo": 3.1e6}}
+
+RUTA_GEOJSON = "Municipios_Interes.geojson"
+
+
+def cargar_reglas(ruta=None):
+    """
+    Reglas de atípicos configuradas (o las predeterminadas)
+    """
+    ruta = ruta or os.environ.get("REGLAS_CALIDAD")
+    if not ruta:
+        return REGLAS_ATIPICOS
+    with open(ruta, encoding="utf-8") as archivo:
+        return json.load(archivo)
+
+
+def normalizar_dane(departamento, municipio):
+    """
+    Código DANE de municipio (entero de 5 dígitos) a partir de los códigos de departamento y
+    municipio, con aritmética en lugar de concatenar textos rellenados con ceros
+    """
+    return (pd.to_numeric(departamento).astype("int32") * 1000 + pd.to_numeric(municipio).astype("int32")).astype("int32")
+
+
+def codigos_geometria(ruta_geojson=RUTA_GEOJSON):
+    """
+    Códigos DANE de los municipios con geometría (solo se leen las propiedades del GeoJSON)
+    """
+    with open(ruta_geojson, encoding="utf-8") as archivo:
+        propiedades = pd.DataFrame([f["properties"] for f in json.load(archivo)["features"]])
+    return np.sort(normalizar_dane(propiedades["dpto_ccdgo"], propiedades["mpio_ccdgo"]).to_numpy())
+
+
+def _regla(reglas, producto):
+    return reglas.get(producto, reglas.get("*", {}))
+
+
+def umbrales_atipicos(bloques, reglas=None):
+    """
+    Límites (mínimo, máximo) del volumen válido de cada producto. Las reglas IQR necesitan
+    los cuartiles de todo el archivo: se estiman con el histograma logarítmico recorriendo los bloques.
+    """
+    reglas = reglas or cargar_reglas()
+    conteos = {}
+    for bloque in bloques:
+        validos = bloque[bloque["VOLUMEN_DESPACHADO"].notna()]
+        celdas = pd.DataFrame({
+            "PRODUCTO": validos["PRODUCTO"].astype(str).to_numpy(),
+            "CUBETA": cubeta(validos["VOLUMEN_DESPACHADO"].to_numpy()),
+        })
+        for (producto, indice), cantidad in celdas.value_counts().items():
+            conteos.setdefault(producto, {})
+            conteos[producto][indice] = conteos[producto].get(indice, 0) + cantidad
+
+    umbrales = {}
+    for producto, histograma in conteos.items():
+        regla = _regla(reglas, producto)
+        if regla.get("regla") == "iqr":
+            q1, q3 = cuantiles(list(histograma), list(histograma.values()), [0.25, 0.75])
+            factor = regla.get("factor", 1.5)
+            umbrales[producto] = (float(q1 - factor * (q3 - q1)), float(q3 + factor * (q3 - q1)))
+        else:
+            umbrales[producto] = (regla.get("minimo", -np.inf), regla.get("maximo", np.inf))
+    return umbrales
+
+
+def necesita_umbrales(reglas=None):
+    """
+    Si alguna regla depende de la distribución de los datos (y requiere una pasada previa)
+    """
+    return any(regla.get("regla") == "iqr" for regla in (reglas or cargar_reglas()).values())
+
+
+def umbrales_fijos(reglas=None):
+    """
+    Límites de las reglas de umbral, aplicables sin recorrer los datos
+    """
+    reglas = reglas or cargar_reglas()
+    return {producto: (regla.get("minimo", -np.inf), regla.get("maximo", np.inf)) for producto, regla in reglas.items()}
+
+
+def marcar(bloque, umbrales, codigos_validos):
+    """
+    Añadir la columna CALIDAD con las marcas de cada despacho. El volumen original se conserva;
+    los agregados descartan los volúmenes marcados como atípicos.
+    """
+    volumen = bloque["VOLUMEN_DESPACHADO"]
+    productos = bloque["PRODUCTO"]
+    defecto = umbrales.get("*", (-np.inf, np.inf))
+    limites = {producto: umbrales.get(str(producto), defecto) for producto in productos.unique()}
+    minimo = productos.map({producto: inferior for producto, (inferior, _) in limites.items()}).astype("float64")
+    maximo = productos.map({producto: superior for producto, (_, superior) in limites.items()}).astype("float64")
+
+    calidad = np.zeros(len(bloque), dtype="uint8")
+    calidad[((volumen < minimo) | (volumen > maximo)).to_numpy()] |= ATIPICO
+    calidad[volumen.isna().to_numpy()] |= SIN_VOLUMEN
+    calidad[~np.isin(bloque["CODIGO_MUNICIPIO_DANE_PROVEEDOR"].to_numpy(), codigos_validos)] |= PROVEEDOR_SIN_GEOMETRIA
+    calidad[~np.isin(bloque["CODIGO_MUNICIPIO_DANE_DESTINO"].to_numpy(), codigos_validos)] |= DESTINO_SIN_GEOMETRIA
+    return bloque.assign(CALIDAD=calidad)
+
+
+def acumular_reporte(reporte, bloque):
+    """
+    Sumar al reporte los conteos de marcas y los códigos DANE sin geometría del bloque
+    """
+    calidad = bloque["CALIDAD"].to_numpy()
+    reporte["despachos"] = reporte.get("despachos", 0) + len(bloque)
+    for nombre, marca in [("atipicos", ATIPICO), ("sin_volumen", SIN_VOLUMEN)]:
+        reporte[nombre] = reporte.get(nombre, 0) + int(((calidad & marca) != 0).sum())
+    for nombre, columna, marca in [
+        ("proveedores_sin_geometria", "CODIGO_MUNICIPIO_DANE_PROVEEDOR", PROVEEDOR_SIN_GEOMETRIA),
+        ("destinos_sin_geometria", "CODIGO_MUNICIPIO_DANE_DESTINO", DESTINO_SIN_GEOMETRIA),
+    ]:
+        faltantes = reporte.setdefault(nombre, {})
+        for codigo, cantidad in bloque.loc[(calidad & marca) != 0, columna].value_counts().items():
+            faltantes[str(codigo)] = faltantes.get(str(codigo), 0) + int(cantidad)
+    return reporte
+
+
+def ruta_reporte(ruta_parquet):
+    return os.path.splitext(ruta_parquet)[0] + ".calidad.json"
+
+
+def guardar_reporte(reporte, ruta_parquet):
+    temporal = f"{ruta_reporte(ruta_parquet)}.{os.getpid()}.tmp"
+    with open(temporal, "w", encoding="utf-8") as archivo:
+        json.dump(reporte, archivo, indent=2, ensure_ascii=False)
+    os.replace(temporal, ruta_reporte(ruta_parquet))
+
+
+def leer_reporte(ruta_parquet):
+    """
+    Reporte de calidad guardado junto al Parquet de una exportación (None si no existe)
+    """
+    try:
+        with open(ruta_reporte(ruta_parquet), encoding="utf-8") as archivo:
+            return json.load(archivo)
+    except FileNotFoundError:
+        return None
+
+
+def umbrales_reporte(ruta_parquet):
+    """
+    Umbrales de atípicos con que se marcó una exportación, según su reporte de calidad
+    """
+    return {producto: tuple(limites) for producto, limites in leer_reporte(ruta_parquet)["umbrales"].items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mostrar el reporte de calidad de una exportación ya ingerida")
+    parser.add_argument("parquet", help="Parquet en caché de la exportación")
+    args = parser.parse_args()
+
+    reporte = leer_reporte(args.parquet)
+    if reporte is None:
+        parser.error(f"No hay reporte de calidad para {args.parquet}")
+    print(json.dumps(reporte, indent=2, ensure_ascii=False))
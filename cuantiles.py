@@ -0,0 +1,44 @@
+import numpy as np
+
+# Histograma logarítmico (tipo DDSketch): cada cubeta cubre [γ^(i-1), γ^i), así que
+# cualquier cuantil se estima con error relativo menor a ERROR_RELATIVO. Dos histogramas
+# se combinan sumando los conteos de cada cubeta, igual que las medidas del cubo.
+ERROR_RELATIVO = 0.01
+GAMMA = (1 + ERROR_RELATIVO) / (1 - ERROR_RELATIVO)
+
+# Cubeta para volúmenes nulos o negativos
+CUBETA_CERO = np.iinfo("int32").min
+
+
+def cubeta(valores, gamma=GAMMA):
+    """
+    Índice de la cubeta de cada valor
+    """
+    valores = np.asarray(valores, dtype="float64")
+    positivos = valores > 0
+    indices = np.full(len(valores), CUBETA_CERO, dtype="int32")
+    indices[positivos] = np.ceil(np.log(valores[positivos]) / np.log(gamma))
+    return indices
+
+
+def valor_cubeta(indices, gamma=GAMMA):
+    """
+    Valor representativo de cada cubeta (el de menor error relativo dentro de ella)
+    """
+    indices = np.asarray(indices)
+    valores = 2 * np.power(gamma, indices.astype("float64")) / (gamma + 1)
+    return np.where(indices == CUBETA_CERO, 0.0, valores)
+
+
+def cuantiles(cubetas, conteos, probabilidades, gamma=GAMMA):
+    """
+    Estimar los cuantiles a partir de los conteos por cubeta
+    """
+    cubetas, conteos = np.asarray(cubetas), np.asarray(conteos)
+    if conteos.sum() == 0:
+        return np.full(len(probabilidades), np.nan)
+    orden = np.argsort(cubetas, kind="stable")
+    acumulado = np.cumsum(conteos[orden])
+    rangos = np.asarray(probabilidades, dtype="float64") * (acumulado[-1] - 1)
+    posiciones = np.searchsorted(acumulado, rangos, side="right")
+    return valor_cubeta(cubetas[orden][posiciones], gamma)
@@ -0,0 +1,330 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from ingesta import (
+    RUTA_CSV,
+    DIRECTORIO_CACHE,
+    cargar_despachos_por_bloques,
+    convertir_depurado,
+    depurado_vigente,
+    firma_coincide,
+    guardar_parquet,
+    leer_metadato,
+    ruta_parquet,
+)
+from historico import (
+    RUTA_HISTORICO,
+    construir_historico,
+    anios_rangos,
+    describir_exportacion,
+    leer_exportaciones_por_bloques,
+    leer_historico_por_bloques,
+    leer_manifiesto,
+    rangos_modificados,
+)
+from cuantiles import cubeta
+from metricas import medida
+from calidad import ATIPICO, cargar_reglas, umbrales_reporte
+
+# Dimensiones y medidas del cubo de despachos
+DIMENSIONES = [
+    "ANIO_DESPACHO",
+    "MES_DESPACHO",
+    "PRODUCTO",
+    "TIPO_COMPRADOR",
+    "CODIGO_MUNICIPIO_DANE_PROVEEDOR",
+    "CODIGO_MUNICIPIO_DANE_DESTINO",
+]
+MEDIDAS = ["CANTIDAD", "CANTIDAD_VOLUMEN", "VOLUMEN", "VOLUMEN_CUADRADOS"]
+EXTREMOS = {"VOLUMEN_MIN": "min", "VOLUMEN_MAX": "max"}
+AGREGACIONES = {**{medida: "sum" for medida in MEDIDAS}, **EXTREMOS}
+CATEGORICAS = ["PRODUCTO", "TIPO_COMPRADOR"]
+
+# Distribución del volumen: conteo de despachos por mes, producto y cubeta del histograma logarítmico
+DIMENSIONES_DISTRIBUCION = ["ANIO_DESPACHO", "MES_DESPACHO", "PRODUCTO", "CUBETA"]
+AGREGACIONES_DISTRIBUCION = {"CANTIDAD": "sum"}
+
+RUTA_CUBO = os.path.join(DIRECTORIO_CACHE, "cubo_despachos.parquet")
+RUTA_MUNICIPIOS = os.path.join(DIRECTORIO_CACHE, "municipios.parquet")
+RUTA_DISTRIBUCION = os.path.join(DIRECTORIO_CACHE, "distribucion_volumen.parquet")
+# Las exportaciones incorporadas con `incorporar` se convierten aquí, marcadas con los umbrales del CSV base
+DIRECTORIO_INCORPORADAS = os.path.join(DIRECTORIO_CACHE, "incorporadas")
+_CLAVE_FUENTES = "fuentes"
+_CLAVE_EXPORTACIONES = "exportaciones"
+# Histórico particionado del que sale el cubo (ausente si sale del CSV base y sus incorporaciones)
+_CLAVE_ORIGEN = "origen"
+
+# Cambia cuando cambian las columnas del cubo guardado, para no reutilizar uno anterior
+_CLAVE_FORMATO = "formato"
+FORMATO_CUBO = 4
+_CLAVE_REGLAS = "reglas_calidad"
+
+def limpiar_volumen(data):
+    """
+    Marcar como faltantes los volúmenes que la etapa de calidad señaló como atípicos
+    """
+    data = data.copy()
+    data.loc[(data["CALIDAD"] & ATIPICO) != 0, "VOLUMEN_DESPACHADO"] = np.nan
+    return data
+
+
+def _periodo(anio, mes):
+    return anio.astype("int32") * 12 + mes.astype("int32")
+
+
+def construir_cubo(data):
+    """
+    Resumir los despachos por año, mes, producto, tipo de comprador,
+    municipio proveedor y municipio destino
+    """
+    volumen = data["VOLUMEN_DESPACHADO"]
+    celdas = data[DIMENSIONES].assign(
+        CANTIDAD=1,
+        CANTIDAD_VOLUMEN=volumen.notna().astype("int64"),
+        VOLUMEN=volumen.fillna(0.0),
+        VOLUMEN_CUADRADOS=volumen.fillna(0.0) ** 2,
+        VOLUMEN_MIN=volumen,
+        VOLUMEN_MAX=volumen,
+    )
+    return _sumar_celdas(celdas)
+
+
+def construir_distribucion(data):
+    """
+    Conteo de volúmenes válidos por año, mes, producto y cubeta del histograma
+    """
+    validos = data[data["VOLUMEN_DESPACHADO"].notna()]
+    celdas = validos[["ANIO_DESPACHO", "MES_DESPACHO", "PRODUCTO"]].assign(
+        CUBETA=cubeta(validos["VOLUMEN_DESPACHADO"].to_numpy()),
+        CANTIDAD=1,
+    )
+    return _sumar_celdas(celdas, DIMENSIONES_DISTRIBUCION, AGREGACIONES_DISTRIBUCION)
+
+
+def _sumar_celdas(celdas, dimensiones=DIMENSIONES, agregaciones=AGREGACIONES):
+    for columna in CATEGORICAS:
+        if columna in celdas:
+            celdas[columna] = celdas[columna].astype("category")
+    return celdas.groupby(dimensiones, observed=True).agg(agregaciones).reset_index()
+
+
+def _combinar(partes, dimensiones=DIMENSIONES, agregaciones=AGREGACIONES):
+    """
+    Unir cubos parciales (cada uno con sus propias categorías) y volver a agregar las celdas repetidas
+    """
+    texto = {columna: str for columna in CATEGORICAS if columna in dimensiones}
+    tipos = {columna: partes[0][columna].dtype for columna in dimensiones if columna not in texto}
+    celdas = pd.concat([parte.astype(texto) for parte in partes], ignore_index=True)
+    return _sumar_celdas(celdas, dimensiones, agregaciones).astype(tipos)
+
+
+@medida("etl_agregacion")
+def construir_por_bloques(bloques):
+    """
+    Construir el cubo, la tabla de municipios y la distribución del volumen leyendo los
+    despachos por bloques: cada bloque se resume y se combina con lo acumulado, de modo que
+    la memoria depende del tamaño del bloque y del número de celdas, no del número de despachos
+    """
+    cubo, municipios, distribucion = None, None, None
+    for bloque in bloques:
+        bloque = limpiar_volumen(bloque)
+        parciales = construir_cubo(bloque), construir_municipios(bloque), construir_distribucion(bloque)
+        if cubo is None:
+            cubo, municipios, distribucion = parciales
+            continue
+        cubo = _combinar([cubo, parciales[0]])
+        municipios = _unir_municipios([municipios, parciales[1]])
+        distribucion = _combinar([distribucion, parciales[2]], DIMENSIONES_DISTRIBUCION, AGREGACIONES_DISTRIBUCION)
+    return cubo, municipios, distribucion
+
+
+def construir_municipios(data):
+    """
+    Tabla de municipios (código DANE, departamento y nombre) presentes en los despachos
+    """
+    columnas = ["CODIGO_MUNICIPIO_DANE", "DEPARTAMENTO", "MUNICIPIO"]
+    proveedores = data[["CODIGO_MUNICIPIO_DANE_PROVEEDOR", "DEPARTAMENTO_PROVEEDOR", "MUNICIPIO_PROVEEDOR"]].set_axis(columnas, axis=1)
+    destinos = data[["CODIGO_MUNICIPIO_DANE_DESTINO", "DEPARTAMENTO", "MUNICIPIO"]].set_axis(columnas, axis=1)
+    return _unir_municipios([proveedores, destinos])
+
+
+def _unir_municipios(tablas):
+    municipios = pd.concat([t.astype({"DEPARTAMENTO": str, "MUNICIPIO": str}) for t in tablas], ignore_index=True)
+    municipios = municipios.drop_duplicates("CODIGO_MUNICIPIO_DANE").sort_values("CODIGO_MUNICIPIO_DANE")
+    return municipios.astype({"CODIGO_MUNICIPIO_DANE": "int32"}).reset_index(drop=True)
+
+
+def actualizar_cubo(cubo, municipios, distribucion, bloques, rangos):
+    """
+    Recalcular solo los meses que tocan los rangos de fechas (pares AAAAMMDD) de las exportaciones
+    incorporadas, reemplazadas o retiradas. `bloques` son los despachos vigentes (sin rangos repetidos)
+    de al menos esos meses, p. ej. solo de sus años; el resto de las celdas se conserva.
+    """
+    meses = set()
+    for inicio, fin in rangos:
+        meses.update(range((inicio // 10000) * 12 + inicio // 100 % 100, (fin // 10000) * 12 + fin // 100 % 100 + 1))
+
+    def en_meses(data):
+        return _periodo(data["ANIO_DESPACHO"], data["MES_DESPACHO"]).isin(meses)
+
+    nuevos = (bloque[en_meses(bloque)] for bloque in bloques)
+    cubo_nuevo, municipios_nuevos, distribucion_nueva = construir_por_bloques(nuevos)
+    conservados = cubo[~en_meses(cubo)]
+    distribucion_conservada = distribucion[~en_meses(distribucion)]
+    if cubo_nuevo is None:
+        return conservados, municipios, distribucion_conservada
+    return (
+        _combinar([conservados, cubo_nuevo]),
+        _unir_municipios([municipios, municipios_nuevos]),
+        _combinar([distribucion_conservada, distribucion_nueva], DIMENSIONES_DISTRIBUCION, AGREGACIONES_DISTRIBUCION),
+    )
+
+
+def guardar_cubo(cubo, municipios, distribucion, exportaciones, ruta_cubo=RUTA_CUBO, ruta_municipios=RUTA_MUNICIPIOS, ruta_distribucion=RUTA_DISTRIBUCION, origen=None):
+    """
+    Guardar el cubo, la tabla de municipios y la distribución del volumen junto con las exportaciones
+    de las que salen (Parquet, firma del CSV y rango de fechas de cada una) y el histórico de origen
+    """
+    fuentes = {nombre: datos["firma"] for nombre, datos in exportaciones.items()}
+    guardar_parquet(municipios, ruta_municipios)
+    guardar_parquet(distribucion, ruta_distribucion)
+    guardar_parquet(cubo, ruta_cubo, {
+        _CLAVE_FUENTES: fuentes,
+        _CLAVE_EXPORTACIONES: exportaciones,
+        _CLAVE_ORIGEN: origen,
+        _CLAVE_FORMATO: FORMATO_CUBO,
+        _CLAVE_REGLAS: cargar_reglas(),
+    })
+
+
+def cargar_cubo(ruta_cubo=RUTA_CUBO, ruta_municipios=RUTA_MUNICIPIOS, ruta_distribucion=RUTA_DISTRIBUCION):
+    """
+    Leer el cubo, la tabla de municipios, la distribución del volumen y las exportaciones ya incorporadas
+    """
+    return (
+        pd.read_parquet(ruta_cubo),
+        pd.read_parquet(ruta_municipios),
+        pd.read_parquet(ruta_distribucion),
+        exportaciones_cubo(ruta_cubo),
+    )
+
+
+def exportaciones_cubo(ruta_cubo=RUTA_CUBO):
+    return leer_metadato(ruta_cubo, _CLAVE_EXPORTACIONES) or {}
+
+
+def despachos_cubo_por_bloques(columnas=None, ruta_cubo=RUTA_CUBO):
+    """
+    Recorrer por bloques los despachos de los que sale el cubo guardado (sus exportaciones, sin fechas repetidas)
+    """
+    yield from leer_exportaciones_por_bloques(exportaciones_cubo(ruta_cubo), columnas)
+
+
+def formato_vigente(ruta_cubo=RUTA_CUBO, ruta_municipios=RUTA_MUNICIPIOS, ruta_distribucion=RUTA_DISTRIBUCION):
+    """
+    Verificar que el cubo guardado está completo, tiene las columnas del formato actual
+    y se construyó con las reglas de calidad vigentes
+    """
+    return (
+        os.path.exists(ruta_municipios)
+        and os.path.exists(ruta_distribucion)
+        and leer_metadato(ruta_cubo, _CLAVE_FORMATO) == FORMATO_CUBO
+        and leer_metadato(ruta_cubo, _CLAVE_REGLAS) == cargar_reglas()
+    )
+
+
+def cargar_distribucion(ruta_distribucion=RUTA_DISTRIBUCION):
+    return pd.read_parquet(ruta_distribucion)
+
+
+def version_datos(ruta_cubo=RUTA_CUBO):
+    """
+    Marca corta que cambia cada vez que el cubo incorpora fuentes distintas o se construye con otras reglas de calidad
+    """
+    clave = {
+        "fuentes": leer_metadato(ruta_cubo, _CLAVE_FUENTES) or {},
+        "reglas": leer_metadato(ruta_cubo, _CLAVE_REGLAS),
+    }
+    return hashlib.sha256(json.dumps(clave, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def obtener_cubo(ruta_csv=RUTA_CSV, ruta_cubo=RUTA_CUBO, ruta_municipios=RUTA_MUNICIPIOS, ruta_distribucion=RUTA_DISTRIBUCION):
+    """
+    Cargar el cubo desde disco, o construirlo por bloques si el CSV base cambió
+    """
+    fuentes = leer_metadato(ruta_cubo, _CLAVE_FUENTES) or {}
+    if (
+        formato_vigente(ruta_cubo, ruta_municipios, ruta_distribucion)
+        and leer_metadato(ruta_cubo, _CLAVE_ORIGEN) is None
+        and firma_coincide(ruta_csv, fuentes.get(os.path.basename(ruta_csv)))
+    ):
+        cubo, municipios, _, _ = cargar_cubo(ruta_cubo, ruta_municipios, ruta_distribucion)
+        return cubo, municipios
+
+    cubo, municipios, distribucion = construir_por_bloques(cargar_despachos_por_bloques(ruta_csv))
+    exportaciones = {os.path.basename(ruta_csv): describir_exportacion(ruta_parquet(ruta_csv))}
+    guardar_cubo(cubo, municipios, distribucion, exportaciones, ruta_cubo, ruta_municipios, ruta_distribucion)
+    return cubo, municipios
+
+
+def obtener_cubo_historico(origen, ruta_historico=RUTA_HISTORICO, procesos=None, ruta_cubo=RUTA_CUBO, ruta_municipios=RUTA_MUNICIPIOS, ruta_distribucion=RUTA_DISTRIBUCION):
+    """
+    Cargar el cubo de todas las exportaciones de un directorio o patrón glob, recorriendo el histórico
+    particionado por bloques. Si el cubo ya sale del histórico, solo se recalculan los meses de las
+    exportaciones nuevas, retiradas o cambiadas, leyendo únicamente las particiones de sus años.
+    """
+    construir_historico(origen, ruta_historico, procesos)
+    exportaciones = leer_manifiesto(ruta_historico)["exportaciones"]
+    if formato_vigente(ruta_cubo, ruta_municipios, ruta_distribucion) and leer_metadato(ruta_cubo, _CLAVE_ORIGEN) == ruta_historico:
+        cubo, municipios, distribucion, anteriores = cargar_cubo(ruta_cubo, ruta_municipios, ruta_distribucion)
+        if anteriores == exportaciones:
+            return cubo, municipios
+        rangos = rangos_modificados(anteriores, exportaciones)
+        bloques = leer_historico_por_bloques(ruta=ruta_historico, anios=anios_rangos(rangos))
+        cubo, municipios, distribucion = actualizar_cubo(cubo, municipios, distribucion, bloques, rangos)
+    else:
+        cubo, municipios, distribucion = construir_por_bloques(leer_historico_por_bloques(ruta=ruta_historico))
+    guardar_cubo(cubo, municipios, distribucion, exportaciones, ruta_cubo, ruta_municipios, ruta_distribucion, ruta_historico)
+    return cubo, municipios
+
+
+def incorporar(ruta_nueva, ruta_csv=RUTA_CSV, ruta_cubo=RUTA_CUBO, ruta_municipios=RUTA_MUNICIPIOS, ruta_distribucion=RUTA_DISTRIBUCION):
+    """
+    Incorporar un nuevo CSV de SICOM al cubo del CSV base guardado en disco. Sus atípicos se marcan
+    con los umbrales del CSV base (el reporte de calidad queda junto a su Parquet) y en las fechas
+    que se repiten se conservan los despachos de la exportación más reciente.
+    """
+    obtener_cubo(ruta_csv, ruta_cubo, ruta_municipios, ruta_distribucion)
+    cubo, municipios, distribucion, exportaciones = cargar_cubo(ruta_cubo, ruta_municipios, ruta_distribucion)
+    nombre = os.path.basename(ruta_nueva)
+    anterior = exportaciones.get(nombre)
+    if anterior is not None and firma_coincide(ruta_nueva, anterior["firma"]):
+        return cubo, municipios
+
+    umbrales = umbrales_reporte(exportaciones[os.path.basename(ruta_csv)]["parquet"])
+    destino = ruta_parquet(ruta_nueva, DIRECTORIO_INCORPORADAS)
+    if not depurado_vigente(ruta_nueva, destino, umbrales):
+        convertir_depurado(ruta_nueva, destino, umbrales=umbrales)
+    exportaciones[nombre] = describir_exportacion(destino)
+
+    rangos = [(datos["inicio"], datos["fin"]) for datos in [anterior, exportaciones[nombre]] if datos is not None]
+    bloques = leer_exportaciones_por_bloques(exportaciones, anios=anios_rangos(rangos))
+    cubo, municipios, distribucion = actualizar_cubo(cubo, municipios, distribucion, bloques, rangos)
+    guardar_cubo(cubo, municipios, distribucion, exportaciones, ruta_cubo, ruta_municipios, ruta_distribucion)
+    return cubo, municipios
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construir o actualizar el cubo de despachos")
+    parser.add_argument("csv", nargs="*", help="Nuevas exportaciones de SICOM a incorporar")
+    args = parser.parse_args()
+
+    cubo, municipios = obtener_cubo()
+    for ruta in args.csv:
+        cubo, municipios = incorporar(ruta)
+    print(f"Cubo con {len(cubo):,} celdas y {len(municipios)} municipios")
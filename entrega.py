@@ -0,0 +1,95 @@
+import gzip
+import hashlib
+
+from memoizacion import CacheLRU
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Respuestas que vale la pena comprimir (JSON de Dash, HTML de los mapas, JavaScript, GeoJSON)
+TIPOS_COMPRIMIBLES = {
+    "application/json",
+    "application/geo+json",
+    "application/javascript",
+    "text/javascript",
+    "text/css",
+    "text/html",
+    "text/plain",
+}
+TAMANO_MINIMO = 1024
+NIVEL_GZIP = 6
+NIVEL_BROTLI = 5
+
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+
+# Los cuerpos que se repiten (layout, bundles de Dash, mapas) se comprimen una sola vez por worker
+_comprimidos = CacheLRU(max_entradas=64)
+
+
+def codificacion_aceptada(aceptadas):
+    """
+    Codificación a usar según Accept-Encoding: brotli si el cliente la acepta y está instalada, si no gzip
+    """
+    if brotli is not None and aceptadas.quality("br") > 0:
+        return "br"
+    if aceptadas.quality("gzip") > 0:
+        return "gzip"
+    return None
+
+
+def _comprimir(cuerpo, codificacion):
+    clave = (codificacion, hashlib.sha256(cuerpo).digest())
+    encontrado, comprimido = _comprimidos.obtener(clave)
+    if not encontrado:
+        if codificacion == "br":
+            comprimido = brotli.compress(cuerpo, quality=NIVEL_BROTLI)
+        else:
+            comprimido = gzip.compress(cuerpo, NIVEL_GZIP, mtime=0)
+        _comprimidos.guardar(clave, comprimido)
+    return comprimido
+
+
+def comprimir(respuesta, aceptadas):
+    """
+    Comprimir el cuerpo de la respuesta si es de un tipo comprimible y suficientemente grande
+    """
+    if (
+        respuesta.direct_passthrough
+        or respuesta.is_streamed
+        or respuesta.status_code != 200
+        or "Content-Encoding" in respuesta.headers
+        or respuesta.mimetype not in TIPOS_COMPRIMIBLES
+    ):
+        return respuesta
+    respuesta.vary.add("Accept-Encoding")
+    codificacion = codificacion_aceptada(aceptadas)
+    cuerpo = respuesta.get_data()
+    if codificacion is None or len(cuerpo) < TAMANO_MINIMO:
+        return respuesta
+    respuesta.set_data(_comprimir(cuerpo, codificacion))
+    respuesta.headers["Content-Encoding"] = codificacion
+    return respuesta
+
+
+def revalidable(respuesta, solicitud, version, ultima_modificacion):
+    """
+    Respuestas GET sin política de caché propia (índice, layout, dependencias): ETag débil con la versión
+    de los datos y el contenido, Last-Modified de la construcción de los artefactos y revalidación en
+    cada visita, que responde 304 sin cuerpo si el navegador ya tiene la misma versión
+    """
+    if (
+        solicitud.method not in ("GET", "HEAD")
+        or respuesta.status_code != 200
+        or respuesta.direct_passthrough
+        or respuesta.is_streamed
+        or "Cache-Control" in respuesta.headers
+        or "ETag" in respuesta.headers
+    ):
+        return respuesta
+    contenido = hashlib.sha256(respuesta.get_data()).hexdigest()[:16]
+    respuesta.set_etag(f"{version}-{contenido}", weak=True)
+    respuesta.last_modified = ultima_modificacion
+    respuesta.cache_control.no_cache = True
+    return respuesta.make_conditional(solicitud)
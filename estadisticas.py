@@ -0,0 +1,83 @@
+import numpy as np
+
+from cuantiles import cuantiles, valor_cubeta
+
+# Hasta este número de despachos el resumen se calcula con los valores exactos
+LIMITE_EXACTO = 100_000
+# Máximo de valores atípicos que se envían al navegador
+MAX_ATIPICOS = 200
+CUARTILES = [0.25, 0.5, 0.75]
+
+
+def _muestra(valores, maximo=MAX_ATIPICOS):
+    """
+    Muestra determinista de valores ordenados, espaciada de modo uniforme (conserva los extremos)
+    """
+    if len(valores) <= maximo:
+        return valores
+    return valores[np.linspace(0, len(valores) - 1, maximo).round().astype(int)]
+
+
+def _resumen(q1, mediana, q3, bigote_inferior, bigote_superior, media, desviacion, n, atipicos, n_atipicos, exacto):
+    return {
+        "n": int(n),
+        "q1": float(q1),
+        "mediana": float(mediana),
+        "q3": float(q3),
+        "bigote_inferior": float(bigote_inferior),
+        "bigote_superior": float(bigote_superior),
+        "media": float(media),
+        "desviacion": float(desviacion),
+        "atipicos": [float(valor) for valor in _muestra(atipicos)],
+        "n_atipicos": int(n_atipicos),
+        "exacto": exacto,
+    }
+
+
+def resumen_exacto(valores):
+    """
+    Resumen de diagrama de caja (cuartiles, bigotes de Tukey, media, desviación y atípicos)
+    calculado con todos los valores; None si no hay valores
+    """
+    valores = np.sort(np.asarray(valores, dtype="float64"))
+    valores = valores[~np.isnan(valores)]
+    if len(valores) == 0:
+        return None
+    q1, mediana, q3 = np.quantile(valores, CUARTILES)
+    rango = q3 - q1
+    inferior = np.searchsorted(valores, q1 - 1.5 * rango, side="left")
+    superior = np.searchsorted(valores, q3 + 1.5 * rango, side="right")
+    atipicos = np.concatenate([valores[:inferior], valores[superior:]])
+    return _resumen(
+        q1, mediana, q3, valores[inferior], valores[superior - 1],
+        valores.mean(), valores.std(), len(valores), atipicos, len(atipicos), exacto=True,
+    )
+
+
+def resumen_aproximado(distribucion, celdas):
+    """
+    Resumen de diagrama de caja a partir del histograma de volúmenes (CUBETA, CANTIDAD) y de
+    las celdas del cubo correspondientes, que aportan la media, la desviación y los extremos exactos.
+    Los cuartiles tienen el error relativo del histograma; los atípicos son valores de cubeta.
+    """
+    conteos = distribucion.groupby("CUBETA")["CANTIDAD"].sum()
+    conteos = conteos[conteos > 0]
+    n = celdas["CANTIDAD_VOLUMEN"].sum()
+    if n == 0 or conteos.empty:
+        return None
+    minimo, maximo = celdas["VOLUMEN_MIN"].min(), celdas["VOLUMEN_MAX"].max()
+    q1, mediana, q3 = np.clip(cuantiles(conteos.index.to_numpy(), conteos.to_numpy(), CUARTILES), minimo, maximo)
+    media = celdas["VOLUMEN"].sum() / n
+    desviacion = np.sqrt(max(celdas["VOLUMEN_CUADRADOS"].sum() / n - media ** 2, 0.0))
+
+    rango = q3 - q1
+    valores = np.clip(valor_cubeta(conteos.index.to_numpy()), minimo, maximo)
+    dentro = (valores >= q1 - 1.5 * rango) & (valores <= q3 + 1.5 * rango)
+    bigote_inferior = valores[dentro].min() if dentro.any() else q1
+    bigote_superior = valores[dentro].max() if dentro.any() else q3
+    # Los extremos exactos del cubo sustituyen a sus cubetas
+    atipicos = np.unique(np.concatenate([valores[~dentro], [minimo] if minimo < bigote_inferior else [], [maximo] if maximo > bigote_superior else []]))
+    return _resumen(
+        q1, mediana, q3, bigote_inferior, bigote_superior,
+        media, desviacion, n, atipicos, conteos[~dentro].sum(), exacto=False,
+    )
@@ -0,0 +1,136 @@
+import io
+import os
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from historico import PARTICIONES
+
+# Formatos de exportación y su tipo MIME
+FORMATOS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+TAMANO_LOTE = 50_000
+
+
+def filtro_despachos(anios=None, productos=None, compradores=None, departamentos_proveedor=None, departamentos_destino=None):
+    """
+    Expresión de Arrow equivalente a los filtros del tablero (None si no hay filtros); en el histórico,
+    los filtros de año y producto descartan particiones completas
+    """
+    condiciones = []
+    if anios is not None:
+        condiciones.append((ds.field("ANIO_DESPACHO") >= int(anios[0])) & (ds.field("ANIO_DESPACHO") <= int(anios[1])))
+    for columna, valores in [
+        ("PRODUCTO", productos),
+        ("TIPO_COMPRADOR", compradores),
+        ("DEPARTAMENTO_PROVEEDOR", departamentos_proveedor),
+        ("DEPARTAMENTO", departamentos_destino),
+    ]:
+        if valores:
+            condiciones.append(ds.field(columna).isin(list(valores)))
+    return _y(*condiciones)
+
+
+def filtro_vigentes(esquema, excluidos):
+    """
+    Expresión que descarta los despachos de los rangos de fechas (AAAAMMDD) cubiertos por otra exportación
+    """
+    fecha = ds.field("ANIO_DESPACHO").cast(pa.int32()) * 10000 + ds.field("MES_DESPACHO").cast(pa.int32()) * 100
+    if "DIA_DESPACHO" in esquema.names:
+        fecha = fecha + ds.field("DIA_DESPACHO").cast(pa.int32())
+    return _y(*[(fecha < inicio) | (fecha > fin) for inicio, fin in excluidos])
+
+
+def _y(*condiciones):
+    filtro = None
+    for condicion in condiciones:
+        if condicion is not None:
+            filtro = condicion if filtro is None else filtro & condicion
+    return filtro
+
+
+def _sin_diccionarios(esquema):
+    """
+    Esquema con las columnas categóricas (diccionarios de Arrow) como sus valores, para CSV y JSON
+    """
+    return pa.schema([
+        campo.with_type(campo.type.value_type) if pa.types.is_dictionary(campo.type) else campo
+        for campo in esquema
+    ])
+
+
+def lotes_despachos(fuentes, filtros, columnas=None, tamano_lote=TAMANO_LOTE):
+    """
+    Esquema y lotes de los despachos individuales que cumplen los filtros, leídos de los Parquet de las
+    exportaciones (sin sus rangos excluidos) o del histórico particionado, sin cargar el resultado completo
+    """
+    escaneres = []
+    for fuente in fuentes:
+        particiones = PARTICIONES if os.path.isdir(fuente["ruta"]) else None
+        dataset = ds.dataset(fuente["ruta"], format="parquet", partitioning=particiones)
+        filtro = _y(filtro_despachos(**filtros), filtro_vigentes(dataset.schema, fuente["excluidos"]))
+        escaneres.append(dataset.scanner(columns=columnas, filter=filtro, batch_size=tamano_lote))
+    esquema = _sin_diccionarios(escaneres[0].projected_schema)
+    return esquema, (lote.cast(esquema) for escaner in escaneres for lote in escaner.to_batches() if lote.num_rows)
+
+
+def lotes_tabla(tabla, tamano_lote=TAMANO_LOTE):
+    """
+    Esquema y lotes de una tabla agregada ya en memoria
+    """
+    tabla = pa.Table.from_pandas(tabla, preserve_index=False)
+    esquema = _sin_diccionarios(tabla.schema)
+    return esquema, iter(tabla.cast(esquema).to_batches(max_chunksize=tamano_lote))
+
+
+class _Salida(io.RawIOBase):
+    """
+    Archivo de solo escritura que acumula lo escrito hasta que se vacía, para entregar el Parquet por partes
+    """
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def vaciar(self):
+        datos = b"".join(self._partes)
+        self._partes = []
+        return datos
+
+
+def serializar(esquema, lotes, formato):
+    """
+    Generador con los bytes del resultado en el formato pedido, un lote a la vez
+    """
+    if formato == "csv":
+        salida = pa.BufferOutputStream()
+        pacsv.write_csv(esquema.empty_table(), salida)
+        yield salida.getvalue().to_pybytes()
+        for lote in lotes:
+            salida = pa.BufferOutputStream()
+            pacsv.write_csv(lote, salida, pacsv.WriteOptions(include_header=False))
+            yield salida.getvalue().to_pybytes()
+    elif formato == "ndjson":
+        for lote in lotes:
+            texto = lote.to_pandas().to_json(orient="records", lines=True, force_ascii=False, date_format="iso")
+            yield (texto if texto.endswith("\n") else texto + "\n").encode("utf-8")
+    elif formato == "parquet":
+        salida = _Salida()
+        with pq.ParquetWriter(salida, esquema) as escritor:
+            for lote in lotes:
+                escritor.write_batch(lote)
+                yield salida.vaciar()
+        yield salida.vaciar()
+    else:
+        raise ValueError(f"Formato de exportación desconocido: {formato}")
@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+from ingesta import DIRECTORIO_CACHE, firma_archivo, firma_coincide, leer_metadato
+from calidad import RUTA_GEOJSON, normalizar_dane
+
+RUTA_GEOPARQUET = os.path.join(DIRECTORIO_CACHE, "municipios_geometria.parquet")
+
+# Sistema proyectado oficial de Colombia (MAGNA-SIRGAS / Origen-Nacional) para calcular centroides
+CRS_PROYECTADO = "EPSG:9377"
+CRS_MAPA = "EPSG:4326"
+
+# Niveles de zoom para los que se guarda una geometría simplificada
+NIVELES_ZOOM = [6, 8, 10]
+ZOOM_MAPA = 8
+
+_CLAVE_FIRMA = "firma_fuente"
+
+
+def tolerancia_zoom(zoom):
+    """
+    Tolerancia de simplificación (grados) equivalente a medio píxel en el nivel de zoom dado
+    """
+    return 360 / (256 * 2 ** zoom) / 2
+
+
+def columna_zoom(zoom):
+    return f"geometry_z{zoom}"
+
+
+def preparar_municipios(ruta_geojson=RUTA_GEOJSON):
+    """
+    Leer la capa de municipios, indexarla por código DANE y calcular centroides proyectados
+    y geometrías simplificadas por nivel de zoom (conservando los límites compartidos)
+    """
+    gdf = gpd.read_file(ruta_geojson).to_crs(CRS_MAPA)
+    gdf["CODIGO_MUNICIPIO_DANE"] = normalizar_dane(gdf["dpto_ccdgo"], gdf["mpio_ccdgo"])
+    gdf = gdf.sort_values("CODIGO_MUNICIPIO_DANE").reset_index(drop=True)
+
+    centroides = gdf.geometry.to_crs(CRS_PROYECTADO).centroid.to_crs(CRS_MAPA)
+    gdf["lat"] = centroides.y
+    gdf["lon"] = centroides.x
+
+    for zoom in NIVELES_ZOOM:
+        gdf[columna_zoom(zoom)] = gdf.geometry.simplify_coverage(tolerancia_zoom(zoom))
+    return gdf
+
+
+def guardar_municipios(gdf, ruta_geojson=RUTA_GEOJSON, ruta_geoparquet=RUTA_GEOPARQUET):
+    """
+    Guardar la capa preparada en GeoParquet junto con la firma del GeoJSON de origen
+    """
+    os.makedirs(os.path.dirname(ruta_geoparquet) or ".", exist_ok=True)
+    temporal = f"{ruta_geoparquet}.{os.getpid()}.tmp"
+    gdf.to_parquet(temporal)
+    tabla = pq.read_table(temporal)
+    metadatos = dict(tabla.schema.metadata or {})
+    metadatos[_CLAVE_FIRMA.encode()] = json.dumps(firma_archivo(ruta_geojson)).encode()
+    pq.write_table(tabla.replace_schema_metadata(metadatos), temporal, compression="zstd")
+    os.replace(temporal, ruta_geoparquet)
+
+
+def cargar_municipios(zoom=None, ruta_geojson=RUTA_GEOJSON, ruta_geoparquet=RUTA_GEOPARQUET):
+    """
+    Cargar la capa de municipios desde GeoParquet (preparándola si el GeoJSON cambió).
+    Si se indica un zoom, la geometría activa es la simplificada para ese nivel.
+    """
+    if not firma_coincide(ruta_geojson, leer_metadato(ruta_geoparquet, _CLAVE_FIRMA)):
+        guardar_municipios(preparar_municipios(ruta_geojson), ruta_geojson, ruta_geoparquet)
+
+    # Solo se lee la geometría que se va a usar
+    geometria = "geometry" if zoom is None else columna_zoom(min(NIVELES_ZOOM, key=lambda z: abs(z - zoom)))
+    columnas = [c for c in pq.read_schema(ruta_geoparquet).names if c == geometria or not c.startswith("geometry")]
+    gdf = gpd.read_parquet(ruta_geoparquet, columns=columnas)
+    return gdf if geometria == "geometry" else gdf.rename_geometry("geometry")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preparar la capa de municipios en GeoParquet")
+    parser.add_argument("geojson", nargs="?", default=RUTA_GEOJSON)
+    args = parser.parse_args()
+
+    gdf = preparar_municipios(args.geojson)
+    guardar_municipios(gdf, args.geojson)
+    for zoom in NIVELES_ZOOM:
+        vertices = gdf[columna_zoom(zoom)].count_coordinates().sum()
+        print(f"Zoom {zoom}: {vertices:,} vértices (original {gdf.geometry.count_coordinates().sum():,})")
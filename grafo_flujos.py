@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+
+from agregaciones import PRODUCTOS
+
+
+class GrafoFlujos:
+    """
+    Grafo origen-destino de despachos en formato CSR sobre identificadores enteros
+    (posición del código DANE en `codigos`). Cada arista guarda la cantidad de despachos,
+    el volumen total y el volumen de cada producto. Se guardan las dos orientaciones
+    (salida por proveedor y entrada por destino) para responder en O(grado).
+    """
+
+    def __init__(self, codigos, origenes, destinos, pesos):
+        self.codigos = np.asarray(codigos)
+        n = len(self.codigos)
+
+        orden = np.lexsort((destinos, origenes))
+        self.origenes = origenes[orden]
+        self.destinos = destinos[orden]
+        self.pesos = {nombre: np.asarray(valores)[orden] for nombre, valores in pesos.items()}
+        self.indptr_salida = np.concatenate([[0], np.cumsum(np.bincount(self.origenes, minlength=n))])
+
+        # Orientación de entrada: permutación de las aristas ordenadas por destino
+        self.orden_entrada = np.lexsort((self.origenes, self.destinos))
+        self.indptr_entrada = np.concatenate([[0], np.cumsum(np.bincount(self.destinos, minlength=n))])
+
+    @classmethod
+    def desde_cubo(cls, cubo):
+        """
+        Construir el grafo a partir de las celdas (posiblemente filtradas) del cubo de despachos
+        """
+        claves = ["CODIGO_MUNICIPIO_DANE_PROVEEDOR", "CODIGO_MUNICIPIO_DANE_DESTINO"]
+        por_producto = cubo.groupby(claves + ["PRODUCTO"], observed=True)[["CANTIDAD", "VOLUMEN"]].sum()
+        aristas = por_producto.groupby(level=claves).sum()
+        volumen_producto = por_producto["VOLUMEN"].unstack("PRODUCTO", fill_value=0.0).reindex(columns=list(PRODUCTOS), fill_value=0.0)
+
+        origen = aristas.index.get_level_values(0).to_numpy()
+        destino = aristas.index.get_level_values(1).to_numpy()
+        codigos = np.union1d(origen, destino)
+        pesos = {
+            "CANTIDAD": aristas["CANTIDAD"].to_numpy(),
+            "VOLUMEN": aristas["VOLUMEN"].to_numpy(),
+            **{f"VOLUMEN_{nombre}": volumen_producto[producto].to_numpy() for producto, nombre in PRODUCTOS.items()},
+        }
+        return cls(codigos, np.searchsorted(codigos, origen), np.searchsorted(codigos, destino), pesos)
+
+    @classmethod
+    def por_periodo(cls, cubo, columnas=("ANIO_DESPACHO",)):
+        """
+        Un grafo por cada periodo (por ejemplo año, o año y mes)
+        """
+        columnas = list(columnas)
+        return {
+            periodo if len(columnas) > 1 else periodo[0]: cls.desde_cubo(celdas)
+            for periodo, celdas in cubo.groupby(columnas, observed=True)
+        }
+
+    def _id(self, codigo):
+        i = np.searchsorted(self.codigos, codigo)
+        if i < len(self.codigos) and self.codigos[i] == codigo:
+            return i
+        return None
+
+    def _tramo(self, codigo, salida):
+        i = self._id(codigo)
+        if i is None:
+            return np.empty(0, dtype=int)
+        if salida:
+            return np.arange(self.indptr_salida[i], self.indptr_salida[i + 1])
+        return self.orden_entrada[self.indptr_entrada[i]:self.indptr_entrada[i + 1]]
+
+    def grado_salida(self, codigo):
+        """
+        Número de destinos distintos de un municipio proveedor
+        """
+        return len(self._tramo(codigo, salida=True))
+
+    def grado_entrada(self, codigo):
+        """
+        Número de proveedores distintos de un municipio destino
+        """
+        return len(self._tramo(codigo, salida=False))
+
+    def grados_salida(self):
+        """
+        Número de destinos de cada municipio proveedor (código DANE → grado)
+        """
+        grados = np.diff(self.indptr_salida)
+        return pd.Series(grados, index=self.codigos)[grados > 0]
+
+    def grados_entrada(self):
+        """
+        Número de proveedores de cada municipio destino (código DANE → grado)
+        """
+        grados = np.diff(self.indptr_entrada)
+        return pd.Series(grados, index=self.codigos)[grados > 0]
+
+    def vecinos(self, codigo, salida=True):
+        """
+        Municipios relacionados con uno dado y los pesos de cada arista
+        """
+        aristas = self._tramo(codigo, salida)
+        otros = self.destinos[aristas] if salida else self.origenes[aristas]
+        return pd.DataFrame(
+            {nombre: valores[aristas] for nombre, valores in self.pesos.items()},
+            index=pd.Index(self.codigos[otros], name="CODIGO_MUNICIPIO_DANE"),
+        )
+
+    def top(self, codigo, k=5, peso="CANTIDAD", salida=True):
+        """
+        Los k municipios con mayor peso relacionados con uno dado
+        """
+        vecinos = self.vecinos(codigo, salida)
+        if len(vecinos) <= k:
+            return vecinos.sort_values(peso, ascending=False)
+        mayores = np.argpartition(-vecinos[peso].to_numpy(), k)[:k]
+        return vecinos.iloc[mayores].sort_values(peso, ascending=False)
+
+    def flujo(self, origen, destino):
+        """
+        Pesos de la arista origen → destino (ceros si no hay despachos)
+        """
+        i, j = self._id(origen), self._id(destino)
+        if i is not None and j is not None:
+            inicio, fin = self.indptr_salida[i], self.indptr_salida[i + 1]
+            posicion = inicio + np.searchsorted(self.destinos[inicio:fin], j)
+            if posicion < fin and self.destinos[posicion] == j:
+                return {nombre: valores[posicion].item() for nombre, valores in self.pesos.items()}
+        return {nombre: 0 for nombre in self.pesos}
+
+    def aristas(self):
+        """
+        Todas las aristas como tabla con los códigos DANE de origen y destino
+        """
+        return pd.DataFrame({
+            "CODIGO_MUNICIPIO_DANE_PROVEEDOR": self.codigos[self.origenes],
+            "CODIGO_MUNICIPIO_DANE_DESTINO": self.codigos[self.destinos],
+            **self.pesos,
+        })
+
+
+def flujos_municipios(grafo_od, nombres):
+    """
+    Cantidad de despachos entre cada par de municipios proveedor-destino, con sus nombres
+    """
+    flujos = grafo_od.aristas()
+    return pd.DataFrame({
+        "CODIGO_MUNICIPIO_DANE_PROVEEDOR": flujos["CODIGO_MUNICIPIO_DANE_PROVEEDOR"],
+        "CODIGO_MUNICIPIO_DANE_DESTINO": flujos["CODIGO_MUNICIPIO_DANE_DESTINO"],
+        "MUNICIPIO_PROVEEDOR": flujos["CODIGO_MUNICIPIO_DANE_PROVEEDOR"].map(nombres),
+        "MUNICIPIO": flujos["CODIGO_MUNICIPIO_DANE_DESTINO"].map(nombres),
+        "CANTIDAD_DESPACHOS": flujos["CANTIDAD"],
+    })
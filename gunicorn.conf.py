@@ -0,0 +1,17 @@
+import gc
+
+# Los artefactos se cargan una sola vez en el proceso maestro y los workers los heredan
+# al bifurcarse (copy-on-write): el arranque de cada worker no depende del tamaño de los datos.
+# Uso: python artefactos.py && gunicorn
+wsgi_app = "app:server"
+preload_app = True
+bind = "0.0.0.0:8050"
+workers = 4
+# Hilos por worker: una exportación larga (/api/exportar) no deja al worker sin atender callbacks
+threads = 4
+
+
+def when_ready(server):
+    # Mover los objetos ya cargados a la generación permanente para que el recolector
+    # de basura no toque sus páginas en los workers (lo que rompería el copy-on-write)
+    gc.freeze()
@@ -0,0 +1,271 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from ingesta import (
+    DIRECTORIO_CACHE,
+    TAMANO_BLOQUE,
+    tipar,
+    convertir_depurado,
+    depurado_vigente,
+    leer_metadato,
+    ruta_parquet,
+)
+from calidad import cargar_reglas
+
+# Cada exportación se convierte primero a su propio Parquet; luego se unen en un conjunto
+# particionado por año y producto (directorios ANIO_DESPACHO=.../PRODUCTO=...)
+DIRECTORIO_EXPORTACIONES = os.path.join(DIRECTORIO_CACHE, "exportaciones")
+RUTA_HISTORICO = os.path.join(DIRECTORIO_CACHE, "historico")
+PARTICIONES = ds.partitioning(pa.schema([("ANIO_DESPACHO", pa.int16()), ("PRODUCTO", pa.string())]), flavor="hive")
+
+# Los archivos que empiezan por "_" no forman parte del conjunto de datos
+_MANIFIESTO = "_manifiesto.json"
+_CLAVE_FIRMA = "firma_fuente"
+_COLUMNAS_FECHA = ["ANIO_DESPACHO", "MES_DESPACHO", "DIA_DESPACHO"]
+
+
+def listar_exportaciones(origen):
+    """
+    Archivos CSV de un directorio, de un patrón glob o un único archivo, ordenados por nombre
+    """
+    if os.path.isdir(origen):
+        return sorted(glob.glob(os.path.join(origen, "*.csv")))
+    return sorted(glob.glob(origen))
+
+
+def fecha_despacho(data):
+    """
+    Fecha de cada despacho como entero AAAAMMDD (día 0 si la exportación no trae el día)
+    """
+    dia = data["DIA_DESPACHO"].astype("int32") if "DIA_DESPACHO" in data else 0
+    return data["ANIO_DESPACHO"].astype("int32") * 10000 + data["MES_DESPACHO"].astype("int32") * 100 + dia
+
+
+def convertir_exportacion(ruta_csv, directorio=DIRECTORIO_EXPORTACIONES, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Convertir un CSV a Parquet por bloques, con el esquema fijo de ingesta y las marcas de calidad,
+    y devolver la ruta, la firma del CSV y el rango de fechas que cubre. Si el CSV y las reglas
+    de calidad no cambiaron se reutiliza. Las reglas IQR se evalúan sobre cada exportación.
+    """
+    destino = ruta_parquet(ruta_csv, directorio)
+    if not depurado_vigente(ruta_csv, destino):
+        convertir_depurado(ruta_csv, destino, tamano_bloque)
+    return describir_exportacion(destino)
+
+
+def describir_exportacion(ruta):
+    """
+    Ruta, firma del CSV, reglas de calidad y rango de fechas (AAAAMMDD) de una exportación ya convertida
+    """
+    columnas = [c for c in _COLUMNAS_FECHA if c in pq.read_schema(ruta).names]
+    fechas = fecha_despacho(pd.read_parquet(ruta, columns=columnas))
+    return {
+        "parquet": ruta,
+        "firma": leer_metadato(ruta, _CLAVE_FIRMA),
+        "reglas": cargar_reglas(),
+        "inicio": int(fechas.min()),
+        "fin": int(fechas.max()),
+    }
+
+
+def rangos_cubiertos(exportaciones):
+    """
+    Para cada exportación, los rangos de fechas que ya cubren exportaciones más recientes
+    (fecha final mayor y, a igual fecha, nombre posterior). En un rango repetido se
+    conservan solo los despachos de la exportación más reciente.
+    """
+    orden = sorted(exportaciones, key=lambda nombre: (exportaciones[nombre]["fin"], nombre), reverse=True)
+    cubiertos, excluidos = [], {}
+    for nombre in orden:
+        excluidos[nombre] = list(cubiertos)
+        cubiertos.append((exportaciones[nombre]["inicio"], exportaciones[nombre]["fin"]))
+    return excluidos
+
+
+def rangos_modificados(anteriores, actuales):
+    """
+    Rangos de fechas de las exportaciones nuevas, retiradas o cambiadas (el anterior y el actual de
+    cada una). Fuera de ellos los despachos vigentes no cambian, aunque cambie el orden de las exportaciones.
+    """
+    rangos = []
+    for nombre in sorted(set(anteriores) | set(actuales)):
+        if anteriores.get(nombre) != actuales.get(nombre):
+            rangos += [(datos["inicio"], datos["fin"]) for datos in [anteriores.get(nombre), actuales.get(nombre)] if datos is not None]
+    return rangos
+
+
+def anios_rangos(rangos):
+    """
+    Años (particiones ANIO_DESPACHO) que tocan unos rangos de fechas AAAAMMDD
+    """
+    anios = set()
+    for inicio, fin in rangos:
+        anios.update(range(inicio // 10000, fin // 10000 + 1))
+    return anios
+
+
+def filtro_anios(anios):
+    """
+    Expresión de Arrow para leer solo los años dados (None para leerlos todos); en el histórico
+    descarta particiones completas y en una exportación, los grupos de filas de otros años
+    """
+    return None if anios is None else ds.field("ANIO_DESPACHO").isin(sorted(anios))
+
+
+def _vigentes(data, excluidos):
+    fechas = fecha_despacho(data)
+    vigentes = pd.Series(True, index=data.index)
+    for inicio, fin in excluidos:
+        vigentes &= ~fechas.between(inicio, fin)
+    return data[vigentes]
+
+
+def _lotes_vigentes(ruta, excluidos, tamano_bloque, anios=None):
+    esquema = pq.read_schema(ruta)
+    for lote in ds.dataset(ruta, format="parquet").to_batches(filter=filtro_anios(anios), batch_size=tamano_bloque):
+        yield pa.RecordBatch.from_pandas(_vigentes(lote.to_pandas(), excluidos), schema=esquema, preserve_index=False)
+
+
+def leer_exportaciones_por_bloques(exportaciones, columnas=None, tamano_bloque=TAMANO_BLOQUE, anios=None):
+    """
+    Recorrer por bloques los despachos de varias exportaciones ya convertidas, sin los rangos de fechas
+    que cubre otra más reciente: los mismos despachos que quedarían en el histórico, sin particionarlos.
+    Con `anios` solo se leen los despachos de esos años.
+    """
+    excluidos = rangos_cubiertos(exportaciones)
+    for nombre, datos in exportaciones.items():
+        fechas = [c for c in _COLUMNAS_FECHA if c in pq.read_schema(datos["parquet"]).names]
+        lectura = None if columnas is None else list(dict.fromkeys([*columnas, *fechas]))
+        dataset = ds.dataset(datos["parquet"], format="parquet")
+        for lote in dataset.to_batches(columns=lectura, filter=filtro_anios(anios), batch_size=tamano_bloque):
+            data = _vigentes(lote.to_pandas(), excluidos[nombre])
+            yield tipar(data if columnas is None else data[columnas])
+
+
+def escribir_particiones(ruta, excluidos, destino, tamano_bloque=TAMANO_BLOQUE, anios=None):
+    """
+    Añadir al conjunto particionado los despachos de una exportación fuera de los rangos excluidos
+    (con `anios`, solo los de esos años)
+    """
+    nombre = os.path.splitext(os.path.basename(ruta))[0]
+    ds.write_dataset(
+        _lotes_vigentes(ruta, excluidos, tamano_bloque, anios),
+        destino,
+        schema=pq.read_schema(ruta),
+        format="parquet",
+        partitioning=PARTICIONES,
+        basename_template=f"{nombre}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def leer_manifiesto(ruta=RUTA_HISTORICO):
+    try:
+        with open(os.path.join(ruta, _MANIFIESTO), encoding="utf-8") as archivo:
+            return json.load(archivo)
+    except FileNotFoundError:
+        return None
+
+
+def construir_historico(origen, destino=RUTA_HISTORICO, procesos=None, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Convertir en paralelo todas las exportaciones de SICOM (directorio o patrón glob),
+    quitar los rangos de fechas repetidos y escribir el histórico particionado.
+    Si ya existe, solo se reescriben los años que tocan las exportaciones nuevas, retiradas
+    o cambiadas; si ninguna cambió, se conserva tal cual.
+    """
+    rutas = listar_exportaciones(origen)
+    if not rutas:
+        raise FileNotFoundError(f"No se encontraron exportaciones CSV en {origen}")
+
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        convertidas = list(pool.map(convertir_exportacion, rutas, [DIRECTORIO_EXPORTACIONES] * len(rutas), [tamano_bloque] * len(rutas)))
+        exportaciones = {os.path.basename(ruta): datos for ruta, datos in zip(rutas, convertidas)}
+
+        manifiesto = leer_manifiesto(destino)
+        if manifiesto is not None and manifiesto["exportaciones"] == exportaciones:
+            return destino
+        anios = None if manifiesto is None else anios_rangos(rangos_modificados(manifiesto["exportaciones"], exportaciones))
+
+        excluidos = rangos_cubiertos(exportaciones)
+        temporal = f"{destino}.{os.getpid()}.tmp"
+        shutil.rmtree(temporal, ignore_errors=True)
+        list(pool.map(
+            escribir_particiones,
+            [datos["parquet"] for datos in exportaciones.values()],
+            [excluidos[nombre] for nombre in exportaciones],
+            [temporal] * len(exportaciones),
+            [tamano_bloque] * len(exportaciones),
+            [anios] * len(exportaciones),
+        ))
+
+    anterior = f"{destino}.{os.getpid()}.anterior"
+    if anios is None:
+        os.makedirs(temporal, exist_ok=True)
+        _escribir_manifiesto(temporal, exportaciones)
+        if os.path.exists(destino):
+            os.replace(destino, anterior)
+        os.replace(temporal, destino)
+    else:
+        # Se cambia un año a la vez y el manifiesto al final: si el proceso se interrumpe,
+        # el manifiesto anterior hace que la siguiente ejecución reescriba los mismos años
+        os.makedirs(anterior, exist_ok=True)
+        for anio in sorted(anios):
+            particion = f"ANIO_DESPACHO={anio}"
+            if os.path.exists(os.path.join(destino, particion)):
+                os.replace(os.path.join(destino, particion), os.path.join(anterior, particion))
+            if os.path.exists(os.path.join(temporal, particion)):
+                os.replace(os.path.join(temporal, particion), os.path.join(destino, particion))
+        _escribir_manifiesto(destino, exportaciones)
+        shutil.rmtree(temporal, ignore_errors=True)
+    shutil.rmtree(anterior, ignore_errors=True)
+    return destino
+
+
+def _escribir_manifiesto(ruta, exportaciones):
+    temporal = os.path.join(ruta, f"{_MANIFIESTO}.{os.getpid()}.tmp")
+    with open(temporal, "w", encoding="utf-8") as archivo:
+        json.dump({"exportaciones": exportaciones}, archivo, indent=2)
+    os.replace(temporal, os.path.join(ruta, _MANIFIESTO))
+
+
+def particiones_historico(ruta=RUTA_HISTORICO):
+    """
+    Pares (año, producto) presentes en el histórico
+    """
+    dataset = ds.dataset(ruta, format="parquet", partitioning=PARTICIONES)
+    claves = {
+        tuple(ds.get_partition_keys(fragmento.partition_expression).get(c) for c in ["ANIO_DESPACHO", "PRODUCTO"])
+        for fragmento in dataset.get_fragments()
+    }
+    return sorted(claves)
+
+
+def leer_historico_por_bloques(columnas=None, ruta=RUTA_HISTORICO, tamano_bloque=TAMANO_BLOQUE, anios=None):
+    """
+    Recorrer el histórico por bloques de filas; con `anios` solo se abren las particiones de esos años
+    """
+    dataset = ds.dataset(ruta, format="parquet", partitioning=PARTICIONES)
+    for lote in dataset.to_batches(columns=columnas, filter=filtro_anios(anios), batch_size=tamano_bloque):
+        yield tipar(lote.to_pandas())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Unir las exportaciones de SICOM en un histórico particionado")
+    parser.add_argument("origen", help="Directorio o patrón glob con las exportaciones CSV")
+    parser.add_argument("--procesos", type=int, default=None)
+    args = parser.parse_args()
+
+    ruta = construir_historico(args.origen, procesos=args.procesos)
+    for nombre, datos in leer_manifiesto(ruta)["exportaciones"].items():
+        print(f"{nombre}: {datos['inicio']} - {datos['fin']}")
+    print(f"{len(particiones_historico(ruta))} particiones en {ruta}")
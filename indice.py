@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+
+class IndiceCubo:
+    """
+    Índice en memoria sobre las celdas del cubo para responder filtros sin recorrer
+    ni reagrupar todo el DataFrame. Por cada dimensión se guardan las posiciones de
+    las filas ordenadas por valor, de modo que las filas de un valor son un tramo contiguo.
+    """
+
+    def __init__(self, cubo, municipios):
+        departamentos = municipios.set_index("CODIGO_MUNICIPIO_DANE")["DEPARTAMENTO"]
+        self.cubo = cubo.reset_index(drop=True)
+        columnas = {
+            "ANIO_DESPACHO": self.cubo["ANIO_DESPACHO"],
+            "MES_DESPACHO": self.cubo["MES_DESPACHO"],
+            "PRODUCTO": self.cubo["PRODUCTO"],
+            "TIPO_COMPRADOR": self.cubo["TIPO_COMPRADOR"],
+            "DEPARTAMENTO_PROVEEDOR": self.cubo["CODIGO_MUNICIPIO_DANE_PROVEEDOR"].map(departamentos),
+            "DEPARTAMENTO": self.cubo["CODIGO_MUNICIPIO_DANE_DESTINO"].map(departamentos),
+            "CODIGO_MUNICIPIO_DANE_PROVEEDOR": self.cubo["CODIGO_MUNICIPIO_DANE_PROVEEDOR"],
+            "CODIGO_MUNICIPIO_DANE_DESTINO": self.cubo["CODIGO_MUNICIPIO_DANE_DESTINO"],
+        }
+        self.dimensiones = {}
+        for nombre, columna in columnas.items():
+            codigos, valores = pd.factorize(columna, sort=True)
+            valores = pd.Index(np.asarray(valores))
+            orden = np.argsort(codigos, kind="stable")
+            limites = np.searchsorted(codigos[orden], np.arange(len(valores) + 1))
+            self.dimensiones[nombre] = (valores, orden, limites)
+
+    def opciones(self, dimension):
+        """
+        Valores distintos de una dimensión, ordenados
+        """
+        return list(self.dimensiones[dimension][0])
+
+    def posiciones(self, dimension, valores):
+        """
+        Posiciones de las filas cuyo valor en la dimensión está en la lista dada
+        """
+        categorias, orden, limites = self.dimensiones[dimension]
+        indices = categorias.get_indexer(list(valores))
+        tramos = [orden[limites[i]:limites[i + 1]] for i in indices if i >= 0]
+        return np.concatenate(tramos) if tramos else np.empty(0, dtype=orden.dtype)
+
+    def rango(self, dimension, desde=None, hasta=None):
+        """
+        Posiciones de las filas cuyo valor en la dimensión está entre desde y hasta
+        """
+        categorias, orden, limites = self.dimensiones[dimension]
+        inicio = 0 if desde is None else categorias.searchsorted(desde, side="left")
+        fin = len(categorias) if hasta is None else categorias.searchsorted(hasta, side="right")
+        return orden[limites[inicio]:limites[fin]]
+
+    def mascara(self, anios=None, productos=None, compradores=None, departamentos_proveedor=None, departamentos_destino=None):
+        """
+        Máscara booleana de las celdas que cumplen todos los filtros (None o vacío = sin filtro)
+        """
+        seleccion = np.ones(len(self.cubo), dtype=bool)
+        criterios = []
+        if anios is not None:
+            criterios.append(self.rango("ANIO_DESPACHO", *anios))
+        for dimension, valores in [
+            ("PRODUCTO", productos),
+            ("TIPO_COMPRADOR", compradores),
+            ("DEPARTAMENTO_PROVEEDOR", departamentos_proveedor),
+            ("DEPARTAMENTO", departamentos_destino),
+        ]:
+            if valores:
+                criterios.append(self.posiciones(dimension, valores))
+        for posiciones in criterios:
+            parcial = np.zeros(len(self.cubo), dtype=bool)
+            parcial[posiciones] = True
+            seleccion &= parcial
+        return seleccion
+
+    def filtrar(self, **filtros):
+        """
+        Celdas del cubo que cumplen los filtros
+        """
+        if not any(filtros.values()):
+            return self.cubo
+        return self.cubo[self.mascara(**filtros)]
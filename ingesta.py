@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from calidad import cargar_reglas, necesita_umbrales, umbrales_atipicos, umbrales_fijos, codigos_geometria, marcar, acumular_reporte, guardar_reporte
+from metricas import tramo
+
+# Archivo fuente publicado por SICOM y directorio donde se guarda la versión columnar
+RUTA_CSV = "Productores_Productores_de_B100_y_Etanol_-_Alcohol_Carburante__AUTOMATIZADO__20250314.csv"
+DIRECTORIO_CACHE = "cache"
+
+COLUMNAS_CATEGORICAS = [
+    "PRODUCTO",
+    "TIPO_COMPRADOR",
+    "DEPARTAMENTO_PROVEEDOR",
+    "MUNICIPIO_PROVEEDOR",
+    "DEPARTAMENTO",
+    "MUNICIPIO",
+]
+COLUMNAS_DANE = ["CODIGO_MUNICIPIO_DANE_PROVEEDOR", "CODIGO_MUNICIPIO_DANE_DESTINO"]
+TIPOS = {
+    "ANIO_DESPACHO": "int16",
+    "MES_DESPACHO": "int8",
+    "DIA_DESPACHO": "int8",
+    "VOLUMEN_DESPACHADO": "float64",
+    **{columna: "category" for columna in COLUMNAS_CATEGORICAS},
+    **{columna: "int32" for columna in COLUMNAS_DANE},
+    "CALIDAD": "uint8",
+}
+
+_CLAVE_FIRMA = "firma_fuente"
+_CLAVE_REGLAS = "reglas_calidad"
+_CLAVE_UMBRALES = "umbrales_calidad"
+
+# Filas por bloque al leer el CSV por partes
+TAMANO_BLOQUE = 200_000
+
+
+def firma_archivo(ruta, con_hash=True):
+    """
+    Calcular la firma (mtime, tamaño y sha256) del archivo fuente
+    """
+    estado = os.stat(ruta)
+    firma = {"mtime_ns": estado.st_mtime_ns, "tamano": estado.st_size}
+    if con_hash:
+        sha = hashlib.sha256()
+        with open(ruta, "rb") as archivo:
+            for bloque in iter(lambda: archivo.read(1 << 20), b""):
+                sha.update(bloque)
+        firma["sha256"] = sha.hexdigest()
+    return firma
+
+
+def leer_bloques(ruta_csv=RUTA_CSV, columnas=None, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Leer el CSV de SICOM por bloques de filas, con los tipos fijos del esquema
+    """
+    tipos = TIPOS if columnas is None else {c: t for c, t in TIPOS.items() if c in columnas}
+    with pd.read_csv(ruta_csv, usecols=columnas, dtype=tipos, chunksize=tamano_bloque) as lector:
+        yield from lector
+
+
+def depurar_bloques(ruta_csv, reporte, reglas=None, tamano_bloque=TAMANO_BLOQUE, umbrales=None):
+    """
+    Etapa de calidad: leer el CSV por bloques y marcar cada despacho (columna CALIDAD),
+    acumulando en `reporte` los umbrales usados, los atípicos y los códigos DANE sin geometría.
+    Con `umbrales` se usan esos límites de atípicos en lugar de calcularlos sobre este archivo.
+    """
+    reglas = reglas or cargar_reglas()
+    if umbrales is None:
+        if necesita_umbrales(reglas):
+            umbrales = umbrales_atipicos(leer_bloques(ruta_csv, ["PRODUCTO", "VOLUMEN_DESPACHADO"], tamano_bloque), reglas)
+        else:
+            umbrales = umbrales_fijos(reglas)
+    reporte.update(reglas=reglas, umbrales=_serializar_umbrales(umbrales))
+    codigos = codigos_geometria()
+    for bloque in leer_bloques(ruta_csv, tamano_bloque=tamano_bloque):
+        bloque = marcar(bloque, umbrales, codigos)
+        acumular_reporte(reporte, bloque)
+        yield bloque
+
+
+def convertir_depurado(ruta_csv, destino, tamano_bloque=TAMANO_BLOQUE, umbrales=None):
+    """
+    Convertir el CSV en un Parquet tipado con las marcas de calidad, bloque a bloque.
+    El reporte de calidad se guarda junto al Parquet.
+    """
+    reglas, reporte = cargar_reglas(), {}
+    metadatos = {_CLAVE_FIRMA: firma_archivo(ruta_csv), _CLAVE_REGLAS: reglas}
+    if umbrales is not None:
+        metadatos[_CLAVE_UMBRALES] = _serializar_umbrales(umbrales)
+    escribir_por_bloques(depurar_bloques(ruta_csv, reporte, reglas, tamano_bloque, umbrales), destino, metadatos)
+    guardar_reporte(reporte, destino)
+    return destino
+
+
+def _serializar_umbrales(umbrales):
+    return {producto: list(limites) for producto, limites in umbrales.items()}
+
+
+def depurado_vigente(ruta_csv, ruta, umbrales=None):
+    """
+    Verificar que el Parquet corresponde al CSV actual y a las reglas de calidad vigentes
+    (y, si se indican, a los umbrales de atípicos con que se marcó)
+    """
+    return (
+        leer_metadato(ruta, _CLAVE_REGLAS) == cargar_reglas()
+        and (umbrales is None or leer_metadato(ruta, _CLAVE_UMBRALES) == _serializar_umbrales(umbrales))
+        and firma_coincide(ruta_csv, leer_metadato(ruta, _CLAVE_FIRMA))
+    )
+
+
+def ruta_parquet(ruta_csv, directorio_cache=DIRECTORIO_CACHE):
+    """
+    Ruta del archivo Parquet asociado a un CSV fuente
+    """
+    nombre = os.path.splitext(os.path.basename(ruta_csv))[0]
+    return os.path.join(directorio_cache, f"{nombre}.parquet")
+
+
+def guardar_parquet(data, destino, metadatos=None):
+    """
+    Escribir un DataFrame en Parquet de forma atómica, con metadatos JSON opcionales
+    """
+    tabla = pa.Table.from_pandas(data, preserve_index=False)
+    esquema = dict(tabla.schema.metadata or {})
+    for clave, valor in (metadatos or {}).items():
+        esquema[clave.encode()] = json.dumps(valor).encode()
+    tabla = tabla.replace_schema_metadata(esquema)
+
+    os.makedirs(os.path.dirname(destino) or ".", exist_ok=True)
+    temporal = f"{destino}.{os.getpid()}.tmp"
+    pq.write_table(tabla, temporal, compression="zstd")
+    os.replace(temporal, destino)
+    return destino
+
+
+def escribir_por_bloques(bloques, destino, metadatos=None):
+    """
+    Escribir en Parquet, de forma atómica, una secuencia de bloques de despachos sin tenerlos
+    todos en memoria. Las categorías cambian de un bloque a otro: en el archivo se guardan como texto.
+    """
+    os.makedirs(os.path.dirname(destino) or ".", exist_ok=True)
+    temporal = f"{destino}.{os.getpid()}.tmp"
+    escritor = None
+    try:
+        for bloque in bloques:
+            bloque = bloque.astype({columna: str for columna in COLUMNAS_CATEGORICAS if columna in bloque})
+            if escritor is None:
+                esquema = pa.Schema.from_pandas(bloque, preserve_index=False)
+                extra = {clave.encode(): json.dumps(valor).encode() for clave, valor in (metadatos or {}).items()}
+                esquema = esquema.with_metadata({**esquema.metadata, **extra})
+                escritor = pq.ParquetWriter(temporal, esquema, compression="zstd")
+            escritor.write_table(pa.Table.from_pandas(bloque, schema=esquema, preserve_index=False))
+    finally:
+        if escritor is not None:
+            escritor.close()
+    os.replace(temporal, destino)
+    return destino
+
+
+def tipar(data):
+    """
+    Aplicar los tipos del esquema a las columnas presentes
+    """
+    return data.astype({columna: tipo for columna, tipo in TIPOS.items() if columna in data.columns})
+
+
+def leer_por_bloques(ruta, columnas=None, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Leer un Parquet de despachos por bloques de filas, con los tipos del esquema
+    """
+    for lote in pq.ParquetFile(ruta).iter_batches(batch_size=tamano_bloque, columns=columnas):
+        yield tipar(lote.to_pandas())
+
+
+def leer_metadato(ruta, clave):
+    """
+    Leer un metadato JSON guardado con guardar_parquet (None si no existe)
+    """
+    if not os.path.exists(ruta):
+        return None
+    metadatos = pq.read_schema(ruta).metadata or {}
+    if clave.encode() not in metadatos:
+        return None
+    return json.loads(metadatos[clave.encode()])
+
+
+def firma_coincide(ruta, guardada):
+    """
+    Comparar el archivo con una firma guardada.
+    Se compara primero mtime y tamaño; el hash solo se calcula si cambiaron.
+    """
+    if guardada is None:
+        return False
+    actual = firma_archivo(ruta, con_hash=False)
+    if actual["mtime_ns"] == guardada["mtime_ns"] and actual["tamano"] == guardada["tamano"]:
+        return True
+    return firma_archivo(ruta)["sha256"] == guardada.get("sha256")
+
+
+def cache_vigente(ruta_csv=RUTA_CSV, directorio_cache=DIRECTORIO_CACHE):
+    """
+    Verificar si el Parquet en caché corresponde al CSV fuente actual
+    """
+    return depurado_vigente(ruta_csv, ruta_parquet(ruta_csv, directorio_cache))
+
+
+def construir_cache(ruta_csv=RUTA_CSV, directorio_cache=DIRECTORIO_CACHE):
+    """
+    Convertir el CSV en un Parquet tipado (categorías y códigos DANE enteros) con las marcas de calidad
+    """
+    with tramo("etl_ingesta_csv"):
+        return convertir_depurado(ruta_csv, ruta_parquet(ruta_csv, directorio_cache))
+
+
+def cargar_despachos_por_bloques(ruta_csv=RUTA_CSV, columnas=None, tamano_bloque=TAMANO_BLOQUE, directorio_cache=DIRECTORIO_CACHE):
+    """
+    Recorrer por bloques los despachos del Parquet en caché, regenerándolo si el CSV cambió.
+    Si se indican columnas, solo se leen esas.
+    """
+    if not cache_vigente(ruta_csv, directorio_cache):
+        construir_cache(ruta_csv, directorio_cache)
+    yield from leer_por_bloques(ruta_parquet(ruta_csv, directorio_cache), columnas, tamano_bloque)
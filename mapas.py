@@ -0,0 +1,268 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import folium
+import plotly.graph_objects as go
+
+_registro = logging.getLogger(__name__)
+
+CENTRO_COLOMBIA = [4.5709, -74.2973]
+
+# Rangos de cantidad de despachos para colorear las líneas entre municipios
+LIMITES_DESPACHOS = [100, 1000, 10000, 30000]
+COLORES_DESPACHOS = ["blue", "green", "orange", "red", "gray"]
+
+LEYENDA_MUNICIPIOS = """
+<div style="
+    position: fixed;
+    bottom: 50px; left: 50px; width: 200px; height: 90px;
+    background-color: white; z-index:9999;
+    padding: 10px; font-size:14px; border-radius:5px;
+    box-shadow: 2px 2px 5px rgba(0,0,0,0.3);
+">
+    <b>Leyenda</b> <br>
+    <i style="background:blue; width:10px; height:10px; display:inline-block;"></i> Municipios Proveedores<br>
+    <i style="background:red; width:10px; height:10px; display:inline-block;"></i> Municipios Destino
+</div>
+"""
+
+LEYENDA_DESPACHOS = """
+<div style="
+    position: fixed;
+    bottom: 50px;
+    left: 50px;
+    width: 220px;
+    background-color: white;
+    z-index:9999;
+    padding: 10px;
+    border-radius: 5px;
+    font-size: 14px;
+    opacity: 0.9;
+">
+    <b>Rango de Despachos</b><br>
+    <i style="background:blue; width: 10px; height: 10px; display: inline-block;"></i> 0 - 100 <br>
+    <i style="background:green; width: 10px; height: 10px; display: inline-block;"></i> 100 - 1,000 <br>
+    <i style="background:orange; width: 10px; height: 10px; display: inline-block;"></i> 1,000 - 10,000 <br>
+    <i style="background:red; width: 10px; height: 10px; display: inline-block;"></i> 10,000 - 30,000 <br>
+</div>
+"""
+
+
+def color_despachos(cantidad):
+    """
+    Color de cada cantidad de despachos según LIMITES_DESPACHOS (gris por encima del último)
+    """
+    return np.asarray(COLORES_DESPACHOS)[np.digitize(cantidad, LIMITES_DESPACHOS)]
+
+
+def capa_poligonos(gdf, columna_nombre, etiqueta, color):
+    """
+    Una sola capa GeoJSON con los polígonos de todos los municipios; el tooltip sale de las propiedades
+    """
+    gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+    return folium.GeoJson(
+        gdf[[columna_nombre, gdf.geometry.name]],
+        name=etiqueta,
+        style_function=lambda x: {"color": color, "fillColor": color, "fillOpacity": 0.5},
+        tooltip=folium.GeoJsonTooltip(fields=[columna_nombre], aliases=[f"{etiqueta}:"]),
+    )
+
+
+def capa_puntos(centroides, etiqueta, color):
+    """
+    Una sola capa GeoJSON con un marcador circular en el centroide de cada municipio
+    """
+    caracteristicas = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"nombre": nombre},
+        }
+        for nombre, lat, lon in centroides[["MUNICIPIO", "lat", "lon"]].itertuples(index=False)
+    ]
+    return folium.GeoJson(
+        {"type": "FeatureCollection", "features": caracteristicas},
+        name=f"Centroides {etiqueta}",
+        marker=folium.CircleMarker(radius=5, color=color, fill=True, fill_color=color, fill_opacity=0.6),
+        tooltip=folium.GeoJsonTooltip(fields=["nombre"], aliases=[f"{etiqueta}:"]),
+    )
+
+
+def coordenadas_flujos(flujos, centroides):
+    """
+    Coordenadas (lat, lon) de origen y destino de cada flujo; se descartan los flujos sin coordenadas
+    """
+    coordenadas = centroides.set_index("CODIGO_MUNICIPIO_DANE")[["lat", "lon"]]
+    origen = coordenadas.reindex(flujos["CODIGO_MUNICIPIO_DANE_PROVEEDOR"]).to_numpy()
+    destino = coordenadas.reindex(flujos["CODIGO_MUNICIPIO_DANE_DESTINO"]).to_numpy()
+    validos = ~(np.isnan(origen).any(axis=1) | np.isnan(destino).any(axis=1))
+    if not validos.all():
+        faltantes = flujos.loc[~validos, ["MUNICIPIO_PROVEEDOR", "MUNICIPIO"]].itertuples(index=False)
+        _registro.warning("Coordenadas faltantes para %d flujos: %s", (~validos).sum(), ", ".join(f"{o} → {d}" for o, d in faltantes))
+    return flujos[validos], origen[validos], destino[validos]
+
+
+def texto_flujos(flujos):
+    return (
+        flujos["MUNICIPIO_PROVEEDOR"].astype(str) + " → " + flujos["MUNICIPIO"].astype(str) + ": "
+        + flujos["CANTIDAD_DESPACHOS"].astype(str) + " despachos"
+    )
+
+
+def capa_flujos(flujos, centroides):
+    """
+    Una sola capa GeoJSON con una línea por par proveedor-destino, coloreada por cantidad de despachos
+    """
+    flujos, origen, destino = coordenadas_flujos(flujos, centroides)
+    colores = color_despachos(flujos["CANTIDAD_DESPACHOS"].to_numpy())
+    textos = texto_flujos(flujos)
+    caracteristicas = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": [[lon_o, lat_o], [lon_d, lat_d]]},
+            "properties": {"color": color, "texto": texto},
+        }
+        for (lat_o, lon_o), (lat_d, lon_d), color, texto in zip(origen.tolist(), destino.tolist(), colores, textos)
+    ]
+    return folium.GeoJson(
+        {"type": "FeatureCollection", "features": caracteristicas},
+        name="Despachos",
+        style_function=lambda x: {"color": x["properties"]["color"], "weight": 3, "opacity": 0.6},
+        tooltip=folium.GeoJsonTooltip(fields=["texto"], labels=False),
+    )
+
+
+def centroides(gdf, columna_nombre="MUNICIPIO"):
+    """
+    Latitud y longitud del centroide de cada municipio (precalculados en geometria.py)
+    """
+    return pd.DataFrame({
+        "CODIGO_MUNICIPIO_DANE": gdf["CODIGO_MUNICIPIO_DANE"].to_numpy(),
+        "MUNICIPIO": gdf[columna_nombre].to_numpy(),
+        "lat": gdf["lat"].to_numpy(),
+        "lon": gdf["lon"].to_numpy(),
+    })
+
+
+def mapa_municipios(gdf_proveedores, gdf_destinos):
+    """
+    Mapa con los municipios proveedores y destino
+    """
+    m = folium.Map(location=CENTRO_COLOMBIA, zoom_start=6)
+    capa_poligonos(gdf_proveedores, "MUNICIPIO_PROVEEDOR", "Proveedor", "#57B4BA").add_to(m)
+    capa_poligonos(gdf_destinos, "MUNICIPIO", "Destino", "#FE4F2D").add_to(m)
+    m.get_root().html.add_child(folium.Element(LEYENDA_MUNICIPIOS))
+    return m
+
+
+def mapa_relaciones(centroides_proveedores, centroides_destinos, flujos):
+    """
+    Mapa de los despachos entre municipios proveedores y destino
+    """
+    grafo = folium.Map(location=CENTRO_COLOMBIA, zoom_start=6)
+    todos = pd.concat([centroides_proveedores, centroides_destinos]).drop_duplicates("CODIGO_MUNICIPIO_DANE")
+    capa_flujos(flujos, todos).add_to(grafo)
+    capa_puntos(centroides_proveedores, "Proveedor", "blue").add_to(grafo)
+    capa_puntos(centroides_destinos, "Destino", "red").add_to(grafo)
+    grafo.get_root().html.add_child(folium.Element(LEYENDA_DESPACHOS))
+    return grafo
+
+
+# Mapas con Plotly: la geometría se sirve una sola vez como archivo estático (que el navegador
+# guarda en caché) y las figuras solo llevan códigos DANE y coordenadas
+DISENO_MAPA = dict(
+    map=dict(style="open-street-map", center=dict(lat=CENTRO_COLOMBIA[0], lon=CENTRO_COLOMBIA[1]), zoom=5),
+    margin=dict(l=0, r=0, t=0, b=0),
+    height=600,
+    legend=dict(x=0.01, y=0.01, bgcolor="rgba(255,255,255,0.8)"),
+)
+
+
+def geojson_municipios(gdf):
+    """
+    GeoJSON de los municipios con el código DANE (texto) y el nombre como propiedades
+    """
+    capa = gdf[["CODIGO_MUNICIPIO_DANE", gdf.geometry.name]].copy()
+    capa["CODIGO_MUNICIPIO_DANE"] = capa["CODIGO_MUNICIPIO_DANE"].astype(str)
+    return capa.to_json(drop_id=True)
+
+
+def traza_municipios(codigos, nombres, url_geojson, etiqueta, color):
+    return go.Choroplethmap(
+        geojson=url_geojson,
+        featureidkey="properties.CODIGO_MUNICIPIO_DANE",
+        locations=[str(codigo) for codigo in codigos],
+        z=np.ones(len(codigos)),
+        colorscale=[[0, color], [1, color]],
+        showscale=False,
+        marker_opacity=0.5,
+        text=nombres,
+        hovertemplate=f"{etiqueta}: %{{text}}<extra></extra>",
+        name=f"Municipios {etiqueta}",
+        showlegend=True,
+    )
+
+
+def figura_municipios(centroides_municipios, codigos_proveedores, codigos_destinos, url_geojson):
+    """
+    Mapa (Plotly) con los municipios proveedores y destino
+    """
+    nombres = centroides_municipios.set_index("CODIGO_MUNICIPIO_DANE")["MUNICIPIO"]
+    fig = go.Figure()
+    fig.add_trace(traza_municipios(codigos_proveedores, nombres.reindex(codigos_proveedores).tolist(), url_geojson, "Proveedor", "#57B4BA"))
+    fig.add_trace(traza_municipios(codigos_destinos, nombres.reindex(codigos_destinos).tolist(), url_geojson, "Destino", "#FE4F2D"))
+    fig.update_layout(**DISENO_MAPA)
+    return fig
+
+
+def figura_relaciones(centroides_municipios, flujos):
+    """
+    Mapa (Plotly) de los despachos entre municipios: una traza de líneas por rango de despachos,
+    con los segmentos separados por huecos, y los centroides de proveedores y destinos
+    """
+    flujos, origen, destino = coordenadas_flujos(flujos, centroides_municipios)
+    colores = color_despachos(flujos["CANTIDAD_DESPACHOS"].to_numpy())
+    etiquetas = ["0 - 100", "100 - 1,000", "1,000 - 10,000", "10,000 - 30,000", "30,000 o más"]
+    hueco = np.full(len(flujos), np.nan)
+
+    fig = go.Figure()
+    for color, etiqueta in zip(COLORES_DESPACHOS, etiquetas):
+        rango = colores == color
+        if not rango.any():
+            continue
+        fig.add_trace(go.Scattermap(
+            lat=np.column_stack([origen[rango, 0], destino[rango, 0], hueco[rango]]).ravel(),
+            lon=np.column_stack([origen[rango, 1], destino[rango, 1], hueco[rango]]).ravel(),
+            mode="lines",
+            line=dict(color=color, width=3),
+            opacity=0.6,
+            hoverinfo="skip",
+            name=etiqueta,
+        ))
+    # Puntos medios invisibles para mostrar el detalle de cada línea
+    fig.add_trace(go.Scattermap(
+        lat=(origen[:, 0] + destino[:, 0]) / 2,
+        lon=(origen[:, 1] + destino[:, 1]) / 2,
+        mode="markers",
+        marker=dict(size=8, opacity=0),
+        text=texto_flujos(flujos),
+        hovertemplate="%{text}<extra></extra>",
+        showlegend=False,
+    ))
+    for columna, etiqueta, color in [
+        ("CODIGO_MUNICIPIO_DANE_PROVEEDOR", "Proveedor", "blue"),
+        ("CODIGO_MUNICIPIO_DANE_DESTINO", "Destino", "red"),
+    ]:
+        puntos = centroides_municipios[centroides_municipios["CODIGO_MUNICIPIO_DANE"].isin(flujos[columna])]
+        fig.add_trace(go.Scattermap(
+            lat=puntos["lat"],
+            lon=puntos["lon"],
+            mode="markers",
+            marker=dict(size=10, color=color, opacity=0.6),
+            text=puntos["MUNICIPIO"],
+            hovertemplate=f"{etiqueta}: %{{text}}<extra></extra>",
+            name=f"Municipios {etiqueta}",
+        ))
+    fig.update_layout(legend_title="Rango de Despachos", **DISENO_MAPA)
+    return fig
@@ -0,0 +1,66 @@
+import os
+import resource
+import sys
+import threading
+import time
+
+
+def rss_actual():
+    """
+    Memoria residente del proceso en bytes (en sistemas sin /proc, el máximo alcanzado)
+    """
+    try:
+        with open("/proc/self/statm") as archivo:
+            return int(archivo.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (FileNotFoundError, ValueError):
+        maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maximo if sys.platform == "darwin" else maximo * 1024
+
+
+class Medicion:
+    """
+    Medir un bloque de código: tiempo de pared, tiempo de CPU y memoria residente
+    (inicial, final y pico, muestreada en un hilo cada `intervalo` segundos). La memoria del
+    proceso incluye lo que dejaron las etapas anteriores; `rss_incremento` es lo que añadió esta.
+
+        with Medicion("cubo") as medicion:
+            ...
+        medicion.resultado
+    """
+
+    def __init__(self, nombre, intervalo=0.01):
+        self.nombre = nombre
+        self.intervalo = intervalo
+        self.resultado = None
+        self._pico = 0
+        self._detener = threading.Event()
+
+    def _muestrear(self):
+        while not self._detener.wait(self.intervalo):
+            self._pico = max(self._pico, rss_actual())
+
+    def __enter__(self):
+        self._rss_inicial = self._pico = rss_actual()
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+        self._hilo.start()
+        self._cpu = time.process_time()
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excepcion):
+        segundos = time.perf_counter() - self._inicio
+        cpu = time.process_time() - self._cpu
+        self._detener.set()
+        self._hilo.join()
+        rss_final = rss_actual()
+        rss_pico = max(self._pico, rss_final)
+        self.resultado = {
+            "etapa": self.nombre,
+            "segundos": segundos,
+            "cpu": cpu,
+            "rss_inicial": self._rss_inicial,
+            "rss_final": rss_final,
+            "rss_pico": rss_pico,
+            "rss_incremento": rss_pico - self._rss_inicial,
+        }
+        return False
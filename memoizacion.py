@@ -0,0 +1,206 @@
+import functools
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+def normalizar(valor):
+    """
+    Convertir parámetros de filtro en una forma canónica y hashable:
+    listas vacías equivalen a None y el orden de las selecciones no importa
+    """
+    if isinstance(valor, dict):
+        return tuple(sorted((clave, normalizar(v)) for clave, v in valor.items()))
+    if isinstance(valor, (list, tuple, set, frozenset)):
+        if not valor:
+            return None
+        return tuple(sorted((normalizar(v) for v in valor), key=repr))
+    if hasattr(valor, "item"):
+        return valor.item()
+    return valor
+
+
+class CacheLRU:
+    """
+    Caché en memoria del proceso con número máximo de entradas, expulsión LRU y TTL
+    """
+
+    def __init__(self, max_entradas=256, ttl=None):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._candado = threading.Lock()
+
+    def obtener(self, clave):
+        with self._candado:
+            if clave not in self._datos:
+                return False, None
+            creado, valor = self._datos[clave]
+            if self.ttl is not None and time.time() - creado > self.ttl:
+                del self._datos[clave]
+                return False, None
+            self._datos.move_to_end(clave)
+            return True, valor
+
+    def guardar(self, clave, valor):
+        with self._candado:
+            self._datos[clave] = (time.time(), valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def __len__(self):
+        return len(self._datos)
+
+
+class CacheArchivos:
+    """
+    Caché compartida entre procesos (p. ej. workers de gunicorn) en un directorio.
+    La fecha de modificación de cada archivo sirve de marca LRU y de TTL.
+    """
+
+    def __init__(self, directorio, max_entradas=1024, ttl=None):
+        self.directorio = directorio
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        os.makedirs(directorio, exist_ok=True)
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, hashlib.sha256(repr(clave).encode()).hexdigest() + ".pkl")
+
+    def obtener(self, clave):
+        ruta = self._ruta(clave)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(ruta) > self.ttl:
+                os.remove(ruta)
+                return False, None
+            with open(ruta, "rb") as archivo:
+                valor = pickle.load(archivo)
+            os.utime(ruta)
+            return True, valor
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return False, None
+
+    def guardar(self, clave, valor):
+        ruta = self._ruta(clave)
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, "wb") as archivo:
+            pickle.dump(valor, archivo, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporal, ruta)
+        self._expulsar()
+
+    def _expulsar(self):
+        with os.scandir(self.directorio) as entradas:
+            archivos = [e for e in entradas if e.name.endswith(".pkl")]
+        if len(archivos) <= self.max_entradas:
+            return
+        archivos.sort(key=lambda e: e.stat().st_mtime)
+        for entrada in archivos[:len(archivos) - self.max_entradas]:
+            try:
+                os.remove(entrada.path)
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return sum(1 for nombre in os.listdir(self.directorio) if nombre.endswith(".pkl"))
+
+
+class CacheRedis:
+    """
+    Caché compartida en un servidor Redis local; la expulsión LRU la hace Redis
+    (maxmemory-policy allkeys-lru) y el TTL se fija por clave. La URL debe apuntar a una
+    base de datos dedicada (p. ej. redis://localhost:6379/1): su tamaño es el de la caché.
+    """
+
+    def __init__(self, url, ttl=None, prefijo="mineria:"):
+        if redis is None:
+            raise ImportError("Se requiere el paquete redis para usar CacheRedis")
+        self.cliente = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefijo = prefijo
+
+    def _clave(self, clave):
+        return self.prefijo + hashlib.sha256(repr(clave).encode()).hexdigest()
+
+    def obtener(self, clave):
+        valor = self.cliente.get(self._clave(clave))
+        if valor is None:
+            return False, None
+        return True, pickle.loads(valor)
+
+    def guardar(self, clave, valor):
+        self.cliente.set(self._clave(clave), pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL), ex=self.ttl)
+
+    def __len__(self):
+        # DBSIZE es O(1), a diferencia de recorrer las claves con el prefijo
+        return self.cliente.dbsize()
+
+
+def crear_cache(backend=None, max_entradas=None, ttl=None, directorio=None):
+    """
+    Crear la caché según la configuración (o las variables de entorno CACHE_*):
+    "memoria", "archivos" o una URL redis://
+    """
+    backend = backend or os.environ.get("CACHE_BACKEND", "memoria")
+    max_entradas = max_entradas or int(os.environ.get("CACHE_MAX_ENTRADAS", 256))
+    ttl = ttl or (float(os.environ["CACHE_TTL"]) if os.environ.get("CACHE_TTL") else None)
+    if backend == "archivos":
+        return CacheArchivos(directorio or os.environ.get("CACHE_DIRECTORIO", os.path.join("cache", "figuras")), max_entradas, ttl)
+    if backend.startswith("redis://"):
+        return CacheRedis(backend, ttl)
+    return CacheLRU(max_entradas, ttl)
+
+
+class Memoizador:
+    """
+    Decorador que guarda en la caché el resultado de cada constructor de figuras,
+    usando como clave el nombre de la función, los parámetros normalizados y la versión de los datos
+    """
+
+    def __init__(self, cache, version):
+        self.cache = cache
+        self.version = version
+        self.contadores = {}
+        # Con gunicorn (threads > 1) varias solicitudes del mismo worker actualizan los contadores a la vez
+        self._candado = threading.Lock()
+
+    def __call__(self, funcion):
+        nombre = funcion.__qualname__
+        with self._candado:
+            contador = self.contadores.setdefault(nombre, {"aciertos": 0, "fallos": 0})
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            clave = (nombre, self.version, tuple(normalizar(a) for a in args), normalizar(kwargs))
+            encontrado, valor = self.cache.obtener(clave)
+            with self._candado:
+                contador["aciertos" if encontrado else "fallos"] += 1
+            if encontrado:
+                return valor
+            valor = funcion(*args, **kwargs)
+            self.cache.guardar(clave, valor)
+            return valor
+
+        return envoltura
+
+    def estadisticas(self):
+        """
+        Aciertos y fallos por función, y tamaño actual de la caché
+        """
+        with self._candado:
+            funciones = {nombre: dict(contador) for nombre, contador in self.contadores.items()}
+        return {
+            "backend": type(self.cache).__name__,
+            "version": self.version,
+            "entradas": len(self.cache),
+            "pid": os.getpid(),
+            "funciones": funciones,
+        }
@@ -0,0 +1,219 @@
+import cProfile
+import contextlib
+import functools
+import os
+import re
+import threading
+import time
+
+from medicion import rss_actual
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+PREFIJO = "sicom"
+# Límites (en segundos) de las cubetas del histograma de duraciones
+CUBETAS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DIRECTORIO_PERFILES = os.path.join("cache", "perfiles")
+
+
+class Registro:
+    """
+    Duración, tiempo de CPU y memoria residente de los tramos medidos en el proceso, acumulados por nombre.
+    Con gunicorn cada worker tiene su propio registro; los tramos del arranque (--preload) se heredan del maestro.
+    """
+
+    def __init__(self, cubetas=CUBETAS):
+        self.cubetas = cubetas
+        self._tramos = {}
+        self._candado = threading.Lock()
+
+    def iniciar(self):
+        return time.perf_counter(), time.process_time(), rss_actual()
+
+    def terminar(self, nombre, inicio):
+        """
+        Registrar un tramo empezado con iniciar(); para cuando el inicio y el fin están en funciones distintas
+        """
+        segundos = time.perf_counter() - inicio[0]
+        cpu = time.process_time() - inicio[1]
+        rss = rss_actual()
+        with self._candado:
+            tramo = self._tramos.setdefault(nombre, {
+                "conteo": 0,
+                "segundos": 0.0,
+                "cpu": 0.0,
+                "cubetas": [0] * len(self.cubetas),
+                "rss": 0,
+                "incremento_maximo": 0,
+            })
+            tramo["conteo"] += 1
+            tramo["segundos"] += segundos
+            tramo["cpu"] += cpu
+            for i, limite in enumerate(self.cubetas):
+                if segundos <= limite:
+                    tramo["cubetas"][i] += 1
+            tramo["rss"] = rss
+            tramo["incremento_maximo"] = max(tramo["incremento_maximo"], rss - inicio[2])
+        return segundos
+
+    @contextlib.contextmanager
+    def tramo(self, nombre):
+        inicio = self.iniciar()
+        try:
+            yield
+        finally:
+            self.terminar(nombre, inicio)
+
+    def resumen(self, prefijo=""):
+        """
+        Copia de los tramos registrados (solo los que empiezan por el prefijo)
+        """
+        with self._candado:
+            return {
+                nombre: {**tramo, "cubetas": list(tramo["cubetas"])}
+                for nombre, tramo in self._tramos.items() if nombre.startswith(prefijo)
+            }
+
+
+REGISTRO = Registro()
+tramo = REGISTRO.tramo
+
+
+def medida(nombre=None):
+    """
+    Decorador que registra cada llamada de la función como un tramo (por defecto, con su nombre)
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with tramo(nombre or funcion.__name__):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(**etiquetas):
+    texto = ",".join(f'{clave}="{_escapar(valor)}"' for clave, valor in etiquetas.items())
+    return "{" + texto + "}" if texto else ""
+
+
+def exponer(registro=REGISTRO, etapas_etl=None, cache=None):
+    """
+    Métricas en el formato de texto de Prometheus: histogramas de los tramos, memoria del proceso,
+    duración de las etapas del último ETL (del manifiesto de los artefactos) y aciertos de la caché
+    """
+    lineas = []
+
+    def familia(nombre, tipo, ayuda):
+        lineas.append(f"# HELP {PREFIJO}_{nombre} {ayuda}")
+        lineas.append(f"# TYPE {PREFIJO}_{nombre} {tipo}")
+
+    def muestra(nombre, valor, **etiquetas):
+        lineas.append(f"{PREFIJO}_{nombre}{_etiquetas(**etiquetas)} {valor}")
+
+    tramos = registro.resumen()
+    familia("tramo_segundos", "histogram", "Duración de cada tramo medido")
+    for nombre, datos in tramos.items():
+        for limite, conteo in zip(registro.cubetas, datos["cubetas"]):
+            muestra("tramo_segundos_bucket", conteo, tramo=nombre, le=limite)
+        muestra("tramo_segundos_bucket", datos["conteo"], tramo=nombre, le="+Inf")
+        muestra("tramo_segundos_sum", datos["segundos"], tramo=nombre)
+        muestra("tramo_segundos_count", datos["conteo"], tramo=nombre)
+    familia("tramo_cpu_segundos_total", "counter", "Tiempo de CPU del proceso durante cada tramo")
+    for nombre, datos in tramos.items():
+        muestra("tramo_cpu_segundos_total", datos["cpu"], tramo=nombre)
+    familia("tramo_rss_bytes", "gauge", "Memoria residente al terminar la última ejecución del tramo")
+    for nombre, datos in tramos.items():
+        muestra("tramo_rss_bytes", datos["rss"], tramo=nombre)
+    familia("tramo_rss_incremento_maximo_bytes", "gauge", "Mayor aumento de memoria residente durante el tramo")
+    for nombre, datos in tramos.items():
+        muestra("tramo_rss_incremento_maximo_bytes", datos["incremento_maximo"], tramo=nombre)
+
+    familia("proceso_rss_bytes", "gauge", "Memoria residente del proceso")
+    muestra("proceso_rss_bytes", rss_actual(), pid=os.getpid())
+    familia("proceso_cpu_segundos_total", "counter", "Tiempo de CPU del proceso")
+    muestra("proceso_cpu_segundos_total", time.process_time(), pid=os.getpid())
+
+    if etapas_etl:
+        familia("etl_etapa_segundos", "gauge", "Duración de cada etapa del ETL que construyó los artefactos")
+        for nombre, datos in etapas_etl.items():
+            muestra("etl_etapa_segundos", datos["segundos"], etapa=nombre)
+        familia("etl_etapa_rss_incremento_bytes", "gauge", "Aumento de memoria residente durante cada etapa del ETL")
+        for nombre, datos in etapas_etl.items():
+            muestra("etl_etapa_rss_incremento_bytes", datos["incremento_maximo"], etapa=nombre)
+
+    if cache:
+        familia("cache_aciertos_total", "counter", "Aciertos de la caché de figuras por función")
+        for funcion, contador in cache["funciones"].items():
+            muestra("cache_aciertos_total", contador["aciertos"], funcion=funcion)
+        familia("cache_fallos_total", "counter", "Fallos de la caché de figuras por función")
+        for funcion, contador in cache["funciones"].items():
+            muestra("cache_fallos_total", contador["fallos"], funcion=funcion)
+        familia("cache_entradas", "gauge", "Entradas en la caché de figuras")
+        muestra("cache_entradas", cache["entradas"], backend=cache["backend"])
+
+    return "\n".join(lineas) + "\n"
+
+
+class Perfilador:
+    """
+    Perfilar una sola solicitud: armar() marca la siguiente y su perfil se guarda en `directorio`,
+    con pyinstrument (HTML) si está instalado y se pide, o con cProfile (.prof, legible con pstats o snakeviz)
+    """
+
+    def __init__(self, directorio=DIRECTORIO_PERFILES, herramienta="cprofile"):
+        self.directorio = directorio
+        self.herramienta = "pyinstrument" if herramienta == "pyinstrument" and pyinstrument is not None else "cprofile"
+        self._armado = False
+        self._activo = False
+        self._candado = threading.Lock()
+
+    def armar(self):
+        with self._candado:
+            self._armado = True
+
+    def iniciar(self, forzar=False):
+        """
+        Empezar a perfilar si se pidió (armado o forzado) y no hay otro perfil en curso; None en otro caso
+        """
+        with self._candado:
+            if not (self._armado or forzar) or self._activo:
+                return None
+            self._armado = self._armado and forzar
+            self._activo = True
+        if self.herramienta == "pyinstrument":
+            perfil = pyinstrument.Profiler()
+            perfil.start()
+        else:
+            perfil = cProfile.Profile()
+            perfil.enable()
+        return perfil
+
+    def terminar(self, perfil, nombre):
+        """
+        Detener el perfil y guardarlo; devuelve la ruta del archivo
+        """
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            nombre = re.sub(r"[^\w.-]+", "_", nombre).strip("_")[:80]
+            base = os.path.join(self.directorio, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{nombre}")
+            if self.herramienta == "pyinstrument":
+                perfil.stop()
+                ruta = base + ".html"
+                with open(ruta, "w", encoding="utf-8") as archivo:
+                    archivo.write(perfil.output_html())
+            else:
+                perfil.disable()
+                ruta = base + ".prof"
+                perfil.dump_stats(ruta)
+            return ruta
+        finally:
+            with self._candado:
+                self._activo = False
@@ -0,0 +1,93 @@
+import math
+import operator
+import re
+
+# Operadores que genera el filtro nativo de dash_table (filter_query)
+OPERADORES = {
+    "eq": operator.eq, "=": operator.eq,
+    "ne": operator.ne, "!=": operator.ne,
+    "lt": operator.lt, "<": operator.lt,
+    "le": operator.le, "<=": operator.le,
+    "gt": operator.gt, ">": operator.gt,
+    "ge": operator.ge, ">=": operator.ge,
+}
+_CONDICION = re.compile(
+    r"^\{(?P<columna>[^}]+)\}\s+(?P<sensible>[si]?)(?P<operador>contains|datestartswith|eq|ne|lt|le|gt|ge|!=|<=|>=|=|<|>)\s+(?P<valor>.+)$"
+)
+
+
+def _valor(texto):
+    texto = texto.strip()
+    if len(texto) >= 2 and texto[0] == texto[-1] and texto[0] in "\"'`":
+        return texto[1:-1]
+    try:
+        return float(texto)
+    except ValueError:
+        return texto
+
+
+def separar_filtro(filter_query):
+    """
+    Separar el filter_query de dash_table en condiciones (columna, operador, valor, sensible a mayúsculas)
+    """
+    condiciones = []
+    for parte in (filter_query or "").split(" && "):
+        coincidencia = _CONDICION.match(parte.strip())
+        if coincidencia:
+            condiciones.append((
+                coincidencia["columna"],
+                coincidencia["operador"],
+                _valor(coincidencia["valor"]),
+                coincidencia["sensible"] != "i",
+            ))
+    return condiciones
+
+
+def aplicar_filtro(tabla, filter_query):
+    """
+    Filtrar la tabla numérica con las condiciones escritas en la tabla del navegador
+    """
+    for columna, operador, valor, sensible in separar_filtro(filter_query):
+        if columna not in tabla.columns:
+            continue
+        serie = tabla[columna]
+        if operador in ("contains", "datestartswith"):
+            texto = serie.astype(str)
+            if operador == "contains":
+                mascara = texto.str.contains(str(valor), case=sensible, regex=False)
+            else:
+                mascara = texto.str.startswith(str(valor))
+        elif serie.dtype.kind in "biuf" and isinstance(valor, float):
+            mascara = OPERADORES[operador](serie, valor)
+        else:
+            texto, valor = serie.astype(str), str(valor)
+            if not sensible:
+                texto, valor = texto.str.lower(), valor.lower()
+            mascara = OPERADORES[operador](texto, valor)
+        tabla = tabla[mascara]
+    return tabla
+
+
+def ordenar(tabla, sort_by):
+    """
+    Ordenar por las columnas indicadas en sort_by (orden numérico, no lexicográfico)
+    """
+    sort_by = [s for s in (sort_by or []) if s["column_id"] in tabla.columns]
+    if not sort_by:
+        return tabla
+    return tabla.sort_values(
+        [s["column_id"] for s in sort_by],
+        ascending=[s["direction"] == "asc" for s in sort_by],
+        kind="stable",
+    )
+
+
+def consultar(tabla, page_current, page_size, sort_by=None, filter_query=None):
+    """
+    Filtrar, ordenar y devolver solo la página visible junto con la página actual y el número de páginas
+    """
+    tabla = ordenar(aplicar_filtro(tabla, filter_query), sort_by)
+    paginas = max(1, math.ceil(len(tabla) / page_size))
+    pagina = min(page_current or 0, paginas - 1)
+    visible = tabla.iloc[pagina * page_size:(pagina + 1) * page_size]
+    return visible.to_dict("records"), pagina, paginas
@@ -0,0 +1,163 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Cada serie es una combinación de estas dimensiones; el tiempo va en el eje denso (un valor por día)
+DIMENSIONES_SERIE = ["PRODUCTO", "TIPO_COMPRADOR", "DEPARTAMENTO_PROVEEDOR", "DEPARTAMENTO"]
+MEDIDAS_SERIE = ["CANTIDAD", "VOLUMEN"]
+COLUMNAS_SERIE = ["ANIO_DESPACHO", "MES_DESPACHO", "DIA_DESPACHO", *DIMENSIONES_SERIE, "VOLUMEN_DESPACHADO", "CALIDAD"]
+
+# Frecuencias de remuestreo (alias de pandas; las semanas empiezan el lunes)
+FRECUENCIAS = {"dia": "D", "semana": "W-MON", "mes": "MS", "anio": "YS"}
+# Máximo de puntos por traza que se envían al navegador
+MAX_PUNTOS = 500
+
+_ARCHIVO_DATOS = "series.f8"
+_ARCHIVO_INDICE = "series.json"
+
+
+def agregar_dias(bloque):
+    """
+    Despachos y volumen de cada día y combinación de dimensiones del bloque
+    (los despachos sin fecha válida se descartan)
+    """
+    fecha = pd.to_datetime(pd.DataFrame({
+        "year": bloque["ANIO_DESPACHO"],
+        "month": bloque["MES_DESPACHO"],
+        "day": bloque["DIA_DESPACHO"],
+    }), errors="coerce")
+    dias = pd.DataFrame({"FECHA": fecha.to_numpy().astype("datetime64[D]")})
+    for dimension in DIMENSIONES_SERIE:
+        dias[dimension] = bloque[dimension].astype(str).to_numpy()
+    dias["VOLUMEN"] = bloque["VOLUMEN_DESPACHADO"].to_numpy()
+    dias = dias[fecha.notna().to_numpy()]
+    return dias.groupby(["FECHA", *DIMENSIONES_SERIE]).agg(
+        CANTIDAD=("VOLUMEN", "size"),
+        VOLUMEN=("VOLUMEN", "sum"),
+    ).reset_index()
+
+
+def lttb(x, y, max_puntos=MAX_PUNTOS):
+    """
+    Índices de los puntos que conserva Largest-Triangle-Three-Buckets: el primero, el último y,
+    en cada tramo intermedio, el que forma el triángulo de mayor área con el punto elegido en el
+    tramo anterior y el promedio del siguiente. Mantiene picos y caídas con pocos puntos.
+    """
+    n = len(y)
+    if n <= max_puntos or max_puntos < 3:
+        return np.arange(n)
+    x, y = np.asarray(x, dtype="float64"), np.asarray(y, dtype="float64")
+    limites = np.linspace(1, n - 1, max_puntos - 1).astype(int)
+    indices = np.empty(max_puntos, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    anterior = 0
+    for i in range(max_puntos - 2):
+        inicio, fin = limites[i], limites[i + 1]
+        siguiente = slice(fin, limites[i + 2] if i + 2 < len(limites) else n)
+        x_medio, y_medio = x[siguiente].mean(), y[siguiente].mean()
+        areas = np.abs(
+            (x[anterior] - x_medio) * (y[inicio:fin] - y[anterior])
+            - (x[anterior] - x[inicio:fin]) * (y_medio - y[anterior])
+        )
+        anterior = inicio + int(np.argmax(areas))
+        indices[i + 1] = anterior
+    return indices
+
+
+def reducir(serie, max_puntos=MAX_PUNTOS):
+    """
+    Serie con a lo sumo max_puntos puntos, elegidos con LTTB
+    """
+    x = serie.index.to_numpy().astype("datetime64[D]").astype("int64")
+    return serie.iloc[lttb(x, serie.to_numpy(), max_puntos)]
+
+
+class SeriesDespachos:
+    """
+    Series diarias densas de despachos: `datos` tiene forma (medidas, series, días), con un día
+    por posición desde `inicio`, y `claves` dice a qué combinación de dimensiones corresponde cada serie.
+    Una ventana de fechas es un corte del arreglo y remuestrear es sumar días consecutivos.
+    """
+
+    def __init__(self, inicio, claves, datos):
+        self.inicio = np.datetime64(inicio, "D")
+        self.claves = claves.reset_index(drop=True)
+        self.datos = datos
+
+    @classmethod
+    def desde_bloques(cls, bloques):
+        """
+        Construir las series recorriendo los despachos por bloques (solo se acumulan los días con despachos)
+        """
+        acumulado = None
+        for bloque in bloques:
+            parcial = agregar_dias(bloque)
+            if acumulado is not None:
+                parcial = pd.concat([acumulado, parcial], ignore_index=True)
+                parcial = parcial.groupby(["FECHA", *DIMENSIONES_SERIE]).sum().reset_index()
+            acumulado = parcial
+        if acumulado is None or acumulado.empty:
+            return cls(np.datetime64("1970-01-01"), pd.DataFrame(columns=DIMENSIONES_SERIE), np.zeros((len(MEDIDAS_SERIE), 0, 0)))
+
+        inicio, fin = acumulado["FECHA"].min(), acumulado["FECHA"].max()
+        series, claves = pd.MultiIndex.from_frame(acumulado[DIMENSIONES_SERIE]).factorize(sort=True)
+        dias = (acumulado["FECHA"] - inicio).dt.days.to_numpy()
+        datos = np.zeros((len(MEDIDAS_SERIE), len(claves), (fin - inicio).days + 1), dtype="float64")
+        for i, medida in enumerate(MEDIDAS_SERIE):
+            datos[i, series, dias] = acumulado[medida].to_numpy()
+        return cls(inicio, pd.DataFrame(list(claves), columns=DIMENSIONES_SERIE), datos)
+
+    def guardar(self, directorio):
+        self.datos.astype("float64").tofile(os.path.join(directorio, _ARCHIVO_DATOS))
+        with open(os.path.join(directorio, _ARCHIVO_INDICE), "w", encoding="utf-8") as archivo:
+            json.dump({
+                "inicio": str(self.inicio),
+                "forma": list(self.datos.shape),
+                "claves": self.claves.to_dict("list"),
+            }, archivo)
+
+    @classmethod
+    def abrir(cls, directorio):
+        """
+        Abrir las series guardadas con memoria mapeada
+        """
+        with open(os.path.join(directorio, _ARCHIVO_INDICE), encoding="utf-8") as archivo:
+            indice = json.load(archivo)
+        forma = tuple(indice["forma"])
+        if np.prod(forma) == 0:
+            datos = np.zeros(forma)
+        else:
+            datos = np.memmap(os.path.join(directorio, _ARCHIVO_DATOS), dtype="float64", mode="r", shape=forma)
+        return cls(indice["inicio"], pd.DataFrame(indice["claves"], columns=DIMENSIONES_SERIE), datos)
+
+    def serie(self, medida="CANTIDAD", frecuencia="mes", anios=None, productos=None, compradores=None,
+              departamentos_proveedor=None, departamentos_destino=None):
+        """
+        Suma de las series que cumplen los filtros, en la ventana de años dada y remuestreada a la
+        frecuencia pedida (dia, semana, mes o anio). Los periodos sin despachos valen 0.
+        """
+        seleccion = np.ones(len(self.claves), dtype=bool)
+        for dimension, valores in [
+            ("PRODUCTO", productos),
+            ("TIPO_COMPRADOR", compradores),
+            ("DEPARTAMENTO_PROVEEDOR", departamentos_proveedor),
+            ("DEPARTAMENTO", departamentos_destino),
+        ]:
+            if valores:
+                seleccion &= self.claves[dimension].isin(valores).to_numpy()
+
+        n_dias = self.datos.shape[2]
+        desde, hasta = 0, n_dias
+        if anios is not None:
+            desde = max(int((np.datetime64(f"{anios[0]}-01-01") - self.inicio).astype(int)), 0)
+            hasta = min(int((np.datetime64(f"{anios[1] + 1}-01-01") - self.inicio).astype(int)), n_dias)
+        hasta = max(hasta, desde)
+
+        valores = self.datos[MEDIDAS_SERIE.index(medida), np.flatnonzero(seleccion), desde:hasta].sum(axis=0)
+        fechas = pd.date_range(self.inicio + np.timedelta64(desde, "D"), periods=hasta - desde, freq="D")
+        diaria = pd.Series(valores, index=fechas, name=medida)
+        if frecuencia == "dia":
+            return diaria
+        return diaria.resample(FRECUENCIAS[frecuencia], label="left", closed="left").sum()